@@ -0,0 +1,418 @@
+# ABOUTME: Local stand-in for the SFR Box web interface, for tests and load benchmarks.
+# ABOUTME: Implements the challenge/HMAC login, the /network/nat table and its action_* forms.
+
+import argparse
+import hashlib
+import hmac
+import html
+import re
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# The rules of the README's network, as a starting table
+SAMPLE_RULES = [
+    {"name": "ssh", "protocol": "TCP", "ext_ports": "22", "ip_address": "192.168.1.74", "dst_ports": "22", "enabled": False},
+    {"name": "futurmaton", "protocol": "TCP", "ext_ports": "1111", "ip_address": "192.168.1.74", "dst_ports": "1111", "enabled": True},
+    {"name": "comfyui", "protocol": "TCP", "ext_ports": "8188", "ip_address": "192.168.1.74", "dst_ports": "8188", "enabled": True},
+    {"name": "joker", "protocol": "TCP", "ext_ports": "3901", "ip_address": "192.168.1.74", "dst_ports": "3901", "enabled": True},
+    {"name": "ssh_the_beast", "protocol": "TCP", "ext_ports": "22022", "ip_address": "192.168.1.96", "dst_ports": "22", "enabled": True},
+    {"name": "slides", "protocol": "TCP", "ext_ports": "80", "ip_address": "192.168.1.74", "dst_ports": "80", "enabled": True},
+]
+
+_PROTOCOLS = {"tcp": "TCP", "udp": "UDP", "both": "Both"}
+
+_LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8" /><title>SFR Box - Login</title></head>
+<body>
+  <div id="content">
+    <form method="post" action="/login" id="form_auth_passwd">
+      <input type="hidden" name="method" value="passwd" />
+      <input type="hidden" name="page_ref" value="{page_ref}" />
+      <input type="hidden" name="zsid" value="" />
+      <input type="hidden" name="hash" value="" />
+      <input type="text" name="login" /><input type="password" name="password" />
+      <input type="submit" value="Login" />
+    </form>
+  </div>
+</body>
+</html>
+"""
+
+_NAT_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8" /><title>SFR Box - Network - NAT</title></head>
+<body>
+  <div id="content">
+    <h1>Network &raquo; NAT</h1>{error}
+    <form method="post" action="/network/nat" id="form_nat">
+      <input type="hidden" name="port_list_tcp" value="{port_list_tcp}" />
+      <input type="hidden" name="port_list_udp" value="{port_list_udp}" />
+      <table id="nat_config" class="responsive">
+        <thead>
+          <tr>
+            <th>#</th><th>Name</th><th>Protocol</th><th>Type</th><th>External ports</th>
+            <th>IP address</th><th>Destination ports</th><th>Activation</th><th></th>
+          </tr>
+        </thead>
+        <tbody>
+{rows}
+            <tr class="new">
+              <td data-title="#"></td>
+              <td data-title="Name"><input type="text" name="nat_rulename" maxlength="20" /></td>
+              <td data-title="Protocol"><select name="nat_proto"><option value="tcp">TCP</option><option value="udp">UDP</option><option value="both">Both</option></select></td>
+              <td data-title="Type"><select name="nat_range"><option value="false">Port</option><option value="true">Range</option></select></td>
+              <td data-title="External ports"><input type="text" name="nat_extport" maxlength="5" /></td>
+              <td data-title="IP address">192.168.1.<input type="text" name="nat_dstip_p3" maxlength="3" /></td>
+              <td data-title="Destination ports"><input type="text" name="nat_dstport" maxlength="5" /></td>
+              <td data-title="Activation"><input type="checkbox" name="nat_active" checked="checked" /></td>
+              <td><input type="submit" name="action_add" value="Add" /></td>
+            </tr>
+        </tbody>
+      </table>
+    </form>
+  </div>
+</body>
+</html>
+"""
+
+_NAT_ROW = """            <tr class="{state}">
+              <td data-title="#"><span class="col_number">{number}</span></td>
+              <td data-title="Name">{name}</td>
+              <td data-title="Protocol">{protocol}</td>
+              <td data-title="Type">Port</td>
+              <td data-title="External ports">{ext_ports}</td>
+              <td data-title="IP address">{ip_address}</td>
+              <td data-title="Destination ports">{dst_ports}</td>
+              <td data-title="Activation">
+                <input type="submit" class="button" name="action_{toggle}.{index}" value="{toggle_label}" />
+              </td>
+              <td data-title="Remove">
+                <input type="submit" class="button remove" name="action_remove.{index}" value="" />
+              </td>
+            </tr>"""
+
+_ACTION = re.compile(r"^action_(remove|enable|disable)\.(\d+)$")
+
+
+def _transports(protocol):
+    protocol = protocol.lower()
+    return {"tcp", "udp"} if protocol == "both" else {protocol}
+
+
+def expected_hash(challenge, login, password):
+    """The `hash` field a client must post for `challenge`."""
+    def part(secret):
+        digest = hashlib.sha256(secret.encode()).hexdigest()
+        return hmac.new(challenge.encode(), digest.encode(), hashlib.sha256).hexdigest()
+    return part(login) + part(password)
+
+
+class RouterState:
+    """What the emulated router knows: credentials, rules, challenges and sessions.
+
+    Every method takes the lock: the server handles requests concurrently.
+    """
+
+    def __init__(self, login="admin", password="password", rules=None, session_ttl=300.0):
+        self.login = login
+        self.password = password
+        self.session_ttl = session_ttl
+        self.lock = threading.Lock()
+        self.rules = []
+        self.next_index = 1
+        self.challenges = set()
+        self.sessions = {}  # sid -> time of last request
+        self.logins = 0
+        self.requests = {}  # (method, path) -> count
+        self.not_modified = 0
+        for rule in rules or []:
+            self.rules.append({**rule, "type": "Port", "index": self.next_index})
+            self.next_index += 1
+
+    def count(self, method, path):
+        with self.lock:
+            self.requests[(method, path)] = self.requests.get((method, path), 0) + 1
+
+    def new_challenge(self):
+        challenge = secrets.token_hex(16)
+        with self.lock:
+            self.challenges.add(challenge)
+        return challenge
+
+    def login_with(self, challenge, submitted):
+        """Open a session if `submitted` is the hash for a challenge handed out (each is single-use)."""
+        with self.lock:
+            if challenge not in self.challenges:
+                return None
+            self.challenges.discard(challenge)
+            if not hmac.compare_digest(submitted, expected_hash(challenge, self.login, self.password)):
+                return None
+            sid = secrets.token_hex(16)
+            self.sessions[sid] = time.monotonic()
+            self.logins += 1
+            return sid
+
+    def touch(self, sid):
+        """Whether `sid` is a live session; using it keeps it alive for another `session_ttl`."""
+        now = time.monotonic()
+        with self.lock:
+            last = self.sessions.get(sid)
+            if last is None or now - last > self.session_ttl:
+                self.sessions.pop(sid, None)
+                return False
+            self.sessions[sid] = now
+            return True
+
+    def expire_sessions(self):
+        """Drop every session, as a router reboot or timeout would."""
+        with self.lock:
+            self.sessions.clear()
+
+    def apply_form(self, form):
+        """Perform the action a NAT form post asks for.
+
+        Returns:
+            An error message for the page, or None
+        """
+        with self.lock:
+            if "action_add" in form:
+                return self._add(form)
+            for key in form:
+                match = _ACTION.match(key)
+                if match:
+                    return self._change(match.group(1), int(match.group(2)))
+        return None
+
+    def _add(self, form):
+        name = form.get("nat_rulename", "")
+        proto = form.get("nat_proto", "")
+        ext_port = form.get("nat_extport", "")
+        dst_port = form.get("nat_dstport", "")
+        octet = form.get("nat_dstip_p3", "")
+        if not name or len(name) > 20:
+            return "Invalid rule name"
+        if proto not in _PROTOCOLS:
+            return "Invalid protocol"
+        for port in (ext_port, dst_port):
+            if not port.isdigit() or not 1 <= int(port) <= 65535:
+                return "Invalid port"
+        if not octet.isdigit() or not 1 <= int(octet) <= 254:
+            return "Invalid IP address"
+        for rule in self.rules:
+            if rule["name"] == name:
+                return "A rule with this name already exists"
+            if _transports(proto) & _transports(rule["protocol"]) and rule["ext_ports"] == str(int(ext_port)):
+                return "External port already in use"
+        ip_address = ".".join(form.get(f"nat_dstip_p{i}", "") for i in range(3)) + f".{octet}"
+        self.rules.append({
+            "name": name,
+            "protocol": _PROTOCOLS[proto],
+            "type": "Port",
+            "ext_ports": str(int(ext_port)),
+            "ip_address": ip_address,
+            "dst_ports": str(int(dst_port)),
+            "enabled": form.get("nat_active") == "on",
+            "index": self.next_index,
+        })
+        self.next_index += 1
+        return None
+
+    def _change(self, action, index):
+        for rule in self.rules:
+            if rule["index"] == index:
+                break
+        else:
+            return "Unknown rule"
+        if action == "remove":
+            self.rules.remove(rule)
+        else:
+            rule["enabled"] = action == "enable"
+        return None
+
+    def nat_page(self, error=None):
+        with self.lock:
+            rules = [dict(rule) for rule in self.rules]
+        rows = []
+        tcp, udp = [], []
+        for number, rule in enumerate(rules, 1):
+            if rule["protocol"] in ("TCP", "Both"):
+                tcp.append(rule["ext_ports"])
+            if rule["protocol"] in ("UDP", "Both"):
+                udp.append(rule["ext_ports"])
+            rows.append(_NAT_ROW.format(
+                state="enabled" if rule["enabled"] else "disabled",
+                number=number,
+                name=html.escape(rule["name"]),
+                protocol=rule["protocol"],
+                ext_ports=rule["ext_ports"],
+                ip_address=rule["ip_address"],
+                dst_ports=rule["dst_ports"],
+                toggle="disable" if rule["enabled"] else "enable",
+                toggle_label="Disable" if rule["enabled"] else "Enable",
+                index=rule["index"],
+            ))
+        return _NAT_PAGE.format(
+            error=f'\n    <div class="error">{html.escape(error)}</div>' if error else "",
+            port_list_tcp=":" + "".join(f"{p}:" for p in tcp),
+            port_list_udp=":" + "".join(f"{p}:" for p in udp),
+            rows="\n".join(rows),
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like a browser session
+    # Headers and body are separate writes: without this, delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        self._serve("GET")
+
+    def do_POST(self):
+        self._serve("POST")
+
+    def _serve(self, method):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        self.state.count(method, url.path)
+        form = {}
+        if method == "POST":
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            form = {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+
+        if url.path == "/login":
+            if method == "GET":
+                page_ref = parse_qs(url.query).get("page_ref", ["/"])[0]
+                return self._send(200, _LOGIN_PAGE.format(page_ref=html.escape(page_ref)))
+            return self._login(form)
+        if url.path == "/network/nat":
+            if not self.state.touch(self._sid()):
+                return self._redirect(f"/login?page_ref={url.path}")
+            error = self.state.apply_form(form) if method == "POST" else None
+            page = self.state.nat_page(error)
+            if method == "GET" and self.server.etag:
+                etag = '"' + hashlib.sha256(page.encode()).hexdigest()[:32] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    with self.state.lock:
+                        self.state.not_modified += 1
+                    return self._send(304, None, headers={"ETag": etag})
+                return self._send(200, page, headers={"ETag": etag})
+            return self._send(200, page)
+        self._send(404, "<html><body>Not found</body></html>")
+
+    def _login(self, form):
+        if form.get("action") == "challenge":
+            challenge = self.state.new_challenge()
+            return self._send(200, (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f"<rsp><zsid>{challenge}</zsid><challenge>{challenge}</challenge></rsp>"
+            ), content_type="text/xml")
+        sid = self.state.login_with(form.get("zsid", ""), form.get("hash", ""))
+        page_ref = form.get("page_ref") or "/"
+        if sid is None:
+            return self._send(200, _LOGIN_PAGE.format(page_ref=html.escape(page_ref)))
+        self._redirect(page_ref, cookie=f"sid={sid}; Path=/; HttpOnly")
+
+    def _sid(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie["sid"].value if "sid" in cookie else None
+
+    def _redirect(self, location, cookie=None):
+        self.send_response(302)
+        self.send_header("Location", location)
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is None:  # 304: no body, no Content-Length
+            self.end_headers()
+            return
+        data = body.encode()
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class RouterEmulator:
+    """An emulated SFR Box served on a local port from a background thread.
+
+    Usable as a context manager; `host` is what SFRBoxNAT (or SFR_BOX_HOST)
+    expects, e.g. "127.0.0.1:54321".
+    """
+
+    def __init__(self, state=None, latency=0.0, port=0, bind="127.0.0.1", etag=False):
+        self.state = state or RouterState()
+        self.server = ThreadingHTTPServer((bind, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.state = self.state
+        # Seconds added to every request, like the round-trip to the real box
+        self.server.latency = latency
+        # Send ETags and answer If-None-Match with 304 (the real box may not)
+        self.server.etag = etag
+        self.host = f"{bind}:{self.server.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an emulated SFR Box NAT interface")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument("--login", default="admin", help="Admin login (default: admin)")
+    parser.add_argument("--password", default="password", help="Admin password (default: password)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each request")
+    parser.add_argument("--session-ttl", type=float, default=300.0, help="Idle seconds before a session expires")
+    parser.add_argument("--empty", action="store_true", help="Start without the sample rules")
+    parser.add_argument("--etag", action="store_true", help="Support conditional GETs of the NAT page")
+    args = parser.parse_args()
+
+    state = RouterState(
+        login=args.login,
+        password=args.password,
+        rules=None if args.empty else SAMPLE_RULES,
+        session_ttl=args.session_ttl,
+    )
+    emulator = RouterEmulator(state, latency=args.latency, port=args.port, etag=args.etag)
+    print(f"Emulated SFR Box on http://{emulator.host} (SFR_BOX_HOST={emulator.host})")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,22 +4,287 @@
 import argparse
 import hashlib
 import hmac
+import json
 import os
 import re
 import sys
+import time
+
+from html.parser import HTMLParser
 
 import requests
-from bs4 import BeautifulSoup
+import yaml
+
+
+# Where the NAT table starts: parsing begins there instead of at the top of the page
+_NAT_TABLE_START = re.compile(r"""<table\b[^>]*\bid\s*=\s*["']?nat_config\b""", re.I)
+
+# Cells read from each rule row, by their data-title
+_NAT_COLUMNS = {
+    "Name": "name",
+    "Protocol": "protocol",
+    "Type": "type",
+    "External ports": "ext_ports",
+    "IP address": "ip_address",
+    "Destination ports": "dst_ports",
+}
+
+
+class _TableEnd(Exception):
+    """Raised by _NATTableParser once the table is closed, to stop parsing."""
+
+
+class _NATTableParser(HTMLParser):
+    """Streaming parser collecting the rows of `table#nat_config`.
+
+    A small state machine over start/end tags: it only tracks the table, its
+    first tbody, the current row, cell and `span.col_number`, and stops at
+    the end of the table. Texts are joined the way BeautifulSoup's
+    `get_text(strip=True)` does (each piece stripped, empty ones dropped).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rules = []
+        self.found = False
+        self._table_depth = 0   # nesting of <table> inside #nat_config
+        self._tbody = "before"  # before / in / after the first tbody
+        self._row = None        # {"cells": {...}, "number": [...], "button": ...}
+        self._cell = None       # data-title of the open cell
+        self._cell_text = None
+        self._span_depth = 0    # open <span> inside span.col_number (1 = the span itself)
+
+    def handle_starttag(self, tag, attrs):
+        if not self.found:
+            if tag == "table" and dict(attrs).get("id") == "nat_config":
+                self.found = True
+                self._table_depth = 1
+            return
+        if tag == "table":
+            self._table_depth += 1
+        elif self._table_depth != 1:
+            pass  # nested tables do not hold rule rows
+        elif tag == "tbody":
+            if self._tbody == "before":
+                self._tbody = "in"
+        elif self._tbody != "in":
+            return
+        elif tag == "tr":
+            self._end_row()  # </tr> is optional
+            self._row = {"cells": {}, "number": None, "button": None}
+        elif tag == "td" and self._row is not None:
+            self._end_cell()  # </td> is optional
+            self._cell = dict(attrs).get("data-title")
+            self._cell_text = []
+        if self._cell is None:
+            return
+        if tag == "span":
+            if self._span_depth:
+                self._span_depth += 1
+            elif self._cell == "#" and self._row["number"] is None:
+                if "col_number" in (dict(attrs).get("class") or "").split():
+                    self._row["number"] = []
+                    self._span_depth = 1
+        elif tag == "input" and self._cell == "Activation" and self._row["button"] is None:
+            attrs = dict(attrs)
+            if attrs.get("type") == "submit":
+                self._row["button"] = attrs
+
+    def handle_endtag(self, tag):
+        if not self.found:
+            return
+        if tag == "table":
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                self._end_row()
+                raise _TableEnd
+        elif self._table_depth != 1:
+            pass
+        elif tag == "tbody":
+            if self._tbody == "in":
+                self._end_row()
+                self._tbody = "after"
+        elif tag == "tr":
+            self._end_row()
+        elif tag == "td":
+            self._end_cell()
+        elif tag == "span" and self._span_depth:
+            self._span_depth -= 1
+
+    def handle_data(self, data):
+        if self._cell_text is None:
+            return
+        text = data.strip()
+        if text:
+            self._cell_text.append(text)
+            if self._span_depth:
+                self._row["number"].append(text)
+
+    def _end_cell(self):
+        if self._cell is not None and self._cell not in self._row["cells"]:
+            self._row["cells"][self._cell] = "".join(self._cell_text)
+        self._cell = None
+        self._cell_text = None
+        self._span_depth = 0
+
+    def _end_row(self):
+        if self._row is None:
+            return
+        self._end_cell()
+        row, self._row = self._row, None
+        # Skip the "add new rule" form row (no span.col_number)
+        if row["number"] is None:
+            return
+        missing = [title for title in _NAT_COLUMNS if title not in row["cells"]]
+        if missing or "Activation" not in row["cells"]:
+            raise RuntimeError(f"NAT rule row without {', '.join(missing or ['Activation'])} cell")
+
+        # "Disable" button means currently enabled; "Enable" means disabled
+        button = row["button"]
+        if button:
+            enabled = button.get("value", "") == "Disable"
+            # Extract index from button name (e.g., "action_disable.5" → 5)
+            idx_match = re.search(r"\.(\d+)$", button.get("name", ""))
+            index = int(idx_match.group(1)) if idx_match else None
+        else:
+            enabled = False
+            index = None
+
+        rule = {"number": "".join(row["number"]), "index": index}
+        for title, key in _NAT_COLUMNS.items():
+            rule[key] = row["cells"][title]
+        rule["enabled"] = enabled
+        self.rules.append(rule)
+
+
+_TABLE_TAG = re.compile(r"<(/?)table\b", re.I)
+
+
+def nat_table_slice(html):
+    """The `table#nat_config` element of the NAT page, or the whole page if it has none.
+
+    Nested tables are skipped; an unclosed table runs to the end of the page.
+    """
+    start = _NAT_TABLE_START.search(html)
+    if not start:
+        return html
+    depth = 0
+    for tag in _TABLE_TAG.finditer(html, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[start.start():html.index(">", tag.end()) + 1]
+    return html[start.start():]
+
+
+def parse_nat_table(html):
+    """Parse the rules of the router's NAT page.
+
+    Returns:
+        One dict per rule: number, index, name, protocol, type, ext_ports,
+        ip_address, dst_ports, enabled
+    """
+    parser = _NATTableParser()
+    start = _NAT_TABLE_START.search(html)
+    try:
+        parser.feed(html[start.start():] if start else html)
+        parser.close()
+    except _TableEnd:
+        pass
+    if not parser.found:
+        raise RuntimeError("Could not find NAT config table in response")
+    return parser.rules
+
+
+# Seconds a cached session is trusted without activity (SFR_BOX_SESSION_TTL)
+DEFAULT_SESSION_TTL = 600
+
+
+def _cache_dir():
+    """nat_manager's directory under $XDG_CACHE_HOME (default ~/.cache)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "nat_manager")
+
+
+def session_cache_path(host, login):
+    """Per host and login session cache file."""
+    return os.path.join(_cache_dir(), f"session-{login}@{host}.json")
+
+
+def snapshot_path(host):
+    """Where `watch` keeps the last rules table seen on `host`."""
+    return os.path.join(_cache_dir(), f"snapshot-{host}.json")
 
 
 class SFRBoxNAT:
     """Client for managing NAT rules on an SFR Box router."""
 
-    def __init__(self, host="192.168.1.1", login="admin", password=None):
+    def __init__(self, host="192.168.1.1", login="admin", password=None,
+                 session_cache=None, session_ttl=DEFAULT_SESSION_TTL):
         self.base_url = f"http://{host}"
         self.login_user = login
         self.password = password
         self.session = requests.Session()
+        # Cookies are kept in this file between runs (None: no cache)
+        self.session_cache = session_cache
+        self.session_ttl = session_ttl
+
+    def load_session(self):
+        """Reuse the cookies of a previous run, if cached for this login and not expired."""
+        if not self.session_cache:
+            return False
+        try:
+            with open(self.session_cache) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get("base_url") != self.base_url or cached.get("login") != self.login_user:
+            return False
+        if cached.get("expires_at", 0) <= time.time():
+            return False
+        self.session.cookies.update(cached.get("cookies", {}))
+        return True
+
+    def save_session(self):
+        """Cache the session cookies (mode 0600) until `session_ttl` seconds from now."""
+        if not self.session_cache:
+            return
+        cached = {
+            "base_url": self.base_url,
+            "login": self.login_user,
+            "expires_at": time.time() + self.session_ttl,
+            "cookies": requests.utils.dict_from_cookiejar(self.session.cookies),
+        }
+        os.makedirs(os.path.dirname(self.session_cache) or ".", mode=0o700, exist_ok=True)
+        tmp = f"{self.session_cache}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cached, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.session_cache)
+
+    def clear_session(self):
+        """Forget the cached session."""
+        if self.session_cache and os.path.exists(self.session_cache):
+            os.remove(self.session_cache)
+
+    def _request(self, method, path, **kwargs):
+        """Send a request, logging in again once if the router answers with its login form.
+
+        A request answered by the login form was not performed, so it is
+        simply retried after authenticating.
+        """
+        resp = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        if "form_auth_passwd" in resp.text:
+            if not self.password:
+                raise RuntimeError("Session expired and no password to log in again")
+            self.clear_session()
+            self.session.cookies.clear()
+            self.authenticate()
+            resp = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        resp.raise_for_status()
+        # The router extends the session on activity: so does the cache
+        self.save_session()
+        return resp
 
     def authenticate(self):
         """Perform challenge-response authentication against the SFR Box."""
@@ -71,6 +336,7 @@ class SFRBoxNAT:
                 "Authentication failed — check login credentials"
             )
 
+        self.save_session()
         return True
 
     def _extract_challenge(self, response_text):
@@ -87,63 +353,25 @@ class SFRBoxNAT:
 
     def list_rules(self):
         """Fetch and parse the current NAT rules from the router."""
-        resp = self.session.get(f"{self.base_url}/network/nat")
-        resp.raise_for_status()
+        resp = self._request("GET", "/network/nat")
         return self._parse_rules(resp.text)
 
-    def _parse_rules(self, html):
-        """Parse NAT rules from the HTML table."""
-        soup = BeautifulSoup(html, "html.parser")
-        table = soup.find("table", id="nat_config")
-        if not table:
-            raise RuntimeError("Could not find NAT config table in response")
-
-        rules = []
-        for row in table.find("tbody").find_all("tr"):
-            # Skip the "add new rule" form row (no span.col_number)
-            number_cell = row.find("td", {"data-title": "#"})
-            if not number_cell:
-                continue
-            number_span = number_cell.find("span", class_="col_number")
-            if not number_span:
-                continue
+    def fetch_nat_page(self, etag=None):
+        """Fetch the NAT page, conditionally if `etag` (from a previous fetch) is given.
 
-            # Extract rule data from cells
-            name = row.find("td", {"data-title": "Name"}).get_text(strip=True)
-            protocol = row.find("td", {"data-title": "Protocol"}).get_text(strip=True)
-            rule_type = row.find("td", {"data-title": "Type"}).get_text(strip=True)
-            ext_ports = row.find("td", {"data-title": "External ports"}).get_text(strip=True)
-            ip_address = row.find("td", {"data-title": "IP address"}).get_text(strip=True)
-            dst_ports = row.find("td", {"data-title": "Destination ports"}).get_text(strip=True)
-
-            # Determine enabled/disabled state and rule index from the button
-            activation_cell = row.find("td", {"data-title": "Activation"})
-            button = activation_cell.find("input", {"type": "submit"})
-            if button:
-                btn_name = button.get("name", "")
-                btn_value = button.get("value", "")
-                # "Disable" button means currently enabled; "Enable" means disabled
-                enabled = btn_value == "Disable"
-                # Extract index from button name (e.g., "action_disable.5" → 5)
-                idx_match = re.search(r"\.(\d+)$", btn_name)
-                index = int(idx_match.group(1)) if idx_match else None
-            else:
-                enabled = False
-                index = None
-
-            rules.append({
-                "number": number_span.get_text(strip=True),
-                "index": index,
-                "name": name,
-                "protocol": protocol,
-                "type": rule_type,
-                "ext_ports": ext_ports,
-                "ip_address": ip_address,
-                "dst_ports": dst_ports,
-                "enabled": enabled,
-            })
+        Returns:
+            (html, etag): html is None if the router answered 304 Not
+            Modified; etag is None if the router does not send one
+        """
+        headers = {"If-None-Match": etag} if etag else {}
+        resp = self._request("GET", "/network/nat", headers=headers)
+        if resp.status_code == 304:
+            return None, etag
+        return resp.text, resp.headers.get("ETag")
 
-        return rules
+    def _parse_rules(self, html):
+        """Parse NAT rules from the HTML table."""
+        return parse_nat_table(html)
 
     def _build_port_lists(self, rules):
         """Build port_list_tcp and port_list_udp from current rules."""
@@ -178,7 +406,8 @@ class SFRBoxNAT:
 
         raise ValueError(f"No rule found matching '{name_or_index}'")
 
-    def _parse_ip_octet(self, ip_input):
+    @staticmethod
+    def _parse_ip_octet(ip_input):
         """Parse IP input — accepts last octet (e.g. '74') or full IP (e.g. '192.168.1.74')."""
         ip_str = str(ip_input)
         if "." in ip_str:
@@ -215,10 +444,16 @@ class SFRBoxNAT:
         }
 
     def add_rule(self, name, ext_port, ip_last_octet, dst_port,
-                 proto="tcp", active=True):
-        """Add a new NAT port forwarding rule."""
+                 proto="tcp", active=True, rules=None):
+        """Add a new NAT port forwarding rule.
+
+        `rules` is the current table if the caller already has it (e.g. the
+        table returned by the previous change); it is fetched otherwise.
+        Like every change, returns the table the router answers with.
+        """
         octet = self._parse_ip_octet(ip_last_octet)
-        rules = self.list_rules()
+        if rules is None:
+            rules = self.list_rules()
         tcp_list, udp_list = self._build_port_lists(rules)
 
         payload = {
@@ -241,15 +476,13 @@ class SFRBoxNAT:
             "action_add": "",
         }
 
-        resp = self.session.post(
-            f"{self.base_url}/network/nat", data=payload
-        )
-        resp.raise_for_status()
+        resp = self._request("POST", "/network/nat", data=payload)
         return self._parse_rules(resp.text)
 
-    def delete_rule(self, name_or_index):
-        """Delete a NAT rule by name or index."""
-        rules = self.list_rules()
+    def delete_rule(self, name_or_index, rules=None):
+        """Delete a NAT rule by name or index (`rules`: current table, as for add_rule)."""
+        if rules is None:
+            rules = self.list_rules()
         rule = self._resolve_rule(rules, name_or_index)
         tcp_list, udp_list = self._build_port_lists(rules)
 
@@ -260,15 +493,13 @@ class SFRBoxNAT:
         }
         payload.update(self._build_rule_payload(rule))
 
-        resp = self.session.post(
-            f"{self.base_url}/network/nat", data=payload
-        )
-        resp.raise_for_status()
+        resp = self._request("POST", "/network/nat", data=payload)
         return self._parse_rules(resp.text)
 
-    def enable_rule(self, name_or_index):
-        """Enable a NAT rule by name or index."""
-        rules = self.list_rules()
+    def enable_rule(self, name_or_index, rules=None):
+        """Enable a NAT rule by name or index (`rules`: current table, as for add_rule)."""
+        if rules is None:
+            rules = self.list_rules()
         rule = self._resolve_rule(rules, name_or_index)
         tcp_list, udp_list = self._build_port_lists(rules)
 
@@ -279,15 +510,13 @@ class SFRBoxNAT:
         }
         payload.update(self._build_rule_payload(rule))
 
-        resp = self.session.post(
-            f"{self.base_url}/network/nat", data=payload
-        )
-        resp.raise_for_status()
+        resp = self._request("POST", "/network/nat", data=payload)
         return self._parse_rules(resp.text)
 
-    def disable_rule(self, name_or_index):
-        """Disable a NAT rule by name or index."""
-        rules = self.list_rules()
+    def disable_rule(self, name_or_index, rules=None):
+        """Disable a NAT rule by name or index (`rules`: current table, as for add_rule)."""
+        if rules is None:
+            rules = self.list_rules()
         rule = self._resolve_rule(rules, name_or_index)
         tcp_list, udp_list = self._build_port_lists(rules)
 
@@ -298,12 +527,235 @@ class SFRBoxNAT:
         }
         payload.update(self._build_rule_payload(rule))
 
-        resp = self.session.post(
-            f"{self.base_url}/network/nat", data=payload
-        )
-        resp.raise_for_status()
+        resp = self._request("POST", "/network/nat", data=payload)
         return self._parse_rules(resp.text)
 
+    def apply(self, changes, rules):
+        """Perform `changes` (from diff_rules) starting from the current table `rules`.
+
+        Each change reuses the table returned by the previous one, so n
+        changes cost n requests and no extra listing.
+
+        Returns:
+            The final table
+        """
+        for action, name, spec in changes:
+            if action == "add":
+                rules = self.add_rule(
+                    name, spec["ext_port"], spec["ip"], spec["dst_port"],
+                    proto=spec["proto"], active=spec["enabled"], rules=rules,
+                )
+                continue
+            # Address the rule by its index in the latest table: deletions renumber
+            target = str(self._resolve_rule(rules, name)["index"])
+            if action == "delete":
+                rules = self.delete_rule(target, rules=rules)
+            elif action == "enable":
+                rules = self.enable_rule(target, rules=rules)
+            else:
+                rules = self.disable_rule(target, rules=rules)
+        return rules
+
+
+def load_ruleset(path):
+    """Read a desired ruleset from YAML.
+
+    Either a list of rules or a mapping with a `rules` list; each rule has
+    `name`, `ext_port`, `ip` (last octet or full address) and `dst_port`,
+    optionally `proto` (default tcp) and `enabled` (default true).
+    """
+    with open(path) as f:
+        data = yaml.safe_load(f) or []
+    if isinstance(data, dict):
+        data = data.get("rules") or []
+    ruleset = []
+    seen = set()
+    for entry in data:
+        missing = [k for k in ("name", "ext_port", "ip", "dst_port") if k not in entry]
+        if missing:
+            raise ValueError(f"Rule {entry!r} is missing {', '.join(missing)}")
+        name = str(entry["name"])
+        if len(name) > 20:
+            raise ValueError(f"Rule name must be 20 chars or less: '{name}'")
+        if name.lower() in seen:
+            raise ValueError(f"Rule '{name}' is defined twice")
+        seen.add(name.lower())
+        proto = str(entry.get("proto", "tcp")).lower()
+        if proto not in ("tcp", "udp", "both"):
+            raise ValueError(f"Rule '{name}': proto must be tcp, udp or both, got '{proto}'")
+        ruleset.append({
+            "name": name,
+            "ext_port": str(int(entry["ext_port"])),
+            "ip": SFRBoxNAT._parse_ip_octet(entry["ip"]),
+            "dst_port": str(int(entry["dst_port"])),
+            "proto": proto,
+            "enabled": bool(entry.get("enabled", True)),
+        })
+    return ruleset
+
+
+def diff_rules(rules, ruleset, prune=False):
+    """Changes turning the router table `rules` into the desired `ruleset`.
+
+    Rules are matched by name (case-insensitive). A rule whose ports, address
+    or protocol differ is deleted and added again (the router cannot edit
+    one); one differing only in state is enabled or disabled. Rules missing
+    from the ruleset are deleted only with `prune`. Deletions come first so
+    that freed ports can be reused by the additions.
+
+    Returns:
+        List of (action, name, spec) with action in add, delete, enable, disable
+    """
+    current = {rule["name"].lower(): rule for rule in rules}
+    deletes, toggles, adds = [], [], []
+    for spec in ruleset:
+        rule = current.pop(spec["name"].lower(), None)
+        if rule is None:
+            adds.append(("add", spec["name"], spec))
+        elif (rule["type"] != "Port"
+              or rule["ext_ports"] != spec["ext_port"]
+              or rule["dst_ports"] != spec["dst_port"]
+              or rule["ip_address"] != f"192.168.1.{spec['ip']}"
+              or rule["protocol"].lower() != spec["proto"]):
+            deletes.append(("delete", rule["name"], None))
+            adds.append(("add", spec["name"], spec))
+        elif rule["enabled"] != spec["enabled"]:
+            toggles.append(("enable" if spec["enabled"] else "disable", rule["name"], None))
+    if prune:
+        deletes.extend(("delete", rule["name"], None) for rule in current.values())
+    return deletes + toggles + adds
+
+
+def print_changes(changes):
+    """Display the changes diff_rules computed."""
+    if not changes:
+        print("Nothing to do: rules already match.")
+        return
+    for action, name, spec in changes:
+        if spec:
+            state = "" if spec["enabled"] else " (disabled)"
+            print(f"{action:8} {name}: {spec['proto']} {spec['ext_port']} -> "
+                  f"192.168.1.{spec['ip']}:{spec['dst_port']}{state}")
+        else:
+            print(f"{action:8} {name}")
+
+
+# Rule fields whose change `watch` reports
+_WATCHED_FIELDS = ("protocol", "type", "ext_ports", "ip_address", "dst_ports", "enabled")
+
+
+def load_snapshot(path):
+    """The snapshot `watch` saved last, or None."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(path, snapshot):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp, path)
+
+
+def diff_snapshots(old_rules, new_rules):
+    """Differences between two rules tables, matching rules by name.
+
+    Returns:
+        Events, each a dict with `event` (added, removed or changed), `name`
+        and `rule` (the new rule, or the removed one); changed events also
+        have `changes`: {field: [old, new]}
+    """
+    old = {rule["name"]: rule for rule in old_rules}
+    new = {rule["name"]: rule for rule in new_rules}
+    events = []
+    for name, rule in old.items():
+        if name not in new:
+            events.append({"event": "removed", "name": name, "rule": rule})
+    for name, rule in new.items():
+        if name not in old:
+            events.append({"event": "added", "name": name, "rule": rule})
+            continue
+        changes = {
+            field: [old[name][field], rule[field]]
+            for field in _WATCHED_FIELDS if old[name][field] != rule[field]
+        }
+        if changes:
+            events.append({"event": "changed", "name": name, "rule": rule, "changes": changes})
+    return events
+
+
+def poll_rules(client, snapshot):
+    """Check the router table against `snapshot` (as saved by a previous poll, or None).
+
+    The page is fetched conditionally when the router gave an ETag; otherwise
+    it is only parsed if the sha256 of its NAT table differs from the
+    snapshot's (the rest of the page, e.g. tokens or uptime, may change on
+    every request).
+
+    Returns:
+        (events, snapshot): the differences, and the snapshot to keep
+    """
+    etag = snapshot.get("etag") if snapshot else None
+    html, etag = client.fetch_nat_page(etag)
+    if html is None:
+        return [], snapshot
+    digest = hashlib.sha256(nat_table_slice(html).encode()).hexdigest()
+    if snapshot and digest == snapshot.get("table_sha256"):
+        return [], snapshot if etag == snapshot.get("etag") else {**snapshot, "etag": etag}
+    rules = client._parse_rules(html)
+    events = diff_snapshots(snapshot["rules"], rules) if snapshot else []
+    return events, {"etag": etag, "table_sha256": digest, "rules": rules}
+
+
+def print_events(events, as_json=False):
+    """Display watch events, as text or as one JSON object per line."""
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    for event in events:
+        if as_json:
+            print(json.dumps({"time": now, **event}), flush=True)
+            continue
+        rule = event["rule"]
+        if event["event"] == "changed":
+            detail = ", ".join(f"{field} {old} -> {new}" for field, (old, new) in event["changes"].items())
+        else:
+            state = "enabled" if rule["enabled"] else "disabled"
+            detail = (f"{rule['protocol']} {rule['ext_ports']} -> "
+                      f"{rule['ip_address']}:{rule['dst_ports']} ({state})")
+        print(f"{now}  {event['event']:8} {event['name']}: {detail}", flush=True)
+
+
+def watch(client, path, interval, as_json=False, once=False):
+    """Poll the rules every `interval` seconds and report what changed.
+
+    The last table seen is kept in `path`, so changes made between two runs
+    are reported at the start of the next one. A poll that fails (router
+    unreachable, unexpected page) is reported on stderr and retried at the
+    next interval; with `once`, the error is raised.
+    """
+    snapshot = load_snapshot(path)
+    while True:
+        try:
+            events, new_snapshot = poll_rules(client, snapshot)
+        except (requests.RequestException, RuntimeError) as e:
+            if once:
+                raise
+            print(f"watch: poll failed: {e}; retrying in {interval}s", file=sys.stderr, flush=True)
+            time.sleep(interval)
+            continue
+        if snapshot is None and not as_json:
+            print_rules(new_snapshot["rules"])
+        print_events(events, as_json)
+        if new_snapshot is not snapshot:
+            save_snapshot(path, new_snapshot)
+            snapshot = new_snapshot
+        if once:
+            return
+        time.sleep(interval)
+
 
 def print_rules(rules):
     """Display rules as a formatted table."""
@@ -344,7 +796,11 @@ def print_rules(rules):
 
 
 def create_client():
-    """Create and authenticate an SFRBoxNAT client from environment variables."""
+    """Create and authenticate an SFRBoxNAT client from environment variables.
+
+    A session cached by a previous run is reused instead of logging in again;
+    requests made with an expired one log in transparently.
+    """
     password = os.environ.get("SFR_BOX_PASSWORD")
     if not password:
         print("Error: SFR_BOX_PASSWORD environment variable is not set.", file=sys.stderr)
@@ -355,8 +811,17 @@ def create_client():
     login = os.environ.get("SFR_BOX_LOGIN", "admin")
     host = os.environ.get("SFR_BOX_HOST", "192.168.1.1")
 
-    client = SFRBoxNAT(host=host, login=login, password=password)
-    client.authenticate()
+    session_ttl = int(os.environ.get("SFR_BOX_SESSION_TTL", DEFAULT_SESSION_TTL))
+
+    client = SFRBoxNAT(
+        host=host,
+        login=login,
+        password=password,
+        session_cache=session_cache_path(host, login) if session_ttl > 0 else None,
+        session_ttl=session_ttl,
+    )
+    if not client.load_session():
+        client.authenticate()
     return client
 
 
@@ -396,8 +861,47 @@ def main():
     dis_parser = subparsers.add_parser("disable", help="Disable a port forwarding rule")
     dis_parser.add_argument("rule", help="Rule name or index number")
 
+    # apply
+    apply_parser = subparsers.add_parser(
+        "apply", help="Make the router rules match a YAML ruleset"
+    )
+    apply_parser.add_argument("ruleset", help="YAML file with the desired rules")
+    apply_parser.add_argument(
+        "--prune", action="store_true",
+        help="Also delete rules that are not in the ruleset"
+    )
+    apply_parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only show the changes"
+    )
+
+    # watch
+    watch_parser = subparsers.add_parser(
+        "watch", help="Poll the rules and report changes"
+    )
+    watch_parser.add_argument(
+        "--interval", type=float, default=60,
+        help="Seconds between polls (default: 60)"
+    )
+    watch_parser.add_argument(
+        "--json", action="store_true",
+        help="Print one JSON object per change"
+    )
+    watch_parser.add_argument(
+        "--once", action="store_true",
+        help="Poll once and exit"
+    )
+
     args = parser.parse_args()
 
+    if args.command == "apply":
+        # Validate before talking to the router
+        try:
+            ruleset = load_ruleset(args.ruleset)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
     client = create_client()
 
     if args.command == "list":
@@ -434,6 +938,25 @@ def main():
         print(f"Disabled rule '{args.rule}'")
         print_rules(rules)
 
+    elif args.command == "watch":
+        host = os.environ.get("SFR_BOX_HOST", "192.168.1.1")
+        try:
+            watch(client, snapshot_path(host), args.interval, as_json=args.json, once=args.once)
+        except KeyboardInterrupt:
+            pass
+        except (requests.RequestException, RuntimeError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    elif args.command == "apply":
+        rules = client.list_rules()
+        changes = diff_rules(rules, ruleset, prune=args.prune)
+        print_changes(changes)
+        if changes and not args.dry_run:
+            rules = client.apply(changes, rules)
+            print()
+            print_rules(rules)
+
 
 if __name__ == "__main__":
     main()
@@ -15,7 +15,8 @@ if [[ "${1:-}" == "-h" || "${1:-}" == "--help" ]]; then
 Usage: cron-deploy.sh [-h] [--remove]
 
 Deploy crontab entries from scripts/crontabs into the user's crontab,
-and install systemd user services from this directory.
+and install systemd user services from this directory
+(tmux save on shutdown, dotfiles symlink watcher).
 
 Options:
   --remove   Remove the managed crontab block and disable systemd services
@@ -41,10 +42,12 @@ cleaned=$(echo "$existing" | awk -v b="$MARKER_BEGIN" -v e="$MARKER_END" '
 
 # --- Systemd user services ---
 SYSTEMD_USER_DIR="$HOME/.config/systemd/user"
-SERVICE_FILE="tmux-save-on-shutdown.service"
-SERVICE_SRC="$SCRIPT_DIR/$SERVICE_FILE"
+# dotfiles-watch.service keeps deploy symlinks healed (src_dotfiles watch)
+SERVICE_FILES=("tmux-save-on-shutdown.service" "dotfiles-watch.service")
 
 deploy_systemd_service() {
+  local SERVICE_FILE="$1"
+  local SERVICE_SRC="$SCRIPT_DIR/$SERVICE_FILE"
   if [[ ! -f "$SERVICE_SRC" ]]; then
     echo "Warning: $SERVICE_SRC not found, skipping systemd service."
     return
@@ -57,6 +60,7 @@ deploy_systemd_service() {
 }
 
 remove_systemd_service() {
+  local SERVICE_FILE="$1"
   if systemctl --user is-enabled "$SERVICE_FILE" &>/dev/null; then
     systemctl --user disable --now "$SERVICE_FILE"
     echo "Disabled systemd service: $SERVICE_FILE"
@@ -72,7 +76,9 @@ remove_systemd_service() {
 if [[ "${1:-}" == "--remove" ]]; then
   echo "$cleaned" | crontab -
   echo "Removed managed crontab block."
-  remove_systemd_service
+  for service in "${SERVICE_FILES[@]}"; do
+    remove_systemd_service "$service"
+  done
   exit 0
 fi
 
@@ -111,4 +117,6 @@ crontab -l
 
 # Deploy systemd services
 echo ""
-deploy_systemd_service
+for service in "${SERVICE_FILES[@]}"; do
+  deploy_systemd_service "$service"
+done
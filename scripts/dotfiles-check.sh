@@ -4,6 +4,8 @@
 
 CACHE_FILE="${HOME}/.cache/dotfiles_sync_status"
 FETCH_MARKER="${HOME}/.cache/dotfiles_sync.last_fetch"
+DRIFT_FILE="${HOME}/.cache/dotfiles_drift"
+DRIFT_LOG="${HOME}/.cache/dotfiles_drift.log"
 LOCK_DIR="${HOME}/.cache/dotfiles_sync.lock.d"
 SETUP_DIR="${HOME}/Setup"
 MAX_AGE=1800  # 30 minutes in seconds
@@ -39,6 +41,15 @@ if (( needs_fetch )); then
     if (( needs_fetch )); then
       git fetch --quiet 2>/dev/null
       touch "$FETCH_MARKER"
+      # Count managed dotfiles not correctly linked on this host. Read-only;
+      # src_dotfiles keeps an inode/mtime cache so this stays cheap. Uses the
+      # project venv (pydantic etc.); errors go to DRIFT_LOG and leave "?"
+      # instead of a count, so a broken check never reads as "no drift".
+      if report=$("$SETUP_DIR/.venv/bin/python" -m src_dotfiles status 2>"$DRIFT_LOG"); then
+        grep -cE '^(missing|shadowed|dangling|wrong_target|variant_mismatch|error) ' <<< "$report" > "$DRIFT_FILE"
+      else
+        echo "?" > "$DRIFT_FILE"
+      fi
     fi
   fi
   # If we couldn't get the lock, another session is fetching — just skip
@@ -64,4 +75,11 @@ if [[ -n "$remote_head" && "$local_head" != "$remote_head" ]]; then
   fi
 fi
 
+drift=$(cat "$DRIFT_FILE" 2>/dev/null)
+if [[ "$drift" == "?" ]]; then
+  status="${status:+$status }drift?"
+elif [[ -n "$drift" && "$drift" != "0" ]]; then
+  status="${status:+$status }drift"
+fi
+
 echo "${status:-ok}" > "$CACHE_FILE"
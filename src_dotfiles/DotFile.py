@@ -1,14 +1,16 @@
 # File operations
 import os
 import shutil
+import stat
 import subprocess
 from datetime import datetime
-from src_dotfiles.config import config
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.blobstore import BlobStore, tree_modes
 from pathlib import Path
-from ezpy_logs.LoggerFactory import LoggerFactory
-from src_dotfiles.models import DotFileModel, BackupMetadata, Identifier, DeployedDotFile, DevicesData
+from typing import Callable, List, Optional, Set
+from src_dotfiles.models import DotFileModel, BackupMetadata, Identifier, DeployedDotFile, DevicesData, DeployAction
 
-logger = LoggerFactory.getLogger(__name__)
+logger = get_logger(__name__)
 DATETIME_FORMAT = "%Y-%m-%d_%H:%M:%S.%f"
 
 def get_time() -> str:
@@ -21,6 +23,39 @@ def get_time() -> str:
     current_time = now.strftime(DATETIME_FORMAT)
     return current_time
 
+def backup_store() -> BlobStore:
+    """Blob store holding backup contents for the current config."""
+    return BlobStore(Path(config.project_path).joinpath(config.objects_dir))
+
+def restore_backup(backup: BackupMetadata, dest: str) -> None:
+    """Materialize a backup snapshot at `dest` as regular files.
+
+    Uses the blob store when the backup has a manifest, and falls back to
+    copying `backup_path` for legacy full-copy backups, or when a blob is
+    missing (e.g. pruned by another device sharing the same content).
+    """
+    if backup.manifest is not None and backup_store().has(backup.manifest):
+        backup_store().materialize(backup.manifest, dest, backup.modes)
+    elif os.path.isdir(backup.backup_path):
+        shutil.copytree(backup.backup_path, dest)
+    else:
+        shutil.copy(backup.backup_path, dest)
+    logger.info(f"Restored {backup.backup_path} to {dest}")
+
+class NeedsPrivilege(PermissionError):
+    """Raised by `DotFile.apply(escalate=False)` instead of running sudo itself."""
+
+def _parent_writable(path: str) -> bool:
+    """Whether the current user can create/remove entries next to `path`.
+
+    Walks up to the nearest existing ancestor, since `_deploy_as_user`
+    creates missing parent directories itself.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    return os.access(parent, os.W_OK)
+
 class DotFile:
     """Operations wrapper for a dotfile in the system.
     
@@ -31,15 +66,26 @@ class DotFile:
 
     The state is stored in the provided DotFileModel instance.
     """
-    def __init__(self, data: DotFileModel, identifier: Identifier = config.identifier):
+    def __init__(self, data: DotFileModel, identifier: Optional[Identifier] = None):
         """Initialize with a DotFileModel instance.
 
         Args:
             data (DotFileModel): The model containing the dotfile's state
-            identifier (str): The identifier of the device where the dotfile is deployed
+            identifier (Optional[str]): The identifier of the device where the dotfile
+                is deployed. Default: the current device
         """
         self.data = data
-        self.identifier = identifier
+        self.identifier = identifier if identifier is not None else config.identifier
+
+    @property
+    def alias(self) -> str:
+        """Alias of the dotfile."""
+        return self.data.alias
+
+    @property
+    def materialized(self) -> bool:
+        """Whether `data` is built. Always True here; see LazyDotFile."""
+        return True
 
     def add_file(self, use_as_main: bool = True, deploy: bool = True) -> None:
         """Add a new dotfile to be managed.
@@ -59,6 +105,110 @@ class DotFile:
         if deploy:
             self.deploy()
 
+    def _source(self) -> str:
+        """Absolute path of this device's variant if one exists, otherwise of main."""
+        source = self.data.main
+        if self.data.variants and self.identifier in self.data.variants:
+            source = self.data.variants[self.identifier]
+            logger.info(f"Using variant for {self.identifier}: {source}")
+        return Path(config.project_path).joinpath(source).as_posix()
+
+    def source_path(self, render: bool = True) -> str:
+        """Absolute path the deploy symlink must point to.
+
+        Resolves the variant for this device if one exists, otherwise main.
+        For a template, that source is rendered for this device first (a no-op
+        when neither it nor the device variables changed) and the rendered
+        copy is returned.
+
+        Args:
+            render (bool): False to only compute where a template is rendered,
+                without reading or writing anything
+        """
+        source = self._source()
+        if self.data.template:
+            from src_dotfiles.template import render_to_cache, rendered_path
+            if not render:
+                return rendered_path(self.data.alias, self.identifier).as_posix()
+            return render_to_cache(source, self.data.alias, config.device_data).as_posix()
+        return source
+
+    def plan(self, render: bool = True) -> DeployAction:
+        """Inspect the deploy path once and decide what `apply` has to do.
+
+        Does not touch the deploy path: a single lstat (plus a readlink for
+        symlinks) is enough to classify the target. A template is rendered
+        into the render cache first, unless `render` is False: it is then only
+        rendered in memory, so that a broken one still raises `TemplateError`.
+        """
+        deploy_path = self.data.deploy[self.identifier].deploy_path
+        target = self.source_path(render=render)
+        if self.data.template and not render:
+            from src_dotfiles.template import device_variables
+            from src_dotfiles.template import render as render_text
+            render_text(Path(self._source()).read_text(), device_variables(config.device_data))
+        if self.data.farm:
+            return self._plan_farm(DeployAction(alias=self.data.alias, deploy_path=deploy_path, target=target, kind="noop"))
+        action = DeployAction(alias=self.data.alias, deploy_path=deploy_path, target=target, kind="create")
+
+        try:
+            st = os.lstat(deploy_path)
+        except FileNotFoundError:
+            st = None
+
+        if st is not None and stat.S_ISLNK(st.st_mode):
+            action.current = os.readlink(deploy_path)
+            if action.current == target:
+                action.kind = "noop"
+                return action
+            action.kind = "replace_file"
+        elif st is not None and stat.S_ISDIR(st.st_mode):
+            action.kind = "replace_dir"
+            action.backup = True
+        elif st is not None:
+            action.kind = "replace_file"
+            action.backup = True
+
+        if not _parent_writable(deploy_path):
+            action.kind = "sudo"
+        return action
+
+    def apply(self, action: DeployAction, escalate: bool = True) -> bool:
+        """Execute a planned action. Returns False for a noop, True otherwise.
+
+        Does not back up: callers check `action.backup` and call `backup()`
+        first, the same way `deploy` callers always have.
+
+        Args:
+            action (DeployAction): Result of `plan()`
+            escalate (bool): Run `sudo ln` when root is needed. If False, raise
+                NeedsPrivilege instead so the caller can batch elevated work
+
+        Raises:
+            NeedsPrivilege: If escalate is False and the action needs root
+        """
+        if action.kind == "noop":
+            logger.debug(f"{action.deploy_path} already symlinks to {action.target}; skipping")
+            return False
+
+        if action.kind == "farm":
+            self._apply_farm(action)
+        elif action.kind == "sudo":
+            if not escalate:
+                raise NeedsPrivilege(f"{action.deploy_path}: parent directory not writable")
+            self._deploy_via_sudo(action.deploy_path, action.target)
+        else:
+            try:
+                self._deploy_as_user(action.deploy_path, action.target)
+            except PermissionError as e:
+                if not escalate:
+                    raise NeedsPrivilege(f"{action.deploy_path}: permission denied ({e})") from e
+                logger.warning(f"{action.deploy_path}: permission denied ({e}); escalating via sudo")
+                self._deploy_via_sudo(action.deploy_path, action.target)
+
+        logger.info(f"Symlink created {action.deploy_path} -> {action.target}")
+        return True
+
     def deploy(self) -> bool:
         """Deploy the dotfile in the system.
 
@@ -71,28 +221,95 @@ class DotFile:
         /etc/nginx/nginx.conf), falls back to `sudo ln -sfn` for just that
         one entry — keeps the rest of the run as the unprivileged user.
         """
-        deploy_path = self.data.deploy[self.identifier].deploy_path
+        return self.apply(self.plan())
 
-        # Resolve variant: use device-specific file if one exists, otherwise main
-        source = self.data.main
-        if self.data.variants and self.identifier in self.data.variants:
-            source = self.data.variants[self.identifier]
-            logger.info(f"Using variant for {self.identifier}: {source}")
-        target = Path(config.project_path).joinpath(source).as_posix()
+    def farm_files(self) -> List[str]:
+        """Entries a farm deploy links: every file (or symlink) below the source, relative to it."""
+        source = self.source_path()
+        rels = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            # A symlinked directory in the source is linked as one entry, not walked
+            linked_dirs = [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+            dirnames[:] = [d for d in dirnames if d not in linked_dirs]
+            for name in sorted(filenames + linked_dirs):
+                rels.append(Path(dirpath, name).relative_to(source).as_posix())
+        return rels
 
-        # Idempotent: already the right symlink → no-op.
-        if os.path.islink(deploy_path) and os.readlink(deploy_path) == target:
-            logger.debug(f"{deploy_path} already symlinks to {target}; skipping")
-            return False
+    def _plan_farm(self, action: DeployAction) -> DeployAction:
+        """Plan a farm deploy: which links are missing or wrong, which are stale.
 
+        Only entries of the source and links pointing into it are looked at;
+        anything else in the deploy directory is machine-local and left alone.
+        """
+        deploy_path, target = action.deploy_path, action.target
         try:
-            self._deploy_as_user(deploy_path, target)
-        except PermissionError as e:
-            logger.warning(f"{deploy_path}: permission denied ({e}); escalating via sudo")
-            self._deploy_via_sudo(deploy_path, target)
+            st = os.lstat(deploy_path)
+        except FileNotFoundError:
+            st = None
+        rels = self.farm_files()
 
-        logger.info(f"Symlink created {deploy_path} -> {target}")
-        return True
+        if st is not None and not stat.S_ISDIR(st.st_mode):
+            # A whole-directory symlink (plain mode) or a file where the tree should be
+            if stat.S_ISLNK(st.st_mode):
+                action.current = os.readlink(deploy_path)
+            else:
+                action.backup = True
+            action.kind = "farm"
+            action.links = rels
+            return action
+        if st is None:
+            action.links = rels
+        else:
+            for rel in rels:
+                link = os.path.join(deploy_path, rel)
+                try:
+                    link_st = os.lstat(link)
+                except FileNotFoundError:
+                    action.links.append(rel)
+                    continue
+                if not stat.S_ISLNK(link_st.st_mode):
+                    action.links.append(rel)
+                    action.conflicts.append(rel)
+                elif os.readlink(link) != os.path.join(target, rel):
+                    action.links.append(rel)
+            action.stale = self._stale_links(deploy_path, target, set(rels))
+
+        action.backup = bool(action.conflicts)
+        if action.links or action.stale:
+            action.kind = "farm"
+        return action
+
+    @staticmethod
+    def _stale_links(deploy_path: str, target: str, rels: Set[str]) -> List[str]:
+        """Links below deploy_path that point into `target` but match no source entry anymore."""
+        prefix = target.rstrip(os.sep) + os.sep
+        stale = []
+        for dirpath, dirnames, filenames in os.walk(deploy_path):
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path) and os.readlink(path).startswith(prefix):
+                    rel = Path(path).relative_to(deploy_path).as_posix()
+                    if rel not in rels:
+                        stale.append(rel)
+        return sorted(stale)
+
+    def _apply_farm(self, action: DeployAction) -> None:
+        """Reconcile the per-file links of a farm dotfile, leaving unrelated files alone."""
+        deploy_path = action.deploy_path
+        if os.path.islink(deploy_path) or (os.path.lexists(deploy_path) and not os.path.isdir(deploy_path)):
+            os.remove(deploy_path)
+        for rel in action.stale:
+            os.remove(os.path.join(deploy_path, rel))
+        for rel in action.links:
+            link = os.path.join(deploy_path, rel)
+            if os.path.isdir(link) and not os.path.islink(link):
+                shutil.rmtree(link)
+            elif os.path.lexists(link):
+                os.remove(link)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(os.path.join(action.target, rel), link)
+        logger.info(f"{action.alias}: {len(action.links)} link(s) made, {len(action.stale)} stale removed in {deploy_path}")
 
     def _deploy_as_user(self, deploy_path: str, target: str) -> None:
         """Remove anything at deploy_path and symlink target → deploy_path as the current user."""
@@ -131,8 +348,16 @@ class DotFile:
                 f"sudo ln failed for {deploy_path}: {result.stderr.strip() or 'unknown error'}"
             )
 
-    def backup(self) -> None:
-        """Create a backup of the current file if it exists and is not a symlink."""
+    def backup(self, rel_paths: Optional[List[str]] = None) -> None:
+        """Create a backup of the current file if it exists and is not a symlink.
+
+        Contents go to the content-addressed blob store; `backup_path` is laid
+        out as hardlinks to the blobs, so unchanged files cost no extra space.
+
+        Args:
+            rel_paths (Optional[List[str]]): Only back up these entries of a
+                directory (the conflicting files of a farm deploy)
+        """
         if not os.path.exists(self.data.deploy[self.identifier].deploy_path):
             logger.warning(f"{self.data.deploy[self.identifier].deploy_path} does not exist, no backup will be done")
             return
@@ -150,17 +375,30 @@ class DotFile:
         logger.debug(f"{backup_path = }")
         
         deploy_path = self.data.deploy[self.identifier].deploy_path
-        if os.path.isdir(deploy_path) and not os.path.islink(deploy_path):
-            shutil.copytree(deploy_path, backup_path)
+        if rel_paths:
+            manifest = backup_store().snapshot_paths(deploy_path, rel_paths, backup_path)
+            modes = tree_modes(deploy_path, rel_paths)
         else:
-            shutil.copy(deploy_path, backup_path)
-        logger.info(f"Backed up as {backup_path}")
+            manifest = backup_store().snapshot(deploy_path, backup_path)
+            modes = tree_modes(deploy_path)
+        logger.info(f"Backed up as {backup_path} ({len(manifest)} file(s))")
         
         self.data.deploy[self.identifier].backups.append(BackupMetadata(
             backup_path=backup_path,
-            datetime=stime
+            datetime=stime,
+            manifest=manifest,
+            modes=modes,
         ))
 
+    def restore_backup(self, backup: BackupMetadata, dest: str) -> None:
+        """Materialize a backup snapshot at `dest` as regular files.
+
+        Args:
+            backup (BackupMetadata): The backup to restore
+            dest (str): Where to recreate it (must not exist yet)
+        """
+        restore_backup(backup, dest)
+
     def copy_as_main(self, force: bool = False) -> None:
         """Copy the current file as the main version.
         
@@ -211,19 +449,16 @@ class DotFile:
             )
         logger.debug(f"Translated main: {new_main}")
 
-        # Create new model with translated paths
-        new_model = DotFileModel(
-            alias=self.data.alias,
-            main=new_main,
-            deploy={
+        # Copy the model with translated paths: every other field (farm, template...) carries over
+        new_model = self.data.model_copy(update={
+            "main": new_main,
+            "deploy": {
                 target_device.identifier: DeployedDotFile(
                     deploy_path=new_path,
                     backups=[]
                 )
             },
-            only_devices=self.data.only_devices,
-            variants=self.data.variants,
-        )
+        })
         
         return DotFile(new_model, target_device.identifier)
 
@@ -235,3 +470,42 @@ class DotFile:
             for b in deploy.backups:
                 msg += f"\t\t{b.datetime} -> {b.backup_path}\n"
         return msg
+
+
+class LazyDotFile(DotFile):
+    """DotFile whose model is only built the first time `data` is accessed.
+
+    Used for entries registered on another device: translating their paths
+    builds fresh Pydantic models, which commands touching a single alias
+    should not pay for every other entry of the registry.
+    """
+    def __init__(self, alias: str, identifier: Identifier, resolve: Callable[[], DotFileModel]):
+        """Initialize without building the model.
+
+        Args:
+            alias (str): Alias of the dotfile, known without resolving
+            identifier (str): The identifier of the device where the dotfile is deployed
+            resolve (Callable[[], DotFileModel]): Builds the model on first access
+        """
+        self._alias = alias
+        self._resolve = resolve
+        self._data = None
+        self.identifier = identifier
+
+    @property
+    def alias(self) -> str:
+        return self._alias
+
+    @property
+    def data(self) -> DotFileModel:
+        if self._data is None:
+            self._data = self._resolve()
+        return self._data
+
+    @data.setter
+    def data(self, value: DotFileModel) -> None:
+        self._data = value
+
+    @property
+    def materialized(self) -> bool:
+        return self._data is not None
@@ -1,17 +1,28 @@
 #!/usr/bin/env python3
 
-import fire
+from __future__ import annotations
+
+import glob
+import json
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from src_dotfiles.database import Dependencies
-from src_dotfiles.config import config
-from src_dotfiles.models import DeployedDotFile, DotFileModel
-from src_dotfiles.DotFile import DotFile
-from ezpy_logs.LoggerFactory import LoggerFactory
-from typing import Optional
+from src_dotfiles.config import config, get_logger, setup_logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Imported lazily at runtime: pydantic and the registry are only needed
+    # once a command actually runs, not for `--help` or shell completion.
+    from src_dotfiles.models import DeployAction
+    from src_dotfiles.database import Dependencies
+    from src_dotfiles.DotFile import DotFile
+    from src_dotfiles.journal import Journal
+
+logger = get_logger(__name__)
 
-LoggerFactory.setup_LoggerFactory()
-logger = LoggerFactory.getLogger(__name__)
+# (alias, outcome, reason) — outcome is one of "created", "skipped", "failed"
+DeployResult = Tuple[str, str, str]
 
 def path_security_check(path: str) -> bool:
     if not path.startswith(config.home):
@@ -22,9 +33,127 @@ def path_security_check(path: str) -> bool:
             return True
     return False
 
+MANIFEST_SUFFIXES = (".json", ".yaml", ".yml")
+
+def _load_manifest(manifest: str, allow_glob: bool) -> List[Any]:
+    """Read the entries of a batch manifest.
+
+    JSON and YAML files (a list of entries) are supported; YAML needs PyYAML.
+    With `allow_glob`, any other existing path is a single path entry, and
+    anything else is expanded as a glob pattern whose matches become path
+    entries.
+    """
+    path = Path(manifest).expanduser()
+    if path.is_file() and path.suffix in MANIFEST_SUFFIXES:
+        text = path.read_text()
+        if path.suffix in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(f"{manifest}: reading YAML manifests requires PyYAML (pip install pyyaml)")
+            entries = yaml.safe_load(text)
+        else:
+            entries = json.loads(text)
+        if not isinstance(entries, list):
+            raise ValueError(f"{manifest}: expected a list of entries, got {type(entries).__name__}")
+        return entries
+    if not allow_glob:
+        if path.exists():
+            raise ValueError(f"{manifest}: manifests are {', '.join(MANIFEST_SUFFIXES)} files")
+        raise FileNotFoundError(f"Manifest {manifest} does not exist")
+    if os.path.lexists(path):
+        return [os.path.abspath(path)]
+    matches = sorted(glob.glob(os.path.expanduser(manifest)))
+    if not matches:
+        logger.warning(f"{manifest} matches no file")
+    return [os.path.abspath(m) for m in matches]
+
+def _outcome_key(outcomes: Dict[str, str], key: str, index: int) -> str:
+    """Key of a batch entry in the outcome report, disambiguated by position if repeated."""
+    return f"{key} (#{index})" if key in outcomes else key
+
+def _deploy_one(
+    dot_file: DotFile,
+    action: Optional[DeployAction] = None,
+    escalate: bool = True,
+    journal: Optional[Journal] = None,
+) -> DeployResult:
+    """Apply the plan of a single dotfile (backing up first if needed), never raising.
+
+    Runs on worker threads in `deploy --jobs N`: each DotFile only touches its
+    own model and deploy path, so no shared state needs locking here. Without
+    a precomputed `action` the dotfile is planned on the spot. With
+    `escalate=False`, an entry needing root is backed up but reported as
+    "deferred" instead of running sudo. With a `journal`, the previous state
+    of the deploy path (and the backup just taken) is recorded before it is
+    touched.
+    """
+    from src_dotfiles.DotFile import NeedsPrivilege
+
+    a = dot_file.data.alias
+    try:
+        if action is None:
+            action = dot_file.plan()
+        backups = dot_file.data.deploy[dot_file.identifier].backups
+        taken = len(backups)
+        if action.backup:
+            dot_file.backup(action.conflicts or None)
+        if journal is not None and action.kind != "noop":
+            journal.prepare(action, backups[-1] if len(backups) > taken else None)
+        if dot_file.apply(action, escalate=escalate):
+            return a, "created", ""
+        return a, "skipped", ""
+    except NeedsPrivilege as e:
+        return a, "deferred", str(e)
+    except Exception as e:
+        logger.error(f"deploy failed for {a}: {e}")
+        return a, "failed", str(e)
+
+def _independent_groups(dot_files: List[DotFile]) -> List[List[DotFile]]:
+    """Partition dotfiles so that nested deploy paths end up in the same group.
+
+    Two entries are dependent when one deploy path contains the other (e.g. a
+    directory dotfile and a file inside it): replacing the parent would race
+    with the child. Groups keep registry order, so running each group serially
+    on its own worker preserves the serial semantics.
+    """
+    # Each group: (positions in dot_files, deploy paths)
+    groups: List[Tuple[List[int], List[str]]] = []
+    for position, dot_file in enumerate(dot_files):
+        path = os.path.abspath(dot_file.data.deploy[dot_file.identifier].deploy_path)
+        merged: Tuple[List[int], List[str]] = ([position], [path])
+        remaining = []
+        # A path may nest with several groups (a parent of two siblings): merge them all
+        for positions, paths in groups:
+            if any(os.path.commonpath([path, p]) in (path, p) for p in paths):
+                merged[0].extend(positions)
+                merged[1].extend(paths)
+            else:
+                remaining.append((positions, paths))
+        groups = remaining + [merged]
+    groups.sort(key=lambda group: min(group[0]))
+    return [[dot_files[i] for i in sorted(positions)] for positions, _ in groups]
+
 class ManageDotfiles:
     def __init__(self):
-        self.db = Dependencies()
+        self._db: Optional["Dependencies"] = None
+
+    @property
+    def db(self) -> "Dependencies":
+        """The registry, loaded on first use under the exclusive registry lock."""
+        if self._db is None:
+            from src_dotfiles.database import Dependencies
+            self._db = Dependencies()
+        return self._db
+
+    def _read_only(self) -> None:
+        """Load the registry without the lock, for commands that never save it.
+
+        They then never wait behind a running deploy (e.g. `status` from a shell hook).
+        """
+        if self._db is None:
+            from src_dotfiles.database import Dependencies
+            self._db = Dependencies(read_only=True)
 
     def add(self, path: str, alias: Optional[str] = None, force: bool = False, only_device: Optional[str] = None) -> Optional[str]:
         """Add a new dotfile to be managed by the system.
@@ -41,6 +170,13 @@ class ManageDotfiles:
         Raises:
             NotImplementedError: If force=True and trying to add different path for existing alias
         """
+        added = self._add(path, alias, force, only_device)
+        if added is not None:
+            self.db.save_all()
+        return added
+
+    def _add(self, path: str, alias: Optional[str] = None, force: bool = False, only_device: Optional[str] = None) -> Optional[str]:
+        """`add` without saving the registry; see `add` for the arguments."""
         logger.debug(f"{path = } {alias = } {force = } {only_device = }")
 
         new_dot_file = self.db.create_dotfile(path, alias, only_device=only_device)
@@ -49,8 +185,7 @@ class ManageDotfiles:
         if not current_dot_file:
             logger.info(f"Alias {new_dot_file.data.alias} does not exist in the system")
             new_dot_file.add_file()
-            self.db.data.append(new_dot_file)
-            self.db.save_all()
+            self.db.add_dotfile(new_dot_file)
             return new_dot_file.data.alias
         else:       
             if current_dot_file and not force:
@@ -64,8 +199,7 @@ class ManageDotfiles:
                 # Path resolution is way more complex than this :/
                 new_dot_file.backup()
                 new_dot_file.deploy()
-                self.db.data.append(new_dot_file)
-                self.db.save_all()
+                self.db.add_dotfile(new_dot_file, replace=True)
                 return new_dot_file.data.alias
             else:
                 logger.error("Argument path is different from the one in the system")
@@ -102,6 +236,23 @@ class ManageDotfiles:
             Optional[str]: The alias on success, None on collision (force=False)
                 or missing source.
         """
+        registered = self._register(alias, deploy_path, main, only_device, force)
+        if registered is not None:
+            self.db.save_all()
+        return registered
+
+    def _register(
+        self,
+        alias: str,
+        deploy_path: str,
+        main: Optional[str] = None,
+        only_device: Optional[str] = None,
+        force: bool = False,
+    ) -> Optional[str]:
+        """`register` without saving the registry; see `register` for the arguments."""
+        from src_dotfiles.DotFile import DotFile
+        from src_dotfiles.models import DeployedDotFile, DotFileModel
+
         logger.debug(f"{alias = } {deploy_path = } {main = } {only_device = } {force = }")
 
         if main is None:
@@ -144,11 +295,70 @@ class ManageDotfiles:
         dot_file = DotFile(model, identifier)
         dot_file.deploy()  # symlink only — no backup/copy, source is already in place
         self.db.metadata.dotfiles[alias] = model
-        self.db.data.append(dot_file)
-        self.db.save_all()
+        self.db.add_dotfile(dot_file, replace=existing is not None)
         logger.info(f"register: {alias} -> {deploy_path} (main={main})")
         return alias
 
+    def add_many(self, manifest: str) -> Dict[str, str]:
+        """Add many dotfiles in one load/save cycle.
+
+        Args:
+            manifest (str): A JSON/YAML file listing the entries, or a glob
+                (e.g. "~/.config/foo/*.conf") whose matches are added with
+                default aliases. Each manifest entry is either a path or a
+                mapping with the `add` arguments: path, alias, force, only_device.
+
+        Returns:
+            Dict[str, str]: Outcome per entry ("added <alias>", "skipped" or "failed: <reason>"),
+                keyed by path (suffixed with the entry's position when a path repeats)
+        """
+        entries = _load_manifest(manifest, allow_glob=True)
+        outcomes = {}
+        for i, entry in enumerate(entries):
+            kwargs = {"path": entry} if isinstance(entry, str) else dict(entry)
+            key = _outcome_key(outcomes, str(kwargs.get("path")), i)
+            try:
+                added = self._add(**kwargs)
+                outcomes[key] = f"added {added}" if added is not None else "skipped"
+            except Exception as e:
+                logger.error(f"add-many: {key} failed: {e!r}")
+                outcomes[key] = f"failed: {e!r}"
+        self._finish_batch("add-many", outcomes)
+        return outcomes
+
+    def register_many(self, manifest: str) -> Dict[str, str]:
+        """Register many in-place dotfiles in one load/save cycle.
+
+        Args:
+            manifest (str): A JSON/YAML file listing mappings with the `register`
+                arguments: alias, deploy_path, main, only_device, force.
+
+        Returns:
+            Dict[str, str]: Outcome per alias ("registered", "skipped" or "failed: <reason>")
+        """
+        entries = _load_manifest(manifest, allow_glob=False)
+        outcomes = {}
+        for i, entry in enumerate(entries):
+            key = _outcome_key(outcomes, str(entry.get("alias") if isinstance(entry, dict) else entry), i)
+            try:
+                if not isinstance(entry, dict):
+                    raise ValueError("register-many entries must be mappings")
+                registered = self._register(**entry)
+                outcomes[key] = "registered" if registered is not None else "skipped"
+            except Exception as e:
+                logger.error(f"register-many: {key} failed: {e!r}")
+                outcomes[key] = f"failed: {e!r}"
+        self._finish_batch("register-many", outcomes)
+        return outcomes
+
+    def _finish_batch(self, command: str, outcomes: Dict[str, str]) -> None:
+        """Summarize a batch and write the registry once if anything changed."""
+        done = sum(1 for o in outcomes.values() if not o.startswith(("skipped", "failed")))
+        failed = sum(1 for o in outcomes.values() if o.startswith("failed"))
+        logger.info(f"{command} summary: {done} done, {len(outcomes) - done - failed} skipped, {failed} failed")
+        if done:
+            self.db.save_all()
+
     def extend_to(self, alias: str, device: str, deploy_path: Optional[str] = None) -> None:
         """Extend an existing dotfile to a new device.
 
@@ -165,6 +375,8 @@ class ManageDotfiles:
                 deploy entry — fine when the home_path is identical on both
                 devices, wrong otherwise.
         """
+        from src_dotfiles.models import DeployedDotFile
+
         model = self.db.metadata.dotfiles.get(alias)
         if model is None:
             logger.error(f"No dotfile with alias {alias!r} in registry")
@@ -199,8 +411,13 @@ class ManageDotfiles:
             logger.info(f"{device} already in only_devices")
 
         self.db.metadata.dotfiles[alias] = model
+        if device == config.identifier:
+            self.db.refresh(alias)
         self.db.save_all()
-        logger.info(f"Saved. Now run `python -m src_dotfiles deploy --alias {alias}` on {device}.")
+        logger.info(
+            f"Saved. Now run `python -m src_dotfiles deploy --alias {alias}` on {device}, "
+            f"or `deploy --alias {alias} --hosts {device}` from here."
+        )
 
     def set_global(self, alias: str) -> None:
         """Mark a dotfile as eligible for deployment on every device.
@@ -222,49 +439,608 @@ class ManageDotfiles:
         previous = list(model.only_devices)
         model.only_devices = None
         self.db.metadata.dotfiles[alias] = model
+        self.db.refresh(alias)
         self.db.save_all()
         logger.info(f"{alias}: cleared only_devices (was {previous})")
 
-    def deploy(self, alias: Optional[str] = None) -> None:
+    def set_template(self, alias: str, template: bool = True) -> None:
+        """Mark a single-file dotfile's source (main and variants) as a template rendered per device.
+
+        Templates use `{{ home_path }}`-style variables from this device's
+        entry in `devices` (plus `system`) and `{% if identifier == "..." %}`
+        blocks, so one file can replace near-identical variants. `deploy`
+        links to the rendered copy in `dotfiles/rendered/<identifier>/`.
+
+        Args:
+            alias (str): Existing alias.
+            template (bool): False (--notemplate) to deploy the source as is again.
+        """
+        from src_dotfiles.template import TemplateError, render, device_variables
+
+        model = self.db.metadata.dotfiles.get(alias)
+        if model is None:
+            logger.error(f"No dotfile with alias {alias!r} in registry")
+            return
+        if template:
+            # main serves every device without a variant; a variant only its own device
+            sources = [(model.main, config.device_data)] + [
+                (variant, self.db.metadata.devices.get(identifier, config.device_data))
+                for identifier, variant in (model.variants or {}).items()
+            ]
+            for rel, device in sources:
+                source = Path(config.project_path).joinpath(rel)
+                if source.is_dir():
+                    logger.error(f"{alias}: only single files can be templates ({source} is a directory)")
+                    return
+                try:
+                    render(source.read_text(), device_variables(device))
+                except TemplateError as e:
+                    logger.error(f"{alias}: {source} does not render for {device.identifier}: {e}")
+                    return
+        model.template = template
+        self.db.metadata.dotfiles[alias] = model
+        self.db.refresh(alias)
+        self.db.save_all()
+        logger.info(f"{alias}: template={template}; run `deploy --alias {alias}` to relink")
+
+    def set_ssh_host(self, device: str, ssh_host: Optional[str] = None) -> None:
+        """Set how `deploy --hosts` reaches a device over SSH.
+
+        Args:
+            device (str): Device identifier (e.g. "TinyButMighty.ezalos").
+            ssh_host (Optional[str]): SSH destination ("user@host" or an ~/.ssh/config
+                alias). If omitted, resets to user@hostname guessed from the identifier.
+        """
+        data = self.db.metadata.devices.get(device)
+        if data is None:
+            logger.error(f"No device {device!r} in registry")
+            return
+        data.ssh_host = ssh_host
+        self.db.save_all()
+        logger.info(f"{device}: ssh_host={ssh_host}")
+
+    def set_farm(self, alias: str, farm: bool = True) -> None:
+        """Switch a directory dotfile between a per-file symlink farm and one directory symlink.
+
+        In farm mode, `deploy` keeps the deploy path a real directory and
+        links each file of the source into it: missing links are created,
+        links to files removed from the source are deleted, and files that
+        do not come from the source are never touched. Only files in the way
+        of a link are backed up. Run `deploy` afterwards to convert.
+
+        Args:
+            alias (str): Existing alias of a directory dotfile.
+            farm (bool): True for a symlink farm, False for a directory symlink.
+        """
+        model = self.db.metadata.dotfiles.get(alias)
+        if model is None:
+            logger.error(f"No dotfile with alias {alias!r} in registry")
+            return
+        if not Path(config.project_path).joinpath(model.main).is_dir():
+            logger.error(f"{alias}: {model.main} is not a directory; farm mode only applies to directories")
+            return
+        if model.farm == farm:
+            logger.info(f"{alias} already has farm={farm}; no change")
+            return
+        model.farm = farm
+        self.db.metadata.dotfiles[alias] = model
+        self.db.refresh(alias)
+        self.db.save_all()
+        logger.info(f"{alias}: farm={farm}; run `deploy` to apply")
+
+    def gc(
+        self,
+        keep_last: int = 5,
+        keep_daily: int = 7,
+        keep_weekly: int = 4,
+        max_size_mb: Optional[float] = None,
+        dry_run: bool = False,
+    ) -> None:
+        """Prune old backups of this device according to a retention policy.
+
+        Keeps, per dotfile, the `keep_last` newest backups plus the newest one of
+        each of the last `keep_daily` days and `keep_weekly` weeks, then drops the
+        oldest survivors, across all dotfiles, until the whole history fits in
+        `max_size_mb` (the newest backup of each dotfile is kept). Pruned entries
+        are removed from this device's history log and their files from
+        `dotfiles/old/`. Only blobs of the pruned backups are deleted, and only
+        if no backup known here still references them: other devices' logs are
+        not synced, so their blobs are never touched.
+
+        Args:
+            keep_last (int): Most recent backups always kept.
+            keep_daily (int): Days keeping their newest backup.
+            keep_weekly (int): ISO weeks keeping their newest backup.
+            max_size_mb (Optional[float]): Size budget of all of this device's backups, in MiB.
+            dry_run (bool): Only report what would be pruned.
+        """
+        from src_dotfiles.DotFile import backup_store
+        from src_dotfiles.storage import iter_histories
+        from src_dotfiles.retention import disk_usage, fit_budget, select_backups
+
+        backup_root = Path(config.project_path).joinpath(config.backup_dir).resolve().as_posix()
+        # translated from another device and never touched: no local history
+        dot_files = [dot_file for dot_file in self.db.data if dot_file.materialized]
+        selected = [
+            select_backups(dot_file.data.deploy[dot_file.identifier].backups, keep_last, keep_daily, keep_weekly)
+            for dot_file in dot_files
+        ]
+        if max_size_mb is not None:
+            seen = set()  # inodes already counted: snapshots share blobs across dotfiles too
+            selected = fit_budget(selected, int(max_size_mb * 1024 * 1024),
+                                  size_of=lambda b: disk_usage(b.backup_path, seen))
+        pruned = 0
+        candidates = set()  # blobs of the pruned backups
+        for dot_file, kept in zip(dot_files, selected):
+            deploy = dot_file.data.deploy[dot_file.identifier]
+            kept_keys = {id(b) for b in kept}
+            removed = [b for b in deploy.backups if id(b) not in kept_keys]
+            if not removed:
+                continue
+            logger.info(f"gc: {dot_file.data.alias}: pruning {len(removed)} of {len(deploy.backups)} backup(s)")
+            pruned += len(removed)
+            candidates.update(digest for b in removed if b.manifest for digest in b.manifest.values())
+            if dry_run:
+                for b in removed:
+                    logger.info(f"  would remove {b.datetime} -> {b.backup_path}")
+                continue
+            for b in removed:
+                path = os.path.realpath(b.backup_path)
+                if os.path.commonpath([path, backup_root]) != backup_root:
+                    logger.warning(f"gc: {b.backup_path} is outside {backup_root}; keeping the file")
+                elif os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            deploy.backups[:] = kept
+            db_model = self.db.metadata.dotfiles.get(dot_file.data.alias)
+            if db_model is not None and dot_file.identifier in db_model.deploy:
+                db_model.deploy[dot_file.identifier].backups[:] = kept
+
+        if dry_run:
+            logger.info(f"gc (dry run): {pruned} backup(s) would be pruned")
+            return
+        self.db.update_dotfiles(self.db.data)
+        referenced = {
+            digest
+            for model in self.db.metadata.dotfiles.values()
+            for deployed in model.deploy.values()
+            for b in deployed.backups if b.manifest
+            for digest in b.manifest.values()
+        }
+        # Other devices' histories present here (e.g. imported into SQLite)
+        referenced.update(
+            digest
+            for histories in iter_histories(self.db.storage, exclude=config.identifier)
+            for backups in histories.values()
+            for b in backups if b.manifest
+            for digest in b.manifest.values()
+        )
+        blobs, freed = backup_store().prune(referenced, candidates)
+        logger.info(f"gc: pruned {pruned} backup(s), {blobs} blob(s), {freed / 1024:.1f} KiB freed")
+        self.db.save_all()
+
+    def export_json(self) -> None:
+        """Write the SQLite registry to dotfiles.json and the history logs, to commit and sync them."""
+        from src_dotfiles.storage import JsonStorage, SqliteStorage, copy_registry
+
+        if not isinstance(self.db.storage, SqliteStorage):
+            logger.warning("export-json: the registry already is dotfiles.json (set DOTFILES_STORAGE=sqlite)")
+            return None
+        self.db.save_all()
+        copy_registry(self.db.storage, JsonStorage(self.db.get_db_path()))
+
+    def import_json(self) -> None:
+        """Replace the SQLite registry with dotfiles.json and the history logs (e.g. after a git pull)."""
+        from src_dotfiles.storage import JsonStorage, SqliteStorage, copy_registry
+
+        if not isinstance(self.db.storage, SqliteStorage):
+            logger.warning("import-json: the registry already is dotfiles.json (set DOTFILES_STORAGE=sqlite)")
+            return None
+        copy_registry(JsonStorage(self.db.get_db_path()), self.db.storage)
+        # What is in memory predates the import: never save it over the imported registry
+        self.db.close()
+
+    def deploy(
+        self,
+        alias: Optional[str] = None,
+        jobs: int = 1,
+        transactional: bool = False,
+        hosts: Optional[Any] = None,
+        discard_journal: bool = False,
+        overwrite_registry: bool = False,
+    ) -> None:
         """Deploy dotfiles to the system.
 
         Idempotent: already-correct symlinks are skipped silently. In all-mode,
         per-file failures are caught and reported in a summary instead of
         aborting the run.
 
+        An unfinished transactional deploy (journal left by a crash) is always
+        rolled back first.
+
         Args:
             alias (Optional[str]):  Alias of the dotfile to deploy.
                                     If not provided, will deploy all dotfiles.
+            jobs (int): Number of worker threads used in all-mode. Dotfiles with
+                        nested deploy paths always run on the same worker. The
+                        summary is reported in registry order whatever the value.
+            transactional (bool): Journal every deploy path before touching it;
+                                  if any entry fails (or on Ctrl-C), put every
+                                  path back as it was before the run.
+            hosts (Optional[str | List[str]]): Deploy on these devices over SSH
+                                  instead of locally ("all" for every other
+                                  registered device), `jobs` hosts at a time.
+                                  This device's dotfiles.json replaces theirs;
+                                  a host whose copy changed since the last push
+                                  from here is refused.
+            discard_journal (bool): Drop the journal of an unfinished deploy
+                                  whose rollback keeps failing (after fixing the
+                                  paths it reports by hand) instead of rolling
+                                  it back again.
+            overwrite_registry (bool): With --hosts, push dotfiles.json even to
+                                  hosts whose copy changed since the last push.
         """
+        from src_dotfiles.journal import Journal
+
+        if hosts is not None:
+            return self._deploy_hosts(hosts, alias, jobs, transactional, overwrite_registry)
+
+        journal = Journal(Path(config.project_path).joinpath(config.dotfiles_dir, ".deploy_journal.jsonl"))
+        if journal.exists() and discard_journal:
+            logger.warning(f"{journal.path}: discarding the unfinished deploy without reverting it")
+            self._keep_journaled_backups(journal.records())
+            journal.commit()
+            self.db.save_all()
+        elif journal.exists():
+            logger.warning(f"{journal.path}: previous deploy did not finish; rolling it back")
+            if not self._rollback(journal):
+                logger.error(
+                    "deploy: the previous deploy could not be fully rolled back; nothing deployed. "
+                    "Revert the paths listed above by hand (e.g. with sudo for root-owned links) "
+                    "and run `deploy --discard-journal`, or run deploy again to retry the rollback."
+                )
+                return
+        if not transactional:
+            journal = None
+        else:
+            journal.begin()
+        try:
+            failed = self._deploy(alias, jobs, journal)
+        except BaseException:
+            if journal is not None:
+                logger.warning("deploy interrupted; rolling back")
+                self._rollback(journal)
+            raise
+        if journal is not None:
+            if failed:
+                logger.warning(f"deploy: {len(failed)} failure(s); rolling back")
+                self._rollback(journal)
+            else:
+                journal.commit()
+        self.db.save_all()
+
+    def _deploy(self, alias: Optional[str], jobs: int, journal: Optional[Journal]) -> List[Tuple[str, str]]:
+        """Body of `deploy`; returns the (alias, reason) of failed entries."""
         if alias is None:
-            logger.info("Deploying all dotfiles")
-            created, skipped, failed = [], [], []
-            for dot_file in self.db.data:
-                a = dot_file.data.alias
-                try:
-                    dot_file.backup()
-                    if dot_file.deploy():
-                        created.append(a)
-                    else:
-                        skipped.append(a)
-                except Exception as e:
-                    logger.error(f"deploy failed for {a}: {e}")
-                    failed.append((a, str(e)))
+            logger.info(f"Deploying all dotfiles ({jobs = })")
+            actions = self._plan_all(self.db.data)
+            pending = [d for d in self.db.data if actions.get(id(d)) is None or actions[id(d)].kind != "noop"]
+            if not pending:
+                logger.info(f"deploy summary: nothing to do, {len(self.db.data)} already correct")
+                return []
+            applied = {id(d): r for d, r in zip(pending, self._deploy_all(pending, jobs, actions, journal))}
+            results = [applied.get(id(d), (d.data.alias, "skipped", "")) for d in self.db.data]
+            created = [a for a, outcome, _ in results if outcome == "created"]
+            skipped = [a for a, outcome, _ in results if outcome == "skipped"]
+            failed = [(a, reason) for a, outcome, reason in results if outcome == "failed"]
             logger.info(
                 f"deploy summary: {len(created)} created, "
                 f"{len(skipped)} already correct, {len(failed)} failed"
             )
             for a, reason in failed:
                 logger.warning(f"  FAILED {a}: {reason}")
+            return failed
+        dot_file = self.db.select_by_alias(alias)
+        if dot_file is None:
+            logger.warning(f"There is no match in database for {alias}")
+            return []
+        logger.info(f"Deploying {alias}")
+        if journal is not None:
+            a, outcome, reason = _deploy_one(dot_file, journal=journal)
+            return [(a, reason)] if outcome == "failed" else []
+        action = dot_file.plan()
+        if action.backup:
+            dot_file.backup(action.conflicts or None)
+        dot_file.apply(action)
+        return []
+
+    def _deploy_hosts(
+        self, hosts: Any, alias: Optional[str], jobs: int, transactional: bool, overwrite_registry: bool = False
+    ) -> None:
+        """Fan `deploy` out to other devices and log a merged per-host summary.
+
+        Hosts deploy from the pushed dotfiles.json: with the SQLite registry,
+        it is exported first so that they never get a stale one.
+        """
+        from src_dotfiles.fanout import fan_out
+        from src_dotfiles.storage import SqliteStorage
+
+        names = hosts.split(",") if isinstance(hosts, str) else [str(h) for h in hosts]
+        devices = self.db.metadata.devices
+        if names == ["all"]:
+            selected = [d for identifier, d in devices.items() if identifier != config.identifier]
         else:
-            dot_file = self.db.select_by_alias(alias)
-            if dot_file is None:
-                logger.warning(f"There is no match in database for {alias}")
+            by_name = {**{d.ssh_host: d for d in devices.values() if d.ssh_host}, **devices}
+            unknown = [n for n in names if n not in by_name]
+            if unknown:
+                logger.error(f"Unknown device(s) {unknown}; known: {sorted(devices)}")
                 return None
-            logger.info(f"Deploying {alias}")
-            dot_file.backup()
-            dot_file.deploy()
+            selected = [by_name[n] for n in names]
+        args = (["--alias", alias] if alias else []) + (["--transactional"] if transactional else [])
+        if isinstance(self.db.storage, SqliteStorage):
+            logger.info("Exporting the SQLite registry to dotfiles.json before pushing it")
+            self.export_json()
+        logger.info(f"Deploying on {len(selected)} host(s) ({jobs = })")
+        results = fan_out(self.db.metadata, selected, jobs, args, alias, overwrite_registry=overwrite_registry)
+        failed = sum(1 for _, outcome, _, _ in results if outcome != "ok")
+        logger.info(f"hosts summary: {len(results) - failed} ok, {failed} failed")
+        for name, outcome, pushed, detail in results:
+            logger.info(f"  {outcome.upper():<6} {name}: {pushed} file(s) pushed; {detail}")
+
+    def _rollback(self, journal: Journal) -> bool:
+        """Revert the paths recorded in `journal`, keeping the backups it references in the registry.
+
+        Returns:
+            bool: Whether every path was reverted (the journal is kept otherwise)
+        """
+        records, failed = journal.rollback()
+        self._keep_journaled_backups(records)
+        for deploy_path, error in failed:
+            logger.error(f"  NOT REVERTED {deploy_path}: {error} (journal kept at {journal.path})")
         self.db.save_all()
+        return not failed
+
+    def _keep_journaled_backups(self, records: List[dict]) -> None:
+        """Re-attach the backups journaled in `records` to their entries.
+
+        Backups taken during the reverted run may never have been saved (e.g.
+        after a crash): they are re-attached so that gc does not prune the
+        blobs the restored content came from.
+        """
+        from src_dotfiles.retention import backup_key
+        from src_dotfiles.models import BackupMetadata
+
+        for record in records:
+            dot_file = self.db.select_by_alias(record["alias"])
+            if record["backup"] is None or dot_file is None:
+                continue
+            backups = dot_file.data.deploy[dot_file.identifier].backups
+            backup = BackupMetadata(**record["backup"])
+            if backup_key(backup) not in {backup_key(b) for b in backups}:
+                backups.append(backup)
+
+    def plan(self) -> None:
+        """Print what `deploy` would do on this device, without touching anything."""
+        self._read_only()
+        actions = self._plan_all(self.db.data, render=False)
+        for dot_file in self.db.data:
+            action = actions.get(id(dot_file))
+            if action is None:
+                print(f"{'error':<13} {dot_file.data.alias}")
+                continue
+            detail = ""
+            if action.kind == "farm":
+                detail = f" ({len(action.links)} to link, {len(action.stale)} stale, {len(action.conflicts)} conflicting)"
+            print(f"{action.kind:<13} {action.alias}: {action.deploy_path} -> {action.target}{detail}")
+        pending = [a for a in actions.values() if a.kind != "noop"]
+        logger.info(f"plan: {len(pending)} change(s), {len(actions) - len(pending)} already correct")
+
+    def status(self) -> None:
+        """Report how every managed dotfile is deployed on this device. Read-only.
+
+        Each entry is one of: ok, missing, shadowed (a regular file or directory
+        is in the way), dangling, wrong_target, variant_mismatch (linked to main
+        or another device's variant). Results are cached by inode/mtime in
+        `dotfiles/.status_cache.json`, so repeated checks only look again at
+        the paths that changed. The registry is never saved.
+        """
+        from src_dotfiles import status as drift
+        from src_dotfiles.template import TemplateError
+
+        self._read_only()
+        cache = drift.StatusCache(Path(config.project_path).joinpath(config.dotfiles_dir, ".status_cache.json"))
+        statuses, deploy_paths = {}, []
+        for dot_file in self.db.data:
+            deploy_path = dot_file.data.deploy[dot_file.identifier].deploy_path
+            deploy_paths.append(deploy_path)
+            try:
+                kind, current = drift.check(dot_file, cache)
+            except (OSError, TemplateError) as e:
+                logger.error(f"status failed for {dot_file.data.alias}: {e}")
+                kind, current = "error", None
+            statuses[dot_file.data.alias] = kind
+            print(f"{kind:<17} {dot_file.data.alias}: {deploy_path}" + (f" -> {current}" if kind not in ("ok", "missing", "shadowed") else ""))
+        cache.retain(deploy_paths)
+        cache.save()
+        drifted = sum(1 for kind in statuses.values() if kind != drift.OK)
+        logger.info(f"status: {drifted} drifted, {len(statuses) - drifted} ok ({cache.hits} cached)")
+
+    def capture(self, alias: Optional[str] = None, promote: bool = False, merge: bool = False) -> None:
+        """Find deployed copies edited in place and show (or fold back) their changes.
+
+        A deploy path that is a regular file or directory instead of the
+        symlink is hashed against main and the variants. Copies identical to
+        a source are only reported; divergent ones get a unified diff against
+        this device's source, or with --merge a three-way merge (git
+        merge-file) that uses the last backup as base.
+
+        With --promote, the deployed content (or the merge result, if it has
+        no conflicts) becomes the new source, and the deploy path is backed
+        up and turned back into the symlink.
+
+        Args:
+            alias (Optional[str]): Only look at this dotfile.
+            promote (bool): Write the changes into main (or this device's variant).
+            merge (bool): Three-way merge instead of taking the deployed copy as is.
+        """
+        from src_dotfiles import capture as cap
+
+        if not promote:
+            self._read_only()
+        if alias is not None:
+            dot_file = self.db.select_by_alias(alias)
+            if dot_file is None:
+                logger.error(f"capture: no dotfile with alias {alias}")
+                return
+            dot_files = [dot_file]
+        else:
+            dot_files = self.db.data
+
+        promoted = 0
+        for dot_file in dot_files:
+            state, same_as, _ = cap.compare(dot_file)
+            deploy_path = dot_file.data.deploy[dot_file.identifier].deploy_path
+            if state == cap.IDENTICAL:
+                logger.info(f"capture: {dot_file.data.alias}: {deploy_path} is a copy of {same_as}; `deploy` will relink it")
+            if state != cap.DIVERGENT:
+                continue
+
+            content = None
+            if merge:
+                try:
+                    content, conflicts = cap.three_way_merge(dot_file)
+                except ValueError as e:
+                    logger.error(f"capture: {e}")
+                    continue
+                except (RuntimeError, FileNotFoundError) as e:
+                    # git merge-file failed, or git is not installed
+                    logger.error(f"capture: {dot_file.data.alias}: cannot merge: {e}")
+                    continue
+                print(content, end="")
+                if conflicts:
+                    logger.warning(f"capture: {dot_file.data.alias}: {conflicts} conflict(s); resolve them before promoting")
+                    continue
+            else:
+                for line in cap.unified_diff(dot_file.source_path(), deploy_path):
+                    print(line, end="" if line.endswith("\n") else "\n")
+
+            if promote:
+                try:
+                    cap.promote(dot_file, content)
+                except ValueError as e:
+                    logger.error(f"capture: {e}")
+                    continue
+                dot_file.backup()
+                dot_file.apply(dot_file.plan())
+                promoted += 1
+
+        if promoted:
+            logger.info(f"capture: promoted {promoted} dotfile(s)")
+            self.db.save_all()
+
+    def watch(self, poll: bool = False, interval: float = 2.0) -> None:
+        """Keep deploy symlinks in place: back up and redeploy them as soon as they are clobbered.
+
+        Runs until interrupted. Uses inotify on the deploy paths' parent
+        directories (lstat polling with --poll, or where inotify is missing);
+        the registry is only locked while a path is being healed.
+
+        Args:
+            poll (bool): Poll instead of using inotify.
+            interval (float): Polling period in seconds.
+        """
+        from src_dotfiles.watch import Watcher
+
+        if self._db is not None:
+            self._db.close()  # the watcher reopens the registry for each heal
+        watcher = Watcher(poll=poll, interval=interval)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            logger.info(f"watch: stopped after healing {watcher.healed} dotfile(s)")
+
+    def _plan_all(self, dot_files: List[DotFile], render: bool = True) -> Dict[int, DeployAction]:
+        """Stat every deploy path once and return the actions keyed by id(dot_file).
+
+        Dotfiles that cannot be planned are left out; `_deploy_one` re-plans
+        them and reports the failure. With `render=False`, templates are not
+        written to the render cache (see `DotFile.plan`).
+        """
+        actions = {}
+        for dot_file in dot_files:
+            try:
+                actions[id(dot_file)] = dot_file.plan(render=render)
+            except Exception as e:
+                logger.error(f"plan failed for {dot_file.data.alias}: {e}")
+        return actions
+
+    def _deploy_all(
+        self,
+        dot_files: List[DotFile],
+        jobs: int = 1,
+        actions: Optional[Dict[int, DeployAction]] = None,
+        journal: Optional[Journal] = None,
+    ) -> List[DeployResult]:
+        """Deploy every dotfile, serially or on a bounded thread pool.
+
+        `actions` are the plans from `_plan_all`. Only the first entry of a
+        group of nested paths may use its precomputed plan: the others are
+        re-planned once the entries before them have been applied.
+
+        Entries that need root are collected and linked afterwards by a single
+        elevated helper, so sudo is asked for at most once per run.
+
+        Returns one result per dotfile, in the order of `dot_files`.
+        """
+        actions = actions or {}
+        groups = _independent_groups(dot_files)
+
+        def run_group(group: List[DotFile]) -> List[DeployResult]:
+            return [
+                _deploy_one(d, actions.get(id(d)) if i == 0 else None, escalate=False, journal=journal)
+                for i, d in enumerate(group)
+            ]
+
+        if jobs <= 1 or len(groups) <= 1:
+            grouped = [run_group(group) for group in groups]
+        else:
+            with ThreadPoolExecutor(max_workers=min(jobs, len(groups))) as pool:
+                grouped = list(pool.map(run_group, groups))
+
+        by_id = {id(d): r for group, rs in zip(groups, grouped) for d, r in zip(group, rs)}
+        deferred = [d for d in dot_files if by_id[id(d)][1] == "deferred"]
+        if deferred:
+            by_id.update(self._deploy_privileged(deferred))
+        return [by_id[id(d)] for d in dot_files]
+
+    def _deploy_privileged(self, dot_files: List[DotFile]) -> Dict[int, DeployResult]:
+        """Link root-owned deploy paths through one `sudo python -m src_dotfiles.privileged`.
+
+        Returns the results keyed by id(dot_file).
+        """
+        from src_dotfiles import privileged
+
+        requests = [{"deploy_path": d.data.deploy[d.identifier].deploy_path, "target": d.source_path()} for d in dot_files]
+        logger.info(f"deploy: {len(requests)} path(s) need root; running one elevated helper")
+        try:
+            results = privileged.run(requests, cwd=config.project_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"deploy: elevated helper failed: {e}")
+            return {id(d): (d.data.alias, "failed", str(e)) for d in dot_files}
+        outcomes = {}
+        for d, result in zip(dot_files, results):
+            if result["ok"]:
+                logger.info(f"Symlink created {result['deploy_path']} -> {d.source_path()} (as root)")
+            outcomes[id(d)] = (d.data.alias, "created" if result["ok"] else "failed", result["error"])
+        return outcomes
+
+def main() -> None:
+    """CLI entry point: fire (and logging) are only set up when a command runs."""
+    import fire
+
+    setup_logging()
+    fire.Fire(ManageDotfiles)
 
 if __name__ == "__main__":
-    fire.Fire(ManageDotfiles)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+from src_dotfiles.config import get_logger
+
+logger = get_logger(__name__)
+
+CHUNK_SIZE = 1 << 20
+# Manifest key used when the snapshot is a single file rather than a tree
+FILE_KEY = "."
+
+Manifest = Dict[str, str]
+# Relative path (as in a manifest) -> permission bits
+Modes = Dict[str, int]
+
+
+def hash_file(path: Union[str, Path]) -> str:
+    """sha256 of a file, read in fixed-size chunks so large files never sit in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_files(root: Union[str, Path]) -> Iterator[Tuple[str, str]]:
+    """Yield (relative path, absolute path) for every regular file below `root`.
+
+    Follows symlinks like `shutil.copytree` does by default; dangling links
+    are skipped with a warning. Order is deterministic.
+    """
+    root = Path(root)
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if not os.path.exists(path):
+                logger.warning(f"{path} is a dangling symlink; not backed up")
+                continue
+            yield Path(path).relative_to(root).as_posix(), path
+
+
+def hash_tree(path: Union[str, Path]) -> Manifest:
+    """Manifest of a file or directory without storing anything."""
+    if os.path.isdir(path):
+        return {rel: hash_file(abs_path) for rel, abs_path in iter_files(path)}
+    return {FILE_KEY: hash_file(path)}
+
+
+def tree_modes(path: Union[str, Path], rel_paths: Optional[Iterable[str]] = None) -> Modes:
+    """Permission bits of the files a snapshot of `path` stores, keyed like its manifest.
+
+    Blobs are shared and read-only, so the modes are recorded next to the
+    manifest and put back by `BlobStore.materialize`.
+
+    Args:
+        path (str | Path): File or directory
+        rel_paths (Optional[Iterable[str]]): Only these entries of a directory (as `snapshot_paths`)
+    """
+    if rel_paths is not None:
+        modes = {}
+        for rel in rel_paths:
+            for key, mode in tree_modes(os.path.join(path, rel)).items():
+                modes[rel if key == FILE_KEY else f"{rel}/{key}"] = mode
+        return modes
+    if os.path.isdir(path):
+        return {rel: stat.S_IMODE(os.stat(abs_path).st_mode) for rel, abs_path in iter_files(path)}
+    return {FILE_KEY: stat.S_IMODE(os.stat(path).st_mode)}
+
+
+class BlobStore:
+    """Content-addressed store for backup contents.
+
+    Every file is stored once under `<root>/<sha[:2]>/<sha>`, read-only.
+    A backup snapshot is a manifest (relative path -> sha256) plus a browsable
+    copy of the tree in which each file is a hardlink to its blob, so
+    repeated backups of unchanged content cost directory entries only.
+    Where hardlinks are not possible (e.g. another filesystem), the blob is
+    copied instead.
+    """
+    def __init__(self, root: Union[str, Path]):
+        """Initialize the store.
+
+        Args:
+            root (str | Path): Directory holding the blobs (created on demand)
+        """
+        self.root = Path(root)
+
+    def blob_path(self, digest: str) -> Path:
+        """Location of the blob for `digest`."""
+        return self.root.joinpath(digest[:2], digest)
+
+    def put(self, path: Union[str, Path]) -> str:
+        """Store the content of `path` if it is not already there.
+
+        Returns:
+            str: sha256 of the content
+        """
+        digest = hash_file(path)
+        blob = self.blob_path(digest)
+        if blob.exists():
+            logger.debug(f"{path} already stored as {digest}")
+            return digest
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=blob.parent, prefix=f".{digest}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, blob)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        logger.debug(f"Stored {path} as {digest}")
+        return digest
+
+    def link(self, digest: str, dest: Union[str, Path]) -> None:
+        """Make `dest` show the blob's content: hardlink if possible, copy otherwise."""
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(self.blob_path(digest), dest)
+        except OSError as e:
+            logger.debug(f"Hardlink to {dest} failed ({e}); copying")
+            shutil.copy2(self.blob_path(digest), dest)
+
+    def snapshot(self, source: Union[str, Path], dest: Union[str, Path]) -> Manifest:
+        """Store `source` (file or directory) and lay out a browsable copy at `dest`.
+
+        Returns:
+            Manifest: relative path -> sha256 ("." for a single file)
+        """
+        if os.path.isdir(source):
+            manifest = {rel: self.put(abs_path) for rel, abs_path in iter_files(source)}
+            Path(dest).mkdir(parents=True, exist_ok=True)
+            for rel, digest in manifest.items():
+                self.link(digest, Path(dest).joinpath(rel))
+        else:
+            manifest = {FILE_KEY: self.put(source)}
+            self.link(manifest[FILE_KEY], dest)
+        return manifest
+
+    def snapshot_paths(self, root: Union[str, Path], rel_paths: Iterable[str], dest: Union[str, Path]) -> Manifest:
+        """Like `snapshot`, restricted to some entries (files or directories) below `root`.
+
+        Returns:
+            Manifest: path relative to `root` -> sha256
+        """
+        manifest = {}
+        for rel in rel_paths:
+            path = os.path.join(root, rel)
+            if os.path.isdir(path):
+                files = [(f"{rel}/{sub}", abs_path) for sub, abs_path in iter_files(path)]
+            else:
+                files = [(rel, path)]
+            for key, abs_path in files:
+                manifest[key] = self.put(abs_path)
+                self.link(manifest[key], Path(dest).joinpath(key))
+        return manifest
+
+    def materialize(self, manifest: Manifest, dest: Union[str, Path], modes: Optional[Modes] = None) -> None:
+        """Recreate a snapshot at `dest` as regular, writable files.
+
+        Args:
+            manifest (Manifest): The snapshot
+            dest (str | Path): Where to recreate it
+            modes (Optional[Modes]): Permission bits recorded with the snapshot;
+                files without one get the umask default
+        """
+        dest = Path(dest)
+        for rel, digest in manifest.items():
+            target = dest if rel == FILE_KEY else dest.joinpath(rel)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(self.blob_path(digest), target)
+            if modes and rel in modes:
+                os.chmod(target, modes[rel])
+
+    def has(self, manifest: Manifest) -> bool:
+        """Whether every blob of `manifest` is in the store."""
+        return all(self.blob_path(digest).exists() for digest in manifest.values())
+
+    def prune(self, referenced: Iterable[str], candidates: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+        """Delete every blob whose digest is not in `referenced`.
+
+        Args:
+            referenced (Iterable[str]): Digests to keep
+            candidates (Optional[Iterable[str]]): Only consider these digests
+                (default: every blob in the store)
+
+        Returns:
+            Tuple[int, int]: Number of blobs removed and bytes freed
+        """
+        referenced = set(referenced)
+        removed, freed = 0, 0
+        if not self.root.exists():
+            return removed, freed
+        if candidates is None:
+            blobs = self.root.glob("*/*")
+        else:
+            blobs = (self.blob_path(digest) for digest in set(candidates))
+        for blob in blobs:
+            if blob.name.endswith(".tmp") or blob.name in referenced or not blob.exists():
+                continue
+            freed += blob.stat().st_size
+            blob.unlink()
+            removed += 1
+        return removed, freed
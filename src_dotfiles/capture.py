@@ -0,0 +1,152 @@
+import difflib
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from src_dotfiles.blobstore import CHUNK_SIZE, FILE_KEY, Manifest, hash_tree
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.DotFile import DotFile, backup_store
+
+logger = get_logger(__name__)
+
+LINKED = "linked"        # deploy path is a symlink: nothing to capture
+MISSING = "missing"      # nothing deployed
+IDENTICAL = "identical"  # a regular copy with the content of main or a variant
+DIVERGENT = "divergent"  # a regular copy edited in place
+
+
+def sources(dot_file: DotFile) -> List[str]:
+    """Registry-relative sources of a dotfile: this device's one first, then main and the other variants."""
+    own = dot_file.data.main
+    if dot_file.data.variants and dot_file.identifier in dot_file.data.variants:
+        own = dot_file.data.variants[dot_file.identifier]
+    result = [own]
+    for source in [dot_file.data.main, *(dot_file.data.variants or {}).values()]:
+        if source not in result:
+            result.append(source)
+    return result
+
+
+def compare(dot_file: DotFile) -> Tuple[str, Optional[str], Optional[Manifest]]:
+    """Compare what is deployed with the dotfile's sources, hashing both in streaming chunks.
+
+    Returns:
+        Tuple: state (LINKED, MISSING, IDENTICAL or DIVERGENT), the source it
+            is identical to (if any) and the manifest of the deployed content
+    """
+    deploy_path = dot_file.data.deploy[dot_file.identifier].deploy_path
+    if os.path.islink(deploy_path) or dot_file.data.farm:
+        # A farm is a real directory of links by design; its conflicts show up in `plan`
+        return LINKED, None, None
+    if not os.path.exists(deploy_path):
+        return MISSING, None, None
+
+    deployed = hash_tree(deploy_path)
+    # A template is compared with what it renders to on this device
+    for source in [dot_file.source_path()] if dot_file.data.template else sources(dot_file):
+        source_abs = Path(config.project_path).joinpath(source)
+        if source_abs.exists() and source_abs.is_dir() == os.path.isdir(deploy_path) and hash_tree(source_abs) == deployed:
+            return IDENTICAL, source, deployed
+    return DIVERGENT, None, deployed
+
+
+def unified_diff(source: str, deployed: str) -> Iterator[str]:
+    """Unified diff from `source` to `deployed` (files or directories), one line at a time.
+
+    Directories are compared through their manifests first, so only files
+    whose hashes differ are read for the diff.
+    """
+    if not os.path.isdir(deployed):
+        yield from _file_diff(source if os.path.isfile(source) else None, deployed, source, deployed)
+        return
+    before = hash_tree(source) if os.path.isdir(source) else {}
+    after = hash_tree(deployed)
+    for rel in sorted(before.keys() | after.keys()):
+        if before.get(rel) == after.get(rel):
+            continue
+        old = os.path.join(source, rel) if rel in before else None
+        new = os.path.join(deployed, rel) if rel in after else None
+        yield from _file_diff(old, new, os.path.join(source, rel), os.path.join(deployed, rel))
+
+
+def _file_diff(old: Optional[str], new: Optional[str], old_label: str, new_label: str) -> Iterator[str]:
+    """Unified diff of two files, either of which may be absent (None)."""
+    if _is_binary(old) or _is_binary(new):
+        yield f"Binary files {old_label} and {new_label} differ\n"
+        return
+    old_lines = _read_lines(old)
+    new_lines = _read_lines(new)
+    yield from difflib.unified_diff(old_lines, new_lines, old_label if old else "/dev/null", new_label if new else "/dev/null")
+
+
+def _is_binary(path: Optional[str]) -> bool:
+    if path is None:
+        return False
+    with open(path, "rb") as f:
+        return b"\0" in f.read(CHUNK_SIZE)
+
+
+def _read_lines(path: Optional[str]) -> List[str]:
+    if path is None:
+        return []
+    with open(path, errors="replace") as f:
+        return f.readlines()
+
+
+def three_way_merge(dot_file: DotFile) -> Tuple[str, int]:
+    """Merge in-place edits of a single-file dotfile with its source, using the last backup as base.
+
+    Runs `git merge-file -p <source> <last backup> <deployed>`: changes made
+    to the source since that backup and changes made to the deployed copy
+    are both kept, conflicting hunks are marked.
+
+    Returns:
+        Tuple[str, int]: Merged content and number of conflicts
+
+    Raises:
+        ValueError: If the dotfile is a directory or has no backup to use as base
+    """
+    deploy = dot_file.data.deploy[dot_file.identifier]
+    if os.path.isdir(deploy.deploy_path):
+        raise ValueError(f"{dot_file.data.alias}: three-way merge only supports single files")
+    if not deploy.backups:
+        raise ValueError(f"{dot_file.data.alias}: no backup to use as merge base")
+    last = deploy.backups[-1]
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base")
+        if last.manifest and FILE_KEY in last.manifest and backup_store().has(last.manifest):
+            backup_store().materialize(last.manifest, base, last.modes)
+        else:
+            shutil.copyfile(last.backup_path, base)
+        result = subprocess.run(
+            ["git", "merge-file", "-p", "-L", "source", "-L", f"backup {last.datetime}", "-L", "deployed",
+             dot_file.source_path(), base, deploy.deploy_path],
+            capture_output=True, text=True,
+        )
+    if result.returncode < 0 or result.returncode > 127:
+        raise RuntimeError(f"git merge-file failed: {result.stderr.strip()}")
+    return result.stdout, result.returncode
+
+
+def promote(dot_file: DotFile, content: Optional[str] = None) -> None:
+    """Make the deployed copy (or `content`, e.g. a merge result) the new source of this device.
+
+    The source is this device's variant if it has one, main otherwise.
+
+    Raises:
+        ValueError: For templates: edits of the rendered output cannot be folded back automatically
+    """
+    if dot_file.data.template:
+        raise ValueError(f"{dot_file.data.alias} is a template; port the changes to {dot_file.data.main} by hand")
+    source = dot_file.source_path()
+    deploy_path = dot_file.data.deploy[dot_file.identifier].deploy_path
+    if content is not None:
+        Path(source).write_text(content)
+    elif os.path.isdir(deploy_path):
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.copytree(deploy_path, source)
+    else:
+        shutil.copyfile(deploy_path, source)
+    logger.info(f"Promoted {deploy_path} into {source}")
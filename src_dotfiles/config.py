@@ -1,13 +1,30 @@
-from ezpy_logs.LoggerFactory import LoggerFactory
+import logging
+import platform
 import socket
 import re
 from getpass import getuser
 from pathlib import Path
 import os
-from src_dotfiles.models import DevicesData
 
-LoggerFactory.setup_LoggerFactory()
-logger = LoggerFactory.getLogger(__name__)
+def get_logger(name: str) -> logging.Logger:
+    """Module logger. Unlike LoggerFactory.getLogger, never sets logging up (see setup_logging)."""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+_logging_setup = False
+
+def setup_logging() -> None:
+    """Set up the log files and console output, once: on first config read or from the CLI entry point."""
+    global _logging_setup
+    if _logging_setup:
+        return
+    from ezpy_logs.LoggerFactory import LoggerFactory
+
+    _logging_setup = True
+    LoggerFactory.setup_LoggerFactory()
+
+logger = get_logger(__name__)
 
 class DotDict(dict):
     """
@@ -21,7 +38,21 @@ class DotDict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
-config = DotDict()
+class LazyConfig(DotDict):
+    """
+    DotDict filled by set_config() the first time a value is read,
+    so importing this module (and the CLI) has no side effects:
+    no logging setup, no hostname lookup, no mkdir, no pydantic import.
+    """
+    def __getitem__(self, key):
+        if not _configured:
+            set_config()
+        return dict.__getitem__(self, key)
+
+    __getattr__ = __getitem__
+
+_configured = False
+config = LazyConfig()
 
 def get_computer_name():
     identifier = socket.gethostname() + "." + getuser()
@@ -51,21 +82,32 @@ def get_home_path():
     return home_path
 
 def set_config(dotfiles_dir="dotfiles"):
-    global config
+    global config, _configured
+    # Pydantic is only needed once a command actually reads the config
+    from src_dotfiles.models import DevicesData
+
+    setup_logging()
+    _configured = True
     config.pwd = get_project_path(pwd=False)
     config.home = get_home_path()
     config.project_path = get_project_path()
     config.dotfiles_dir = dotfiles_dir
     config.backup_dir = Path(config.dotfiles_dir).joinpath('old').as_posix()
+    config.objects_dir = Path(config.backup_dir).joinpath('objects').as_posix()
+    config.rendered_dir = Path(config.dotfiles_dir).joinpath('rendered').as_posix()
     config.depedencies_path = Path(config.dotfiles_dir).joinpath('dotfiles.json').as_posix()
     config.legacy_meta3_path = Path(config.dotfiles_dir).joinpath('meta_3.json').as_posix()
+    # Registry backend: "json" (dotfiles.json, default) or "sqlite" (local registry.sqlite3)
+    config.storage = os.environ.get("DOTFILES_STORAGE", "json")
+    config.sqlite_path = Path(config.dotfiles_dir).joinpath('registry.sqlite3').as_posix()
     config.identifier = get_computer_name()
     
     # Create device data for current system
     config.device_data = DevicesData(
         identifier=config.identifier,
         home_path=config.home,
-        dotfiles_dir_path=config.dotfiles_dir
+        dotfiles_dir_path=config.dotfiles_dir,
+        system=platform.system(),
     )
     
     Path(config.dotfiles_dir).mkdir(parents=True, exist_ok=True)
@@ -73,7 +115,5 @@ def set_config(dotfiles_dir="dotfiles"):
     Path(config.backup_dir).mkdir(parents=True, exist_ok=True)
     logger.info(f"Created directory for {config.backup_dir = }")
     logger.debug(f"{config.depedencies_path = }")
+    logger.debug(f"{config.identifier = }")
     return config
-
-set_config()
-logger.debug(f"{config.identifier = }")
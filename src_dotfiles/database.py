@@ -1,13 +1,17 @@
-from src_dotfiles.config import config
+from src_dotfiles.config import config, get_logger
 import json
+import os
 import re
 from pathlib import Path
-from ezpy_logs.LoggerFactory import LoggerFactory
-from typing import List, Optional
-from src_dotfiles.models import DotFileModel, MetaDataDotFiles, DeployedDotFile, DevicesData
-from src_dotfiles.DotFile import DotFile
+from typing import Dict, List, Optional, Tuple
+from src_dotfiles.models import SCHEMA_VERSION, DotFileModel, MetaDataDotFiles, DeployedDotFile, DevicesData, Identifier
+from src_dotfiles.DotFile import DotFile, LazyDotFile
+from src_dotfiles.fsutils import RegistryLock
+from src_dotfiles.history import Histories
+from src_dotfiles.storage import open_storage
+from src_dotfiles.retention import backup_key
 
-logger = LoggerFactory.getLogger(__name__)
+logger = get_logger(__name__)
 
 # Moving parts by identifiers:
 # - hostname
@@ -20,50 +24,92 @@ logger = LoggerFactory.getLogger(__name__)
 #       At the moment everything is in HOME/Setup/dotfiles, but should be configurable
 
 
+def _deploy_key(dot_file: DotFile) -> str:
+    """Normalized deploy path of a dotfile on its device, used as index key."""
+    return os.path.abspath(dot_file.data.deploy[dot_file.identifier].deploy_path)
+
+
 class Dependencies:
     """Manages the collection of dotfiles and their metadata.
     
     This class handles loading and saving the metadata file, and provides
     access to individual dotfiles. It maintains both the raw metadata (through
     Pydantic models) and the operational DotFile instances.
+
+    An advisory lock on the registry is taken before loading and held until
+    `close()` (or process exit), so concurrent runs queue up instead of
+    overwriting each other's changes. Read-only users (`read_only=True`, e.g.
+    `status`) take no lock and never wait: every write is an atomic rename
+    or a SQLite transaction, so what they load is always consistent.
+
+    Backup histories are not part of `dotfiles.json` (schema v2): each device
+    appends its own to `history/<identifier>.jsonl`, a local file that is not
+    synced, and only that log is read and injected into the models at load time.
+
+    Both are read and written through `self.storage`: JSON files by default,
+    or a local SQLite database with DOTFILES_STORAGE=sqlite.
     """
-    def __init__(self):
+    def __init__(self, read_only: bool = False):
         """Initialize the Dependencies manager.
         
         Loads metadata from file if it exists, otherwise creates empty metadata.
         Then loads all dotfiles and translates them to current device if needed.
+
+        Args:
+            read_only (bool): Load without taking the registry lock; `save_all`
+                is then refused (and migrations stay in memory).
         """
         self.test: bool = False
-        self.data: List[DotFile] = []  # Initialize data as empty list first
+        self.read_only = read_only
+        # alias -> DotFile, in registry order: the loaded dotfiles (see `data`),
+        # and normalized deploy_path -> alias. Only changed through
+        # add_dotfile/remove_dotfile, which keep both in sync.
+        self._by_alias: Dict[str, DotFile] = {}
+        self._by_deploy_path: Optional[Dict[str, str]] = None  # built on first path lookup
+        # (alias, source device, target device) -> translated model, see _translate
+        self._translations: Dict[Tuple[str, str, str], Tuple[DotFileModel, DotFileModel]] = {}
         logger.debug(f"{config.depedencies_path = }")
         logger.debug(f"{config.dotfiles_dir = }")
         self.path: str = config.depedencies_path
         self.path_test: str = config.dotfiles_dir + "test_" + "meta.json"
         self.db_path = self.get_db_path()
         logger.debug(f"{self.db_path = }")
+        self.lock = RegistryLock(self.db_path)
+        if not read_only:
+            self.lock.acquire()
+        self.storage = open_storage(self.db_path)
+        needs_save = False
 
-        if self.db_path.exists():
-            logger.debug(f"Loading metadata from {self.db_path}")
-            with open(self.db_path, "r") as f:
-                self.metadata = MetaDataDotFiles.model_validate_json(f.read())
+        metadata = self.storage.load()
+        if metadata is not None:
+            self.metadata = metadata
         elif self._legacy_db_path().exists():
-            logger.info(f"Migrating from {self._legacy_db_path()} to {self.db_path}")
+            logger.info(f"Migrating from {self._legacy_db_path()} to {self.storage.path}")
             with open(self._legacy_db_path(), "r") as f:
                 self.metadata = MetaDataDotFiles.model_validate_json(f.read())
-            # Ensure version is set (old files won't have it, Pydantic defaults to 1)
-            self.save_all()
+            needs_save = True
         else:
             logger.debug(f"Creating new metadata")
             self.metadata = MetaDataDotFiles(
+                version=SCHEMA_VERSION,
                 dotfiles={},
                 devices={
                     config.identifier: config.device_data
                 }
             )
+            needs_save = True
+
+        # Old files have no version field (Pydantic defaults to 1): upgrade them
+        needs_save = self._migrate_history() or needs_save
+        self._load_history()
+        if needs_save and read_only:
+            logger.debug("Registry needs saving (new or migrated); left to the next writing command")
+        elif needs_save:
             self.save_all()
 
         # Load and translate dotfiles after metadata is initialized
-        self.data = self.load_all()
+        for dot_file in self.load_all():
+            self.add_dotfile(dot_file)
 
     def get_db_path(self) -> Path:
         """Get the path to the database file
@@ -74,6 +120,67 @@ class Dependencies:
         dest = self.path_test if self.test else self.path
         return Path(config.project_path).joinpath(dest)
 
+    def _migrate_history(self) -> bool:
+        """Move this device's backup history stored inline (schema v1) to its local log.
+
+        Also drains backups an older client may have written inline into a v2
+        file. Other devices' inline backups stay in the registry until those
+        devices migrate them into their own (local, unsynced) logs. The log is
+        written before the registry, and merged by backup key, so a crash in
+        between only repeats the migration.
+
+        Returns:
+            bool: True if the metadata changed and must be saved
+        """
+        inline: Histories = {}
+        for alias, model in self.metadata.dotfiles.items():
+            deployed = model.deploy.get(config.identifier)
+            if deployed is not None and deployed.backups:
+                inline[alias] = deployed.backups
+        if not inline and self.metadata.version >= SCHEMA_VERSION:
+            return False
+
+        if inline:
+            merged = self.storage.load_history(config.identifier)
+            for alias, backups in inline.items():
+                logged = merged.setdefault(alias, [])
+                known = {backup_key(b) for b in logged}
+                logged.extend(b for b in backups if backup_key(b) not in known)
+                self.metadata.dotfiles[alias].deploy[config.identifier].backups = []
+            self.storage.save_history(config.identifier, merged)
+        logger.info(
+            f"Registry schema v{self.metadata.version} -> v{SCHEMA_VERSION}: "
+            f"{sum(len(b) for b in inline.values())} backup(s) of this device moved to its history log"
+        )
+        self.metadata.version = SCHEMA_VERSION
+        return True
+
+    def _load_history(self) -> None:
+        """Attach this device's logged backups to the registry entries they belong to."""
+        self._history = self.storage.load_history(config.identifier)
+        for alias, backups in self._history.items():
+            model = self.metadata.dotfiles.get(alias)
+            if model is not None and config.identifier in model.deploy:
+                model.deploy[config.identifier].backups = backups
+
+    def _save_history(self) -> None:
+        """Store this device's backups (the JSON log is appended to if only new ones were taken).
+
+        History of aliases no longer in the registry is kept (gc may still need
+        their blobs).
+        """
+        current: Histories = {}
+        for alias, model in self.metadata.dotfiles.items():
+            deployed = model.deploy.get(config.identifier)
+            if deployed is not None and deployed.backups:
+                current[alias] = deployed.backups
+        for alias, backups in self._history.items():
+            model = self.metadata.dotfiles.get(alias)
+            if model is None or config.identifier not in model.deploy:
+                current[alias] = backups
+        self.storage.save_history(config.identifier, current)
+        self._history = current
+
     def _legacy_db_path(self) -> Path:
         """Get the path to the legacy meta_3.json file."""
         return Path(config.project_path).joinpath(config.legacy_meta3_path)
@@ -116,7 +223,10 @@ class Dependencies:
 
 
         if alias in self.metadata.dotfiles.keys():
-            dot_file_model = self.metadata.dotfiles[alias]
+            # Copy the deploy map: the caller may still reject this dotfile, and in
+            # a batch the registry must not pick up an unrelated deploy_path.
+            existing = self.metadata.dotfiles[alias]
+            dot_file_model = existing.model_copy(update={"deploy": dict(existing.deploy)})
         else:
             dot_file_model = DotFileModel(
                 alias=alias,
@@ -166,6 +276,62 @@ class Dependencies:
                 )
         return None
 
+    def _load_model(self, alias: str, model: DotFileModel) -> Optional[DotFile]:
+        """Convert one registry entry into a DotFile for the current device.
+
+        Entries registered on other devices come back as LazyDotFile: which
+        device to translate from is decided now (it decides whether the entry
+        applies here), but the translation itself waits for first access.
+
+        Returns:
+            Optional[DotFile]: The DotFile (translated from another device if
+                needed), or None if the entry does not apply to this device
+        """
+        # Skip dotfiles restricted to other devices
+        if model.only_devices is not None and config.identifier not in model.only_devices:
+            logger.debug(f"Skipping {alias}: only_devices={model.only_devices}, current={config.identifier}")
+            return None
+        if config.identifier in model.deploy.keys():
+            return DotFile(model, config.identifier)
+
+        # Get device data for translation
+        known_devices_in_model = [i for i in model.deploy.keys() if i in self.metadata.devices.keys()]
+
+        if len(known_devices_in_model) == 0:
+            if len(model.deploy) == 0:
+                logger.warning(f"No deploy entries for {model.alias = }, skipping")
+                return None
+            # Try to infer device data from deploy path
+            any_device_id = list(model.deploy.keys())[0]
+            inferred = self._infer_device_data(any_device_id, model.deploy[any_device_id].deploy_path)
+            if inferred is None:
+                logger.warning(f"Cannot infer device data for {any_device_id} from deploy path, skipping {model.alias = }")
+                return None
+            self.metadata.devices[any_device_id] = inferred
+            model_identifier = any_device_id
+        else:
+            model_identifier = known_devices_in_model[0]
+
+        return LazyDotFile(
+            alias, config.identifier,
+            lambda: self._translate(alias, model, model_identifier),
+        )
+
+    def _translate(self, alias: str, model: DotFileModel, source: str) -> DotFileModel:
+        """Translate a registry entry from `source` to the current device, memoized.
+
+        Keyed by (alias, source device, target device); a cached translation is
+        reused as long as it was made from the same model object.
+        """
+        key = (alias, source, config.identifier)
+        cached = self._translations.get(key)
+        if cached is not None and cached[0] is model:
+            return cached[1]
+        original_device = self.metadata.devices[source]
+        translated = DotFile(model).translate_to_device(original_device, config.device_data).data
+        self._translations[key] = (model, translated)
+        return translated
+
     def load_all(self) -> List[DotFile]:
         """Converts the metadata into usable DotFile objects.
         
@@ -176,39 +342,21 @@ class Dependencies:
         """
         dotfiles = []
         for alias, model in self.metadata.dotfiles.items():
-            # Skip dotfiles restricted to other devices
-            if model.only_devices is not None and config.identifier not in model.only_devices:
-                logger.debug(f"Skipping {alias}: only_devices={model.only_devices}, current={config.identifier}")
-                continue
-            if config.identifier not in model.deploy.keys():
-                # Get device data for translation
-                known_devices_in_model = [i for i in model.deploy.keys() if i in self.metadata.devices.keys()]
-
-                if len(known_devices_in_model) == 0:
-                    if len(model.deploy) == 0:
-                        logger.warning(f"No deploy entries for {model.alias = }, skipping")
-                        continue
-                    # Try to infer device data from deploy path
-                    any_device_id = list(model.deploy.keys())[0]
-                    inferred = self._infer_device_data(any_device_id, model.deploy[any_device_id].deploy_path)
-                    if inferred is None:
-                        logger.warning(f"Cannot infer device data for {any_device_id} from deploy path, skipping {model.alias = }")
-                        continue
-                    self.metadata.devices[any_device_id] = inferred
-                    model_identifier = any_device_id
-                else:
-                    model_identifier = known_devices_in_model[0]
-                    
-                original_device = self.metadata.devices[model_identifier]
-                translated = DotFile(model).translate_to_device(original_device, config.device_data)
-                dotfiles.append(translated)
-            else:
-                dotfiles.append(DotFile(model, config.identifier))
+            dot_file = self._load_model(alias, model)
+            if dot_file is not None:
+                dotfiles.append(dot_file)
         self.update_dotfiles(dotfiles)
         return dotfiles
 
     def update_dotfiles(self, dotfiles: List[DotFile]) -> None:
+        """Merge the in-memory DotFiles back into the metadata.
+
+        Backup histories are merged through a key index, so this stays linear
+        in the number of backups.
+        """
         for dotfile in dotfiles:
+            if not dotfile.materialized:
+                continue  # never accessed: nothing to merge, and translating it now would defeat laziness
             identifier = dotfile.identifier
             db_dotfile_model = self.metadata.dotfiles.get(dotfile.data.alias)
             if db_dotfile_model is None:
@@ -219,25 +367,117 @@ class Dependencies:
                 db_dotfile_model.deploy[identifier] = dotfile.data.deploy[identifier]
                 self.metadata.dotfiles[dotfile.data.alias] = db_dotfile_model
                 continue
-            db_backups = db_deploy.backups
-            for db_backup in db_backups:
-                if db_backup not in dotfile.data.deploy[identifier].backups:
-                    dotfile.data.deploy[identifier].backups.append(db_backup)
+            backups = dotfile.data.deploy[identifier].backups
+            if db_deploy.backups is not backups:
+                known = {backup_key(b) for b in backups}
+                for db_backup in db_deploy.backups:
+                    if backup_key(db_backup) not in known:
+                        backups.append(db_backup)
+                        known.add(backup_key(db_backup))
             db_dotfile_model.deploy[identifier] = dotfile.data.deploy[identifier]
             self.metadata.dotfiles[dotfile.data.alias] = db_dotfile_model
 
-    def save_all(self) -> None:
-        """Saves all dotfile data to the metadata file"""
+    def save_all(self) -> bool:
+        """Saves all dotfile data to the metadata file
+
+        The file is replaced atomically (temp file + fsync + rename), so a crash
+        mid-write never leaves truncated JSON behind. The write is skipped when
+        the serialized registry is byte-identical to what was last loaded or
+        saved, so no-op runs keep the file's mtime and leave no diff behind. Backups go to this device's history log first.
+        With the SQLite storage, only the changed rows are written, in one
+        transaction.
+
+        Returns:
+            bool: True if the registry was written, False if it was already up to date
+
+        Raises:
+            RuntimeError: If the registry was opened read-only
+        """
+        if self.read_only:
+            raise RuntimeError("registry opened read-only (no lock held); cannot save")
         self.update_dotfiles(self.data)
         
-        if config.identifier not in self.metadata.devices:
+        device = self.metadata.devices.get(config.identifier)
+        if device is None:
             self.metadata.devices[config.identifier] = config.device_data
-            
-        db_path = self.get_db_path()
-        logger.info(f"Saving to {db_path}")
-        db_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(db_path, 'w') as f:
-            f.write(self.metadata.model_dump_json(indent=4))
+        elif device.system != config.device_data.system:
+            device.system = config.device_data.system  # for templates rendered or checked elsewhere
+
+        self._save_history()
+        return self.storage.save(self.metadata)
+
+    def close(self) -> None:
+        """Close the storage and release the registry lock. No further saves are possible."""
+        self.storage.close()
+        self.lock.release()
+
+    @property
+    def data(self) -> List[DotFile]:
+        """The loaded dotfiles applying to this device, in registry order.
+
+        A new list: change the collection with add_dotfile/remove_dotfile.
+        """
+        return list(self._by_alias.values())
+
+    def _index_path(self, dot_file: DotFile) -> None:
+        if self._by_deploy_path is not None:
+            self._by_deploy_path[_deploy_key(dot_file)] = dot_file.alias
+
+    def _unindex_path(self, dot_file: DotFile) -> None:
+        if self._by_deploy_path is not None:
+            self._by_deploy_path.pop(_deploy_key(dot_file), None)
+
+    def add_dotfile(self, dot_file: DotFile, replace: bool = False) -> DotFile:
+        """Insert a DotFile in the collection.
+
+        Args:
+            dot_file (DotFile): The dotfile to insert
+            replace (bool): Replace the entry with the same alias, in place
+
+        Returns:
+            DotFile: The inserted dotfile
+
+        Raises:
+            ValueError: If another dotfile with this alias is loaded and `replace` is not set
+        """
+        alias = dot_file.alias
+        current = self._by_alias.get(alias)
+        if current is not None and current is not dot_file:
+            if not replace:
+                raise ValueError(f"Alias {alias} is already loaded")
+            logger.info(f"Alias {alias} already loaded; replacing it")
+            self._unindex_path(current)
+        self._by_alias[alias] = dot_file  # an existing key keeps its position
+        self._index_path(dot_file)
+        return dot_file
+
+    def remove_dotfile(self, alias: str) -> Optional[DotFile]:
+        """Remove the dotfile of `alias` from the collection (not from the metadata).
+
+        Returns:
+            Optional[DotFile]: The removed dotfile, or None if it was not loaded
+        """
+        dot_file = self._by_alias.pop(alias, None)
+        if dot_file is not None:
+            self._unindex_path(dot_file)
+        return dot_file
+
+    def refresh(self, alias: str) -> Optional[DotFile]:
+        """Re-derive the DotFile of `alias` from the metadata after a registry change.
+
+        Needed when a change alters whether/how the entry applies to this device
+        (e.g. clearing only_devices, adding a deploy entry for this device).
+
+        Returns:
+            Optional[DotFile]: The refreshed dotfile, or None if it does not apply here
+        """
+        model = self.metadata.dotfiles.get(alias)
+        dot_file = self._load_model(alias, model) if model is not None else None
+        if dot_file is None:
+            self.remove_dotfile(alias)
+            return None
+        self.update_dotfiles([dot_file])
+        return self.add_dotfile(dot_file, replace=True)
 
     def select_by_alias(self, alias: str) -> Optional[DotFile]:
         """Select a dotfile by its alias
@@ -248,15 +488,22 @@ class Dependencies:
         Returns:
             Optional[DotFile]: The found DotFile or None if not found
         """
-        selection = [d for d in self.data if d.data.alias == alias]
-        if len(selection) == 1:
-            return selection[0]
-        elif len(selection) > 1:
-            logger.warning(f"There is {len(selection)} dotfiles named {alias}")
-            for d in selection:
-                logger.warning(str(d))
-            logger.warning("Selecting 1st entry!")
-            return selection[0]
-        else:
+        dot_file = self._by_alias.get(alias)
+        if dot_file is None:
             logger.debug(f"There is no match in database for {alias}")
-            return None
+        return dot_file
+
+    def select_by_deploy_path(self, deploy_path: str) -> Optional[DotFile]:
+        """Select the dotfile deployed at `deploy_path` on this device
+
+        Args:
+            deploy_path (str): The path to search for
+
+        Returns:
+            Optional[DotFile]: The found DotFile or None if not found
+        """
+        if self._by_deploy_path is None:
+            # Needs every deploy path, hence every translation: only built when asked for.
+            self._by_deploy_path = {_deploy_key(d): alias for alias, d in self._by_alias.items()}
+        alias = self._by_deploy_path.get(os.path.abspath(deploy_path))
+        return self._by_alias.get(alias) if alias is not None else None
@@ -0,0 +1,271 @@
+"""Deploy on other devices over SSH (`deploy --hosts`).
+
+Per host, on one multiplexed connection (ControlMaster): hash the needed
+files remotely, rsync only those whose sha256 differs, run `deploy` there and
+stream its output back prefixed with the device. Hosts run concurrently.
+
+The local registry always replaces the host's copy. To avoid silently losing
+edits made there, the sha256 of the registry last pushed to each host is kept
+in `dotfiles/.pushed_registry.json`; a host whose copy changed since then is
+refused unless `overwrite_registry` is set.
+
+The ssh and rsync commands can be replaced through DOTFILES_SSH and
+DOTFILES_RSYNC (e.g. with shims for tests), and the remote interpreter
+through DOTFILES_REMOTE_PYTHON (default: the project's .venv, else python3).
+"""
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from src_dotfiles.blobstore import FILE_KEY, hash_tree
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.models import DevicesData, MetaDataDotFiles
+
+logger = get_logger(__name__)
+
+# (device identifier, outcome "ok" or "failed", files pushed, remote summary or error)
+HostResult = Tuple[str, str, int, str]
+
+# Run by the remote interpreter: sha256 of each requested file below argv[1]
+_REMOTE_HASH = """
+import hashlib, json, os, sys
+root, out = sys.argv[1], {}
+for rel in json.load(sys.stdin):
+    path = os.path.join(root, rel)
+    if os.path.isfile(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        out[rel] = digest.hexdigest()
+json.dump(out, sys.stdout)
+"""
+
+_SUMMARY = re.compile(r"deploy summary: (.*)$")
+
+PUSHED_REGISTRY = ".pushed_registry.json"
+
+
+def ssh_command() -> List[str]:
+    return shlex.split(os.environ.get("DOTFILES_SSH", "ssh"))
+
+
+def rsync_command() -> List[str]:
+    return shlex.split(os.environ.get("DOTFILES_RSYNC", "rsync"))
+
+
+def destination(device: DevicesData) -> str:
+    """SSH destination of a device: its `ssh_host`, else user@hostname guessed from the identifier."""
+    if device.ssh_host:
+        return device.ssh_host
+    hostname, _, user = device.identifier.rpartition(".")
+    return f"{user}@{hostname}" if hostname else device.identifier
+
+
+def remote_project_path(device: DevicesData) -> str:
+    """Where this repository lives on `device` (same place relative to its home)."""
+    local = Path(config.project_path).resolve()
+    home = Path(config.home).resolve()
+    try:
+        return Path(device.home_path).joinpath(local.relative_to(home)).as_posix()
+    except ValueError:
+        return Path(device.home_path).joinpath(local.name).as_posix()
+
+
+def needed_files(metadata: MetaDataDotFiles, device: DevicesData, alias: Optional[str] = None) -> List[str]:
+    """Paths, relative to the dotfiles directory, a deploy on `device` reads: the registry and the sources."""
+    dotfiles_dir = Path(config.dotfiles_dir)
+    sources = [Path(config.depedencies_path)]
+    for model in metadata.dotfiles.values():
+        if alias is not None and model.alias != alias:
+            continue
+        if model.only_devices is not None and device.identifier not in model.only_devices:
+            continue
+        sources.append(Path(model.main))
+        if model.variants and device.identifier in model.variants:
+            sources.append(Path(model.variants[device.identifier]))
+    rels = []
+    for source in sources:
+        try:
+            rel = source.relative_to(dotfiles_dir).as_posix()
+        except ValueError:
+            logger.warning(f"{source} is outside {dotfiles_dir}; not pushed")
+            continue
+        if rel not in rels:
+            rels.append(rel)
+    return rels
+
+
+def pushed_registry_path() -> Path:
+    return Path(config.project_path).joinpath(config.dotfiles_dir, PUSHED_REGISTRY)
+
+
+def load_pushed_registry() -> Dict[str, str]:
+    """sha256 of the registry last pushed to each device, {} if unknown."""
+    try:
+        return json.loads(pushed_registry_path().read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def local_hashes(rels: List[str]) -> Dict[str, str]:
+    """sha256 of every file making up `rels` (directories are expanded), keyed by path relative to the dotfiles directory."""
+    root = Path(config.project_path).joinpath(config.dotfiles_dir)
+    hashes = {}
+    for rel in rels:
+        path = root.joinpath(rel)
+        if not path.exists():
+            logger.warning(f"{path} does not exist; not pushed")
+            continue
+        for key, digest in hash_tree(path).items():
+            hashes[rel if key == FILE_KEY else f"{rel}/{key}"] = digest
+    return hashes
+
+
+class Host:
+    """One device reached through a multiplexed SSH connection."""
+    def __init__(self, device: DevicesData, control_dir: str):
+        """Initialize the host.
+
+        Args:
+            device (DevicesData): Device to deploy on
+            control_dir (str): Directory for the ControlMaster socket
+        """
+        self.device = device
+        self.destination = destination(device)
+        self.project_path = remote_project_path(device)
+        self.dotfiles_path = Path(self.project_path).joinpath(device.dotfiles_dir_path).as_posix()
+        self.options = [
+            "-o", f"ControlPath={os.path.join(control_dir, '%C')}",
+            "-o", "ControlMaster=auto",
+            "-o", "ControlPersist=60",
+            "-o", "BatchMode=yes",
+        ]
+
+    def ssh(self, remote: str) -> List[str]:
+        return [*ssh_command(), *self.options, self.destination, remote]
+
+    def open(self) -> None:
+        """Start the master connection every later command reuses."""
+        subprocess.run(self.ssh("true"), check=True, capture_output=True, text=True, timeout=60)
+
+    def close(self) -> None:
+        subprocess.run([*ssh_command(), *self.options, "-O", "exit", self.destination], capture_output=True)
+
+    def python(self, arguments: str) -> str:
+        """Remote command running `arguments` with DOTFILES_REMOTE_PYTHON, else the project's .venv, else python3."""
+        python = os.environ.get("DOTFILES_REMOTE_PYTHON")
+        if python is not None:
+            return f"{shlex.quote(python)} {arguments}"
+        venv = shlex.quote(Path(self.project_path).joinpath(".venv", "bin", "python").as_posix())
+        return f'{{ PY=python3; [ -x {venv} ] && PY={venv}; "$PY" {arguments}; }}'
+
+    def remote_hashes(self, rels: List[str]) -> Dict[str, str]:
+        remote = self.python(f"-c {shlex.quote(_REMOTE_HASH)} {shlex.quote(self.dotfiles_path)}")
+        result = subprocess.run(self.ssh(remote), input=json.dumps(rels), capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+
+    def push(self, rels: List[str]) -> None:
+        """rsync `rels` (files relative to the dotfiles directory) to the same place on the host."""
+        local = Path(config.project_path).joinpath(config.dotfiles_dir).as_posix()
+        shell = shlex.join([*ssh_command(), *self.options])
+        subprocess.run(
+            [*rsync_command(), "-a", "--files-from=-", "-e", shell,
+             f"{local}/", f"{self.destination}:{self.dotfiles_path}/"],
+            input="\n".join(rels) + "\n", capture_output=True, text=True, check=True,
+        )
+
+    def deploy(self, args: List[str], on_line: Callable[[str], None]) -> Tuple[int, str]:
+        """Run `deploy` remotely, passing each output line to `on_line`.
+
+        Returns:
+            Tuple[int, str]: Exit status and the remote deploy summary (if any)
+        """
+        command = self.python(f"-m src_dotfiles deploy {shlex.join(args)}")
+        remote = f"cd {shlex.quote(self.project_path)} && {command}"
+        summary = ""
+        with subprocess.Popen(self.ssh(remote), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as proc:
+            for line in proc.stdout:
+                line = line.rstrip("\n")
+                on_line(line)
+                match = _SUMMARY.search(line)
+                if match:
+                    summary = match.group(1)
+        return proc.returncode, summary
+
+
+def deploy_host(
+    host: Host,
+    metadata: MetaDataDotFiles,
+    args: List[str],
+    alias: Optional[str] = None,
+    last_pushed: Optional[Dict[str, str]] = None,
+    overwrite_registry: bool = False,
+) -> HostResult:
+    """Sync and deploy one host, never raising.
+
+    `last_pushed` maps devices to the registry sha256 last pushed to them; it
+    is checked against the host's copy and updated once the push is done.
+    """
+    name = host.device.identifier
+    last_pushed = {} if last_pushed is None else last_pushed
+    registry = os.path.relpath(config.depedencies_path, config.dotfiles_dir)
+    pushed = 0
+    try:
+        host.open()
+        try:
+            hashes = local_hashes(needed_files(metadata, host.device, alias))
+            remote = host.remote_hashes(sorted(hashes))
+            theirs = remote.get(registry)
+            if theirs is not None and theirs != hashes.get(registry):
+                if name in last_pushed and theirs != last_pushed[name] and not overwrite_registry:
+                    reason = (f"{registry} was changed on the host since the last push; "
+                              "pull it into this repository or pass --overwrite-registry")
+                    logger.error(f"[{name}] {reason}")
+                    return name, "failed", 0, reason
+                if name not in last_pushed:
+                    logger.warning(f"[{name}] overwriting its {registry}, never pushed from here before")
+            stale = sorted(rel for rel, digest in hashes.items() if remote.get(rel) != digest)
+            if stale:
+                logger.info(f"[{name}] pushing {len(stale)} of {len(hashes)} file(s)")
+                host.push(stale)
+            pushed = len(stale)
+            if registry in hashes:
+                last_pushed[name] = hashes[registry]
+            status, summary = host.deploy(args, lambda line: logger.info(f"[{name}] {line}"))
+        finally:
+            host.close()
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        detail = getattr(e, "stderr", None) or str(e)
+        logger.error(f"[{name}] failed: {detail.strip()}")
+        return name, "failed", pushed, detail.strip()
+    if status != 0:
+        return name, "failed", pushed, summary or f"remote deploy exited with {status}"
+    return name, "ok", pushed, summary
+
+
+def fan_out(
+    metadata: MetaDataDotFiles,
+    devices: List[DevicesData],
+    jobs: int,
+    args: List[str],
+    alias: Optional[str] = None,
+    overwrite_registry: bool = False,
+) -> List[HostResult]:
+    """Deploy on every device concurrently (at most `jobs` at a time), results in `devices` order."""
+    control_dir = tempfile.mkdtemp(prefix="dotfiles-ssh-")  # short: socket paths are length-limited
+    last_pushed = load_pushed_registry()
+    try:
+        hosts = [Host(device, control_dir) for device in devices]
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(hosts)))) as pool:
+            return list(pool.map(
+                lambda host: deploy_host(host, metadata, args, alias, last_pushed, overwrite_registry), hosts))
+    finally:
+        shutil.rmtree(control_dir, ignore_errors=True)
+        pushed_registry_path().write_text(json.dumps(last_pushed, indent=2, sort_keys=True))
@@ -0,0 +1,119 @@
+import contextlib
+import fcntl
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Union
+from src_dotfiles.config import get_logger
+
+logger = get_logger(__name__)
+
+# Locks held by this process, keyed by resolved lock path: [fd, refcount].
+# flock() conflicts between two open() of the same file even inside one
+# process, so nested Dependencies instances share the first descriptor.
+_held: Dict[str, List[int]] = {}
+_held_guard = threading.Lock()
+
+
+def atomic_write(path: Union[str, Path], data: str) -> None:
+    """Write `data` to `path` so that readers see either the old or the new content.
+
+    Writes to a temp file in the same directory, fsyncs it, renames it over
+    `path` and fsyncs the directory. A crash at any point leaves the previous
+    file intact (plus, at worst, a stray `.<name>.*.tmp`).
+
+    Args:
+        path (str | Path): Destination file
+        data (str): Full new content
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = path.stat().st_mode & 0o777 if path.exists() else 0o644
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+    _fsync_dir(path.parent)
+
+
+def _fsync_dir(directory: Path) -> None:
+    """Persist a rename by fsyncing its directory (best effort on exotic filesystems)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class RegistryLock:
+    """Advisory exclusive lock guarding a registry file across load-modify-save.
+
+    The lock lives in a sibling `<registry>.lock` file so it survives the
+    atomic rename of the registry itself. Another process trying to acquire it
+    blocks until the holder releases it or exits; inside one process the lock
+    is reentrant.
+    """
+    def __init__(self, registry_path: Union[str, Path]):
+        """Initialize the lock for a registry file.
+
+        Args:
+            registry_path (str | Path): Path of the file being protected
+        """
+        self.path = Path(f"{registry_path}.lock")
+        self._acquired = False
+
+    def acquire(self) -> None:
+        """Take the lock, waiting for other processes if needed."""
+        if self._acquired:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        key = self.path.resolve().as_posix()
+        with _held_guard:
+            if key in _held:
+                _held[key][1] += 1
+            else:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.info(f"{self.path} is held by another run; waiting for it")
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                _held[key] = [fd, 1]
+        self._acquired = True
+        logger.debug(f"Acquired {self.path}")
+
+    def release(self) -> None:
+        """Release the lock (the last holder in this process unlocks the file)."""
+        if not self._acquired:
+            return
+        key = self.path.resolve().as_posix()
+        with _held_guard:
+            entry = _held[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                fcntl.flock(entry[0], fcntl.LOCK_UN)
+                os.close(entry[0])
+                del _held[key]
+        self._acquired = False
+        logger.debug(f"Released {self.path}")
+
+    def __enter__(self) -> "RegistryLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
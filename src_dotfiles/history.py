@@ -0,0 +1,88 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.fsutils import atomic_write
+from src_dotfiles.models import Alias, BackupMetadata, Identifier
+
+logger = get_logger(__name__)
+
+Histories = Dict[Alias, List[BackupMetadata]]
+
+
+def history_dir() -> Path:
+    """Directory holding one backup history log per device."""
+    return Path(config.project_path).joinpath(config.dotfiles_dir, "history")
+
+
+def history_path(identifier: Identifier) -> Path:
+    return history_dir().joinpath(f"{identifier}.jsonl")
+
+
+def iter_logs() -> Iterator["HistoryLog"]:
+    """Every device's history log present in the registry."""
+    if history_dir().is_dir():
+        for path in sorted(history_dir().glob("*.jsonl")):
+            yield HistoryLog(path)
+
+
+class HistoryLog:
+    """Append-only backup history of one device (schema v2).
+
+    One JSON line per backup: {"alias": ..., "backup": {...}}. Taking a backup
+    only appends a line, so the file (and its git diff) grows by one line
+    instead of the whole registry being rewritten. It is rewritten only when
+    backups are removed (gc).
+    """
+    def __init__(self, path: Union[str, Path]):
+        """Initialize the log.
+
+        Args:
+            path (str | Path): The device's log file
+        """
+        self.path = Path(path)
+
+    def load(self) -> Histories:
+        """Backups per alias, oldest first.
+
+        A torn last line (crash while appending) is ignored.
+        """
+        histories: Histories = {}
+        if not self.path.exists():
+            return histories
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"{self.path}: ignoring incomplete record")
+                    continue
+                histories.setdefault(record["alias"], []).append(BackupMetadata(**record["backup"]))
+        return histories
+
+    def append(self, entries: List[Tuple[Alias, BackupMetadata]]) -> None:
+        """Append new backups, fsynced so a saved registry never references unlogged ones.
+
+        A torn last line is terminated first, so that it does not swallow the first new record.
+        """
+        if not entries:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab+") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            for alias, backup in entries:
+                f.write(_line(alias, backup).encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rewrite(self, histories: Histories) -> None:
+        """Replace the whole log atomically (after backups were removed)."""
+        atomic_write(self.path, "".join(_line(alias, b) for alias, backups in histories.items() for b in backups))
+
+
+def _line(alias: Alias, backup: BackupMetadata) -> str:
+    return json.dumps({"alias": alias, "backup": backup.model_dump()}) + "\n"
@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from src_dotfiles.blobstore import FILE_KEY, hash_tree
+from src_dotfiles.config import get_logger
+from src_dotfiles.DotFile import get_time, restore_backup
+from src_dotfiles.fsutils import _fsync_dir
+from src_dotfiles.models import BackupMetadata, DeployAction
+
+logger = get_logger(__name__)
+
+
+class Journal:
+    """Write-ahead log of a transactional deploy.
+
+    Before a deploy path is touched, its previous state is appended (and
+    fsynced) as one JSON line: "missing", a symlink and where it pointed, or
+    real content together with the backup that holds it. Farm entries record
+    the previous state of each link they are about to change.
+
+    `rollback` walks the records backwards and puts every path back. A journal
+    still on disk when a run starts means the previous transactional deploy
+    did not finish: it is rolled back before anything else happens.
+    """
+    def __init__(self, path: Union[str, Path]):
+        """Initialize the journal.
+
+        Args:
+            path (str | Path): Journal file (JSON lines)
+        """
+        self.path = Path(path)
+        self._guard = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def begin(self) -> None:
+        """Start a transaction (there must be no unfinished one)."""
+        if self.exists():
+            raise RuntimeError(f"{self.path} exists: an unfinished deploy must be recovered first")
+        self._append({"op": "begin", "time": get_time()})
+
+    def prepare(self, action: DeployAction, backup: Optional[BackupMetadata] = None) -> None:
+        """Record the state of `action.deploy_path` before `action` is applied.
+
+        Args:
+            action (DeployAction): The action about to run
+            backup (Optional[BackupMetadata]): Backup just taken of the content it replaces
+        """
+        record = {
+            "op": "prepare",
+            "alias": action.alias,
+            "deploy_path": action.deploy_path,
+            "previous": _state(action.deploy_path),
+            "backup": backup.model_dump() if backup is not None else None,
+        }
+        if action.kind == "farm":
+            record["links"] = {rel: _state(os.path.join(action.deploy_path, rel)) for rel in action.links + action.stale}
+        self._append(record)
+
+    def commit(self) -> None:
+        """End the transaction successfully: the journal is no longer needed."""
+        self.path.unlink()
+        _fsync_dir(self.path.parent)
+
+    def records(self) -> List[dict]:
+        """Prepared entries, in the order they were journaled.
+
+        A torn last line (crash while appending) is ignored: its mutation had
+        not started yet.
+        """
+        records = []
+        for line in self.path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning(f"{self.path}: ignoring incomplete record")
+                continue
+            if record["op"] == "prepare":
+                records.append(record)
+        return records
+
+    def rollback(self) -> Tuple[List[dict], List[Tuple[str, str]]]:
+        """Put every journaled path back to its recorded state, newest first.
+
+        The journal is removed only if everything could be reverted; otherwise
+        it stays for the next run (or a manual look).
+
+        Returns:
+            Tuple: the records (their backups must stay in the registry) and
+                (deploy_path, error) for paths that could not be reverted
+        """
+        records = self.records()
+        failed = []
+        for record in reversed(records):
+            try:
+                _revert(record)
+            except OSError as e:
+                logger.error(f"rollback: could not revert {record['deploy_path']}: {e}")
+                failed.append((record["deploy_path"], str(e)))
+        if not failed:
+            self.commit()
+        logger.info(f"rollback: {len(records) - len(failed)} path(s) reverted, {len(failed)} failed")
+        return records, failed
+
+    def _append(self, record: dict) -> None:
+        with self._guard:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _state(path: str) -> Dict[str, Optional[str]]:
+    """What is at `path` right now: missing, a symlink (and its target), a directory or a file."""
+    if os.path.islink(path):
+        return {"kind": "symlink", "link": os.readlink(path)}
+    if os.path.isdir(path):
+        return {"kind": "dir", "link": None}
+    if os.path.exists(path):
+        return {"kind": "content", "link": None}
+    return {"kind": "missing", "link": None}
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _relink(path: str, target: str) -> None:
+    """Atomically make `path` a symlink to `target`."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    tmp = f"{path}.rollback.tmp"
+    os.symlink(target, tmp)
+    os.replace(tmp, path)
+
+
+def _revert(record: dict) -> None:
+    """Restore one journaled deploy path (idempotent: untouched paths are left alone)."""
+    path = record["deploy_path"]
+    previous = record["previous"]
+    backup = BackupMetadata(**record["backup"]) if record["backup"] else None
+
+    if "links" in record and previous["kind"] in ("dir", "missing") and os.path.isdir(path) and not os.path.islink(path):
+        # Farm reconciled in place: revert each link it changed
+        for rel, state in record["links"].items():
+            _revert_entry(os.path.join(path, rel), state, _sub_backup(backup, rel))
+        if previous["kind"] == "missing":
+            _remove_empty_dirs(path)
+        return
+    _revert_entry(path, previous, backup)
+
+
+def _revert_entry(path: str, previous: Dict[str, Optional[str]], backup: Optional[BackupMetadata]) -> None:
+    if previous["kind"] == "missing":
+        if os.path.islink(path):
+            os.remove(path)
+    elif previous["kind"] == "symlink":
+        if not (os.path.islink(path) and os.readlink(path) == previous["link"]):
+            _relink(path, previous["link"])
+    elif backup is None:
+        logger.warning(f"rollback: no backup recorded for {path}; leaving it as is")
+    elif os.path.islink(path) or not os.path.exists(path) or not _matches(path, backup):
+        _remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        restore_backup(backup, path)
+
+
+def _remove_empty_dirs(root: str) -> None:
+    """Remove the directories a farm deploy created below (and including) `root`, if left empty."""
+    for dirpath, _, _ in os.walk(root, topdown=False):
+        if not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def _matches(path: str, backup: BackupMetadata) -> bool:
+    """Whether `path` still holds exactly the backed-up content (e.g. apply never ran)."""
+    if backup.manifest is None:
+        return False
+    return hash_tree(path) == backup.manifest
+
+
+def _sub_backup(backup: Optional[BackupMetadata], rel: str) -> Optional[BackupMetadata]:
+    """The part of a farm backup (keyed by paths relative to the farm) that holds `rel`."""
+    if backup is None or backup.manifest is None:
+        return None
+    manifest = _sub_keys(backup.manifest, rel)
+    if not manifest:
+        return None
+    modes = _sub_keys(backup.modes, rel) if backup.modes is not None else None
+    return backup.model_copy(update={"manifest": manifest, "modes": modes})
+
+
+def _sub_keys(mapping: dict, rel: str) -> dict:
+    """Entries of a manifest-keyed mapping below `rel`, keyed relative to it."""
+    sub = {}
+    for key, value in mapping.items():
+        if key == rel:
+            sub[FILE_KEY] = value
+        elif key.startswith(rel + "/"):
+            sub[key[len(rel) + 1:]] = value
+    return sub
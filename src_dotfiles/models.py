@@ -1,6 +1,6 @@
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Literal
 from pydantic import BaseModel, Field
 
 Alias = str
@@ -12,9 +12,15 @@ class BackupMetadata(BaseModel):
     Attributes:
         backup_path (str): Path where the backup is stored
         datetime (str): When the backup was made (format: YYYY-MM-DD_HH:MM)
+        manifest (Optional[Dict[str, str]]): Content-addressed manifest of the backup,
+            relative path -> sha256 ("." for a single file). None for legacy full copies.
+        modes (Optional[Dict[str, int]]): Permission bits of the files, keyed like `manifest`.
+            None for backups made before modes were recorded.
     """
     backup_path: str
     datetime: str
+    manifest: Optional[Dict[str, str]] = None
+    modes: Optional[Dict[str, int]] = None
 
 class DeployedDotFile(BaseModel):
     """
@@ -41,12 +47,18 @@ class DotFileModel(BaseModel):
         deploy (Dict[Identifier, DeployedDotFile]): Dictionary of deployment information for this dotfile on different systems.
         only_devices (Optional[List[Identifier]]): If set, restrict deployment to only these devices.
         variants (Optional[Dict[Identifier, str]]): Device-specific variant paths, mapping device identifier to an alternate dotfile path.
+        farm (bool): For directory dotfiles, deploy one symlink per file (stow-style) inside a real
+            directory instead of symlinking the whole directory, so machine-local files next to them survive.
+        template (bool): The source (main or variant) of this single-file dotfile is a template rendered per
+            device into `rendered/<identifier>/<alias>`, which is what gets deployed.
     """
     alias: Alias
     main: str
     deploy: Dict[Identifier, DeployedDotFile] = Field(default_factory=dict)
     only_devices: Optional[List[Identifier]] = None
     variants: Optional[Dict[Identifier, str]] = None
+    farm: bool = False
+    template: bool = False
 
 class DevicesData(BaseModel):
     """
@@ -56,10 +68,20 @@ class DevicesData(BaseModel):
         identifier (str): Unique identifier for the system (e.g., hostname.username).
         home_path (str): Path to the home directory on this system.
         dotfiles_dir_path (str): Path to the dotfiles directory on this system.
+        ssh_host (Optional[str]): SSH destination used by `deploy --hosts` (e.g. "user@host" or an
+            ~/.ssh/config alias). Defaults to user@hostname taken from the identifier.
+        system (Optional[str]): `platform.system()` of the device (e.g. "Linux", "Darwin"), recorded
+            by the device itself; None until it has run a saving command.
     """
     identifier: Identifier
     home_path: str 
     dotfiles_dir_path: str
+    ssh_host: Optional[str] = None
+    system: Optional[str] = None
+
+# v2: backup histories live in per-device logs (`history/<identifier>.jsonl`),
+# so `deploy[...].backups` is always saved empty in dotfiles.json.
+SCHEMA_VERSION = 2
 
 class MetaDataDotFiles(BaseModel):
     """
@@ -69,10 +91,41 @@ class MetaDataDotFiles(BaseModel):
     where dotfiles can be deployed.
 
     Attributes:
-        version (int): Schema version for forward-compatible migrations. Defaults to 1.
+        version (int): Schema version for forward-compatible migrations. Defaults to 1
+            (files written before the field existed); see SCHEMA_VERSION.
         dotfiles (Dict[str, DotFileModel]): Dictionary mapping dotfile aliases to their models.
         devices (Dict[str, DevicesData]): Mapping of system identifiers to their device configuration.
     """
     version: int = 1
     dotfiles: Dict[Alias, DotFileModel] = Field(default_factory=dict)
     devices: Dict[Identifier, DevicesData] = Field(default_factory=dict)
+
+DeployKind = Literal["noop", "create", "replace_file", "replace_dir", "sudo", "farm"]
+
+class DeployAction(BaseModel):
+    """One planned filesystem change for a dotfile, computed before anything is touched.
+
+    Attributes:
+        alias (str): Alias of the dotfile the action belongs to.
+        deploy_path (str): Path where the symlink must end up.
+        target (str): Absolute path the symlink must point to (main or variant).
+        kind (str): "noop" (already correct), "create" (nothing there yet),
+            "replace_file" (file or wrong symlink in the way), "replace_dir"
+            (real directory in the way), "sudo" (parent not writable by us) or
+            "farm" (per-file links of a farm dotfile to reconcile).
+        current (Optional[str]): Current symlink target if deploy_path is a symlink.
+        backup (bool): Whether deploy_path holds real content that must be backed up first.
+        links (List[str]): Farm only: paths relative to deploy_path to (re)link.
+        stale (List[str]): Farm only: links into the source whose file no longer exists.
+        conflicts (List[str]): Farm only: entries of `links` holding real content, the
+            only ones backed up.
+    """
+    alias: Alias
+    deploy_path: str
+    target: str
+    kind: DeployKind
+    current: Optional[str] = None
+    backup: bool = False
+    links: List[str] = Field(default_factory=list)
+    stale: List[str] = Field(default_factory=list)
+    conflicts: List[str] = Field(default_factory=list)
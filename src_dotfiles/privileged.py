@@ -0,0 +1,77 @@
+"""Elevated helper applying many root-owned symlinks in one `sudo` call.
+
+Run as `sudo python -m src_dotfiles.privileged`: reads a JSON list of
+{"deploy_path": ..., "target": ...} on stdin and writes one
+{"deploy_path": ..., "ok": bool, "error": str} per entry, in order, as a JSON
+list on stdout. Standard library only, so it imports nothing else of the
+package (and nothing that would run with root privileges by accident).
+"""
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+
+def link(deploy_path: str, target: str) -> None:
+    """Atomically point `deploy_path` at `target` (the equivalent of `ln -sfn`).
+
+    Refuses to replace a real directory, like `DotFile._deploy_via_sudo`.
+    """
+    if os.path.isdir(deploy_path) and not os.path.islink(deploy_path):
+        raise IsADirectoryError(f"{deploy_path} is a directory (not a symlink); refusing to replace it as root")
+    tmp = os.path.join(os.path.dirname(deploy_path), f".{os.path.basename(deploy_path)}.{os.getpid()}.tmp")
+    os.symlink(target, tmp)
+    try:
+        os.replace(tmp, deploy_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def apply_all(requests: List[Dict[str, str]]) -> List[Dict[str, object]]:
+    """Link every request, never stopping at a failed one."""
+    results = []
+    for request in requests:
+        result = {"deploy_path": request["deploy_path"], "ok": True, "error": ""}
+        try:
+            link(request["deploy_path"], request["target"])
+        except OSError as e:
+            result.update(ok=False, error=str(e))
+        results.append(result)
+    return results
+
+
+def run(requests: List[Dict[str, str]], cwd: str, command: Optional[List[str]] = None) -> List[Dict[str, object]]:
+    """Send `requests` to one elevated helper process and return its per-entry results.
+
+    sudo asks for the password (at most once) on the terminal; stdout only
+    carries the JSON results.
+
+    Args:
+        requests (List[Dict[str, str]]): deploy_path/target pairs
+        cwd (str): Directory containing the `src_dotfiles` package
+        command (Optional[List[str]]): Helper command, default `sudo <python> -m src_dotfiles.privileged`
+
+    Raises:
+        PermissionError: If the helper could not run (e.g. sudo refused)
+    """
+    command = command or ["sudo", sys.executable, "-m", "src_dotfiles.privileged"]
+    proc = subprocess.run(command, input=json.dumps(requests), stdout=subprocess.PIPE, text=True, cwd=cwd)
+    if proc.returncode != 0:
+        raise PermissionError(f"privileged helper failed (exit {proc.returncode})")
+    return json.loads(proc.stdout)
+
+
+def main() -> int:
+    try:
+        requests = json.load(sys.stdin)
+    except ValueError as e:
+        print(f"invalid request list: {e}", file=sys.stderr)
+        return 2
+    json.dump(apply_all(requests), sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
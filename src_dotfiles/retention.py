@@ -0,0 +1,137 @@
+import os
+from datetime import datetime
+from typing import Callable, List, Optional, Set, Tuple
+from src_dotfiles.models import BackupMetadata
+from src_dotfiles.DotFile import DATETIME_FORMAT
+
+# Backups written before 2025 used minute precision
+BACKUP_TIME_FORMATS = (DATETIME_FORMAT, "%Y-%m-%d_%H:%M")
+
+
+def backup_key(backup: BackupMetadata) -> Tuple[str, str]:
+    """Identity of a backup entry, used to index/merge histories in O(1)."""
+    return backup.backup_path, backup.datetime
+
+
+def parse_backup_time(value: str) -> Optional[datetime]:
+    """Parse a BackupMetadata.datetime, whatever format it was written with.
+
+    Returns:
+        Optional[datetime]: The timestamp, or None if it cannot be parsed
+    """
+    for fmt in BACKUP_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def disk_usage(path: str, seen: Set[Tuple[int, int]]) -> int:
+    """Bytes used by a file or tree, counting each inode once across calls.
+
+    Backups are hardlinks into the blob store, so two snapshots of the same
+    content only cost their size once; `seen` carries that across backups.
+    """
+    if not os.path.lexists(path):
+        return 0
+    paths = [path]
+    if os.path.isdir(path) and not os.path.islink(path):
+        paths = [os.path.join(d, f) for d, _, files in os.walk(path) for f in files]
+    total = 0
+    for p in paths:
+        st = os.lstat(p)
+        if (st.st_dev, st.st_ino) in seen:
+            continue
+        seen.add((st.st_dev, st.st_ino))
+        total += st.st_size
+    return total
+
+
+def select_backups(
+    backups: List[BackupMetadata],
+    keep_last: int = 5,
+    keep_daily: int = 7,
+    keep_weekly: int = 4,
+    max_bytes: Optional[int] = None,
+    size_of: Optional[Callable[[BackupMetadata], int]] = None,
+) -> List[BackupMetadata]:
+    """Apply the retention policy to one backup history.
+
+    A backup is kept if it is among the `keep_last` newest, or the newest of
+    one of the `keep_daily` most recent days, or the newest of one of the
+    `keep_weekly` most recent ISO weeks. The kept set is then trimmed with
+    `fit_budget`. Backups with an unparseable timestamp are never pruned.
+
+    Args:
+        backups (List[BackupMetadata]): History of one deploy entry
+        keep_last (int): Number of most recent backups always kept
+        keep_daily (int): Number of most recent days keeping their newest backup
+        keep_weekly (int): Number of most recent weeks keeping their newest backup
+        max_bytes (Optional[int]): Upper bound on the total size of kept backups
+        size_of (Optional[Callable]): Size of a backup, required with max_bytes
+
+    Returns:
+        List[BackupMetadata]: Kept backups, in their original order
+    """
+    dated = [(parse_backup_time(b.datetime), i) for i, b in enumerate(backups)]
+    newest_first = sorted(((t, i) for t, i in dated if t is not None), reverse=True)
+    keep = {i for t, i in dated if t is None}
+
+    days, weeks = set(), set()
+    for rank, (t, i) in enumerate(newest_first):
+        day, week = t.date(), t.isocalendar()[:2]
+        if rank < keep_last:
+            keep.add(i)
+        if day not in days and len(days) < keep_daily:
+            keep.add(i)
+        if week not in weeks and len(weeks) < keep_weekly:
+            keep.add(i)
+        days.add(day)
+        weeks.add(week)
+
+    kept = [b for i, b in enumerate(backups) if i in keep]
+    if max_bytes is not None and size_of is not None:
+        kept = fit_budget([kept], max_bytes, size_of)[0]
+    return kept
+
+
+def fit_budget(
+    histories: List[List[BackupMetadata]],
+    max_bytes: int,
+    size_of: Callable[[BackupMetadata], int],
+) -> List[List[BackupMetadata]]:
+    """Trim several backup histories, oldest first across all of them, until they fit in `max_bytes`.
+
+    Backups with an unparseable timestamp are never pruned, but their size
+    counts against the budget before any other. The newest backup of each
+    history always survives.
+
+    Args:
+        histories (List[List[BackupMetadata]]): Histories sharing the budget
+        max_bytes (int): Upper bound on their total size
+        size_of (Callable): Size of a backup
+
+    Returns:
+        List[List[BackupMetadata]]: Kept backups of each history, in their original order
+    """
+    total = 0
+    dated = []
+    for h, backups in enumerate(histories):
+        for i, b in enumerate(backups):
+            t = parse_backup_time(b.datetime)
+            if t is None:
+                total += size_of(b)
+            else:
+                dated.append((t, h, i))
+    dated.sort(reverse=True)
+    newest = {}
+    for t, h, i in dated:
+        newest.setdefault(h, i)
+
+    dropped = set()
+    for t, h, i in dated:
+        total += size_of(histories[h][i])
+        if total > max_bytes and newest[h] != i:
+            dropped.add((h, i))
+    return [[b for i, b in enumerate(backups) if (h, i) not in dropped] for h, backups in enumerate(histories)]
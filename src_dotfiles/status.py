@@ -0,0 +1,149 @@
+import json
+import os
+import stat
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.DotFile import DotFile
+from src_dotfiles.fsutils import atomic_write
+
+logger = get_logger(__name__)
+
+OK = "ok"
+MISSING = "missing"                      # nothing at the deploy path (farm: some links missing)
+SHADOWED = "shadowed"                    # a regular file or directory sits where the symlink should be
+DANGLING = "dangling"                    # symlink whose target does not exist
+WRONG_TARGET = "wrong_target"            # symlink pointing outside this dotfile's sources
+VARIANT_MISMATCH = "variant_mismatch"    # symlink to main/another variant instead of this device's source
+
+STATUSES = (OK, MISSING, SHADOWED, DANGLING, WRONG_TARGET, VARIANT_MISMATCH)
+# Statuses whose correctness also depends on the symlink target still existing
+_TARGET_DEPENDENT = (OK, VARIANT_MISMATCH, WRONG_TARGET)
+
+# (status, current link target or None)
+Drift = Tuple[str, Optional[str]]
+
+
+class StatusCache:
+    """Persistent (deploy path -> inode, mtime) cache for `status`.
+
+    An entry is reused as long as the deploy path still has the same inode and
+    mtime and the expected target did not change, which spares the readlink on
+    every check; replacing a symlink always changes its inode. The file is
+    per-host state and lives next to the registry, gitignored.
+    """
+    def __init__(self, path: Union[str, Path]):
+        """Load the cache, starting empty if it is missing or unreadable.
+
+        Args:
+            path (str | Path): Cache file
+        """
+        self.path = Path(path)
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+        self.hits = 0
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable status cache {self.path}: {e}")
+
+    def get(self, deploy_path: str, st: os.stat_result, target: str) -> Optional[Drift]:
+        """Cached drift for `deploy_path` if its inode/mtime and expected target are unchanged."""
+        entry = self.entries.get(deploy_path)
+        if entry is None or entry["ino"] != st.st_ino or entry["mtime_ns"] != st.st_mtime_ns or entry["target"] != target:
+            return None
+        self.hits += 1
+        return entry["status"], entry["current"]
+
+    def put(self, deploy_path: str, st: Optional[os.stat_result], target: str, drift: Drift) -> None:
+        """Record the drift of `deploy_path` (a missing path is not cached)."""
+        if st is None:
+            self.dirty |= self.entries.pop(deploy_path, None) is not None
+            return
+        entry = {"ino": st.st_ino, "mtime_ns": st.st_mtime_ns, "target": target, "status": drift[0], "current": drift[1]}
+        if self.entries.get(deploy_path) != entry:
+            self.entries[deploy_path] = entry
+            self.dirty = True
+
+    def retain(self, deploy_paths: List[str]) -> None:
+        """Forget entries for paths that are no longer managed."""
+        keep = set(deploy_paths)
+        for path in [p for p in self.entries if p not in keep]:
+            del self.entries[path]
+            self.dirty = True
+
+    def save(self) -> None:
+        """Write the cache back if anything changed."""
+        if self.dirty:
+            atomic_write(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
+            self.dirty = False
+
+
+def check(dot_file: DotFile, cache: Optional[StatusCache] = None) -> Drift:
+    """Classify the deploy path of `dot_file` without modifying anything.
+
+    Args:
+        dot_file (DotFile): Entry to check, for its own device
+        cache (Optional[StatusCache]): Stat cache to consult and update
+
+    Returns:
+        Drift: One of STATUSES, and the current symlink target if any
+    """
+    if dot_file.data.farm:
+        return _check_farm(dot_file)
+    deploy_path = dot_file.data.deploy[dot_file.identifier].deploy_path
+    target = dot_file.source_path(render=False)
+    try:
+        st = os.lstat(deploy_path)
+    except FileNotFoundError:
+        st = None
+
+    drift = cache.get(deploy_path, st, target) if cache is not None and st is not None else None
+    if drift is not None:
+        # The link itself is unchanged, but its target may have come or gone
+        if drift[0] in _TARGET_DEPENDENT and not os.path.exists(deploy_path):
+            drift = (DANGLING, drift[1])
+        elif drift[0] == DANGLING and os.path.exists(deploy_path):
+            drift = None
+    if drift is None:
+        drift = _classify(dot_file, deploy_path, st, target)
+    if cache is not None:
+        cache.put(deploy_path, st, target, drift)
+    return drift
+
+
+def _check_farm(dot_file: DotFile) -> Drift:
+    """Drift of a symlink farm, from its plan (per-file links are not cached)."""
+    action = dot_file.plan(render=False)
+    if not os.path.lexists(action.deploy_path):
+        return MISSING, None
+    if action.kind == "noop":
+        return OK, None
+    if action.backup:
+        return SHADOWED, None
+    if action.current is not None:
+        return WRONG_TARGET, action.current  # still one directory symlink
+    if action.links:
+        return MISSING, None
+    return DANGLING, None  # only links to files removed from the source
+
+
+def _classify(dot_file: DotFile, deploy_path: str, st: Optional[os.stat_result], target: str) -> Drift:
+    """Slow path of `check`: readlink and compare against the dotfile's sources."""
+    if st is None:
+        return MISSING, None
+    if not stat.S_ISLNK(st.st_mode):
+        return SHADOWED, None
+
+    current = os.readlink(deploy_path)
+    if not os.path.exists(deploy_path):
+        return DANGLING, current
+    if current == target:
+        return OK, current
+    sources = [dot_file.data.main, *(dot_file.data.variants or {}).values()]
+    resolved = os.path.realpath(deploy_path)
+    if any(resolved == os.path.realpath(Path(config.project_path).joinpath(s)) for s in sources):
+        return VARIANT_MISMATCH, current
+    return WRONG_TARGET, current
@@ -0,0 +1,399 @@
+import hashlib
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.fsutils import atomic_write
+from src_dotfiles.history import Histories, HistoryLog, history_path, iter_logs
+from src_dotfiles.models import BackupMetadata, DeployedDotFile, DevicesData, DotFileModel, Identifier, MetaDataDotFiles
+
+logger = get_logger(__name__)
+
+# (alias, backup_path, datetime): identity of a logged backup
+BackupKey = Tuple[str, str, str]
+
+
+def _content_hash(data: str) -> str:
+    """sha256 of the registry text, used for dirty tracking."""
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _keys(histories: Histories) -> List[BackupKey]:
+    return [(alias, b.backup_path, b.datetime) for alias, backups in histories.items() for b in backups]
+
+
+class Storage(ABC):
+    """Where `Dependencies` loads and saves the registry and the backup histories.
+
+    The registry (`MetaDataDotFiles`) is loaded and saved without backups;
+    histories are loaded per device. Implementations track what they last
+    loaded or saved, so that saving an unchanged registry writes nothing.
+    """
+    path: Path
+
+    @abstractmethod
+    def exists(self) -> bool:
+        """Whether a registry is stored yet."""
+
+    @abstractmethod
+    def load(self) -> Optional[MetaDataDotFiles]:
+        """The stored registry, or None if nothing is stored yet."""
+
+    @abstractmethod
+    def save(self, metadata: MetaDataDotFiles) -> bool:
+        """Store the registry (backup lists are ignored).
+
+        Returns:
+            bool: True if anything was written
+        """
+
+    @abstractmethod
+    def load_history(self, identifier: Identifier) -> Histories:
+        """Backups of one device, per alias, oldest first."""
+
+    @abstractmethod
+    def save_history(self, identifier: Identifier, histories: Histories) -> None:
+        """Make the stored history of `identifier` equal to `histories`."""
+
+    @abstractmethod
+    def history_identifiers(self) -> List[Identifier]:
+        """Devices with a stored history."""
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    """`dotfiles.json` (tracked in git) plus one local, append-only history log per device (schema v2)."""
+    def __init__(self, path: Union[str, Path]):
+        """Initialize the storage.
+
+        Args:
+            path (str | Path): The dotfiles.json file
+        """
+        self.path = Path(path)
+        # Hash of the registry bytes as last read from / written to disk; save
+        # skips the rewrite when the serialized metadata still hashes the same.
+        self._saved_hash: Optional[str] = None
+        # identifier -> keys of the backups in its log, in log order
+        self._logged: Dict[Identifier, List[BackupKey]] = {}
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> Optional[MetaDataDotFiles]:
+        if not self.path.exists():
+            return None
+        logger.debug(f"Loading metadata from {self.path}")
+        raw = self.path.read_text()
+        self._saved_hash = _content_hash(raw)
+        return MetaDataDotFiles.model_validate_json(raw)
+
+    def save(self, metadata: MetaDataDotFiles) -> bool:
+        serialized = _without_history(metadata).model_dump_json(indent=4)
+        content_hash = _content_hash(serialized)
+        if content_hash == self._saved_hash and self.path.exists():
+            logger.debug(f"{self.path} unchanged; skipping write")
+            return False
+
+        logger.info(f"Saving to {self.path}")
+        atomic_write(self.path, serialized)
+        self._saved_hash = content_hash
+        return True
+
+    def load_history(self, identifier: Identifier) -> Histories:
+        histories = HistoryLog(history_path(identifier)).load()
+        self._logged[identifier] = _keys(histories)
+        return histories
+
+    def save_history(self, identifier: Identifier, histories: Histories) -> None:
+        """Append the new backups if the log is a prefix of `histories`, rewrite it otherwise."""
+        log = HistoryLog(history_path(identifier))
+        if identifier not in self._logged:
+            self._logged[identifier] = _keys(log.load())
+        logged = self._logged[identifier]
+        current = _keys(histories)
+
+        per_alias: Dict[str, List[BackupKey]] = {}
+        for key in logged:
+            per_alias.setdefault(key[0], []).append(key)
+        rewrite = bool(per_alias.keys() - histories.keys())
+        appended = []
+        for alias, backups in histories.items():
+            before = per_alias.get(alias, [])
+            if _keys({alias: backups[:len(before)]}) != before:
+                rewrite = True
+                break
+            appended.extend((alias, b) for b in backups[len(before):])
+        if rewrite:
+            logger.info(f"Rewriting {log.path}")
+            log.rewrite(histories)
+        else:
+            log.append(appended)
+        self._logged[identifier] = current
+
+    def history_identifiers(self) -> List[Identifier]:
+        return [log.path.stem for log in iter_logs()]
+
+
+class SqliteStorage(Storage):
+    """Local SQLite registry: indexed tables, row-level diffs, one transaction per save.
+
+    Loading builds the models with `model_construct` (the rows were validated
+    when written), and saving only touches the rows that changed, so neither
+    re-parses nor re-dumps the whole document. Not meant for git: sync it
+    with `export-json` / `import-json`.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS devices (
+            identifier TEXT PRIMARY KEY, position INTEGER NOT NULL,
+            home_path TEXT NOT NULL, dotfiles_dir_path TEXT NOT NULL, ssh_host TEXT, system TEXT
+        );
+        CREATE TABLE IF NOT EXISTS dotfiles (
+            alias TEXT PRIMARY KEY, position INTEGER NOT NULL, main TEXT NOT NULL,
+            only_devices TEXT, variants TEXT, farm INTEGER NOT NULL DEFAULT 0,
+            template INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS deploys (
+            alias TEXT NOT NULL, identifier TEXT NOT NULL, position INTEGER NOT NULL,
+            deploy_path TEXT NOT NULL, PRIMARY KEY (alias, identifier)
+        );
+        CREATE INDEX IF NOT EXISTS deploys_by_path ON deploys (identifier, deploy_path);
+        CREATE TABLE IF NOT EXISTS backups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, identifier TEXT NOT NULL, alias TEXT NOT NULL,
+            backup_path TEXT NOT NULL, datetime TEXT NOT NULL, manifest TEXT,
+            UNIQUE (identifier, alias, backup_path, datetime)
+        );
+        CREATE INDEX IF NOT EXISTS backups_by_device ON backups (identifier, alias, id);
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """Open (and create if needed) the database.
+
+        Args:
+            path (str | Path): The SQLite file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(self.SCHEMA)
+        # Columns added after the first release of this schema
+        for table, column, definition in (
+            ("devices", "ssh_host", "TEXT"),
+            ("devices", "system", "TEXT"),
+            ("dotfiles", "template", "INTEGER NOT NULL DEFAULT 0"),
+            ("backups", "modes", "TEXT"),
+        ):
+            if column not in {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}:
+                with self.conn:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        # Rows as last loaded or saved, per table: primary key -> row
+        self._rows: Dict[str, Dict[tuple, tuple]] = {}
+        self._logged: Dict[Identifier, Set[BackupKey]] = {}
+
+    def exists(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM meta WHERE key = 'version'").fetchone() is not None
+
+    def load(self) -> Optional[MetaDataDotFiles]:
+        if not self.exists():
+            return None
+        logger.debug(f"Loading metadata from {self.path}")
+        version = int(self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+        devices = {
+            identifier: DevicesData.model_construct(
+                identifier=identifier, home_path=home, dotfiles_dir_path=dotfiles_dir, ssh_host=ssh_host, system=system)
+            for identifier, home, dotfiles_dir, ssh_host, system in self.conn.execute(
+                "SELECT identifier, home_path, dotfiles_dir_path, ssh_host, system FROM devices ORDER BY position")
+        }
+        deploys: Dict[str, Dict[Identifier, DeployedDotFile]] = {}
+        for alias, identifier, deploy_path in self.conn.execute(
+                "SELECT alias, identifier, deploy_path FROM deploys ORDER BY alias, position"):
+            deploys.setdefault(alias, {})[identifier] = DeployedDotFile.model_construct(deploy_path=deploy_path, backups=[])
+        # Other devices' backups are those still inline in their v1 registry: load them inline too
+        for identifier in self.history_identifiers():
+            if identifier == config.identifier:
+                continue
+            for alias, backups in self.load_history(identifier).items():
+                if identifier in deploys.get(alias, {}):
+                    deploys[alias][identifier].backups = backups
+        dotfiles = {
+            alias: DotFileModel.model_construct(
+                alias=alias, main=main, deploy=deploys.get(alias, {}),
+                only_devices=json.loads(only_devices) if only_devices is not None else None,
+                variants=json.loads(variants) if variants is not None else None,
+                farm=bool(farm), template=bool(template),
+            )
+            for alias, main, only_devices, variants, farm, template in self.conn.execute(
+                "SELECT alias, main, only_devices, variants, farm, template FROM dotfiles ORDER BY position")
+        }
+        metadata = MetaDataDotFiles.model_construct(version=version, dotfiles=dotfiles, devices=devices)
+        self._rows = _rows(metadata)
+        return metadata
+
+    def save(self, metadata: MetaDataDotFiles) -> bool:
+        rows = _rows(metadata)
+        changes = 0
+        with self.conn:
+            for table, table_rows in rows.items():
+                before = self._rows.get(table, {})
+                stale = [key for key in before if key not in table_rows]
+                changed = [row for key, row in table_rows.items() if before.get(key) != row]
+                if stale:
+                    where = " AND ".join(f"{column} = ?" for column in _PRIMARY_KEYS[table])
+                    self.conn.executemany(f"DELETE FROM {table} WHERE {where}", stale)
+                if changed:
+                    placeholders = ", ".join("?" * len(changed[0]))
+                    self.conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", changed)
+                changes += len(stale) + len(changed)
+        self._rows = rows
+        if changes:
+            logger.info(f"Saved {changes} changed row(s) to {self.path}")
+        else:
+            logger.debug(f"{self.path} unchanged; nothing written")
+        return changes > 0
+
+    def load_history(self, identifier: Identifier) -> Histories:
+        histories: Histories = {}
+        for alias, backup_path, datetime, manifest, modes in self.conn.execute(
+                "SELECT alias, backup_path, datetime, manifest, modes FROM backups WHERE identifier = ? ORDER BY id",
+                (identifier,)):
+            histories.setdefault(alias, []).append(BackupMetadata.model_construct(
+                backup_path=backup_path, datetime=datetime,
+                manifest=json.loads(manifest) if manifest is not None else None,
+                modes=json.loads(modes) if modes is not None else None,
+            ))
+        self._logged[identifier] = set(_keys(histories))
+        return histories
+
+    def save_history(self, identifier: Identifier, histories: Histories) -> None:
+        if identifier not in self._logged:
+            self.load_history(identifier)
+        logged = self._logged[identifier]
+        current = _keys(histories)
+        new = [
+            (identifier, alias, b.backup_path, b.datetime,
+             json.dumps(b.manifest) if b.manifest is not None else None,
+             json.dumps(b.modes) if b.modes is not None else None)
+            for alias, backups in histories.items() for b in backups
+            if (alias, b.backup_path, b.datetime) not in logged
+        ]
+        removed = [(identifier, *key) for key in logged - set(current)]
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM backups WHERE identifier = ? AND alias = ? AND backup_path = ? AND datetime = ?", removed)
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO backups (identifier, alias, backup_path, datetime, manifest, modes) VALUES (?, ?, ?, ?, ?, ?)",
+                new)
+        self._logged[identifier] = set(current)
+
+    def history_identifiers(self) -> List[Identifier]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT identifier FROM backups ORDER BY identifier")]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+_PRIMARY_KEYS = {
+    "meta": ("key",),
+    "devices": ("identifier",),
+    "dotfiles": ("alias",),
+    "deploys": ("alias", "identifier"),
+}
+
+
+def _rows(metadata: MetaDataDotFiles) -> Dict[str, Dict[tuple, tuple]]:
+    """Table rows of a registry (without backups), keyed by primary key, in column order."""
+    rows: Dict[str, Dict[tuple, tuple]] = {
+        "meta": {("version",): ("version", str(metadata.version))},
+        "devices": {},
+        "dotfiles": {},
+        "deploys": {},
+    }
+    for position, (identifier, device) in enumerate(metadata.devices.items()):
+        rows["devices"][(identifier,)] = (
+            identifier, position, device.home_path, device.dotfiles_dir_path, device.ssh_host, device.system)
+    for position, (alias, model) in enumerate(metadata.dotfiles.items()):
+        rows["dotfiles"][(alias,)] = (
+            alias, position, model.main,
+            json.dumps(model.only_devices) if model.only_devices is not None else None,
+            json.dumps(model.variants) if model.variants is not None else None,
+            int(model.farm),
+            int(model.template),
+        )
+        for deploy_position, (identifier, deployed) in enumerate(model.deploy.items()):
+            rows["deploys"][(alias, identifier)] = (alias, identifier, deploy_position, deployed.deploy_path)
+    return rows
+
+
+def _without_history(metadata: MetaDataDotFiles) -> MetaDataDotFiles:
+    """The metadata as saved in dotfiles.json: this device's backup lists empty.
+
+    Other devices' backups still inline are those of a v1 registry their
+    device has not migrated yet: they are kept until it does.
+    """
+    dotfiles = {
+        alias: model.model_copy(update={"deploy": {
+            identifier: deployed.model_copy(update={"backups": []})
+            if deployed.backups and identifier == config.identifier else deployed
+            for identifier, deployed in model.deploy.items()
+        }})
+        for alias, model in metadata.dotfiles.items()
+    }
+    return metadata.model_copy(update={"dotfiles": dotfiles})
+
+
+def open_storage(json_path: Union[str, Path]) -> Storage:
+    """The storage selected by `config.storage` (env DOTFILES_STORAGE).
+
+    An empty SQLite registry is first filled from `json_path` and the history
+    logs, so switching backend needs no manual step.
+
+    Raises:
+        ValueError: For an unknown backend name
+    """
+    if config.storage == "json":
+        return JsonStorage(json_path)
+    if config.storage != "sqlite":
+        raise ValueError(f"Unknown registry storage {config.storage!r} (expected 'json' or 'sqlite')")
+    storage = SqliteStorage(Path(config.project_path).joinpath(config.sqlite_path))
+    source = JsonStorage(json_path)
+    if not storage.exists() and source.exists():
+        logger.info(f"Importing {source.path} into {storage.path}")
+        copy_registry(source, storage)
+    return storage
+
+
+def copy_registry(source: Storage, dest: Storage) -> None:
+    """Replace the registry and histories stored in `dest` with those of `source`.
+
+    Backups still inline in a v1 registry are carried over as history too;
+    histories of devices `source` has none for are emptied in `dest`.
+    """
+    metadata = source.load() or MetaDataDotFiles()
+    histories = {identifier: source.load_history(identifier) for identifier in source.history_identifiers()}
+    for alias, model in metadata.dotfiles.items():
+        for identifier, deployed in model.deploy.items():
+            logged = histories.setdefault(identifier, {}).setdefault(alias, [])
+            known = {(b.backup_path, b.datetime) for b in logged}
+            logged.extend(b for b in deployed.backups if (b.backup_path, b.datetime) not in known)
+            if identifier != config.identifier:
+                # Still owned by that device: stays inline in a JSON registry until it migrates
+                deployed.backups = list(logged)
+    dest.load()
+    dest.save(metadata)
+    for identifier in dest.history_identifiers():
+        if identifier not in histories:
+            dest.save_history(identifier, {})  # a device `source` knows no backups of
+    for identifier, history in histories.items():
+        dest.save_history(identifier, {alias: backups for alias, backups in history.items() if backups})
+    logger.info(f"Copied {len(metadata.dotfiles)} dotfile(s) and {len(histories)} device history(ies) to {dest.path}")
+
+
+def iter_histories(storage: Storage, exclude: Optional[Identifier] = None) -> Iterator[Histories]:
+    """Stored histories of every device but `exclude`."""
+    for identifier in storage.history_identifiers():
+        if identifier != exclude:
+            yield storage.load_history(identifier)
@@ -0,0 +1,182 @@
+"""Minimal Jinja-style templates for dotfiles rendered per device.
+
+Supported: `{{ name }}` substitutions and `{% if %}` / `{% elif %}` /
+`{% else %}` / `{% endif %}` blocks whose condition is `name`, `not name`,
+`name == "value"` or `name != "value"`. Like Jinja with `trim_blocks` and
+`lstrip_blocks`, a block tag alone on its line leaves no blank line behind.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from src_dotfiles.config import config, get_logger
+from src_dotfiles.fsutils import atomic_write
+from src_dotfiles.models import DevicesData
+
+logger = get_logger(__name__)
+
+_TOKEN = re.compile(r"{{\s*(?P<var>.*?)\s*}}|^[ \t]*{%\s*(?P<line_block>.*?)\s*%}[ \t]*\n|{%\s*(?P<block>.*?)\s*%}", re.M | re.S)
+_NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+_CONDITION = re.compile(rf'^(?P<not>not\s+)?(?P<name>{_NAME})(?:\s*(?P<op>==|!=)\s*(?P<quote>["\'])(?P<value>.*?)(?P=quote))?$')
+
+# ("text", str) | ("var", name) | ("if", [(condition, body), ...], else_body)
+Node = Tuple[Any, ...]
+
+
+class TemplateError(ValueError):
+    """Syntax error in a template, or a variable it uses is not defined."""
+
+
+@functools.lru_cache(maxsize=128)
+def compile_template(text: str) -> Tuple[Node, ...]:
+    """Parse a template once; later renders of the same text reuse the parsed nodes."""
+    root: List[Node] = []
+    # Open if-blocks: (branches, [else body, or None until {% else %}])
+    stack: List[Tuple[List[Tuple[str, List[Node]]], List[Optional[List[Node]]]]] = []
+    current = root
+    position = 0
+    for match in _TOKEN.finditer(text):
+        if match.start() > position:
+            current.append(("text", text[position:match.start()]))
+        position = match.end()
+        line = text.count("\n", 0, match.start()) + 1
+        if match.group("var") is not None:
+            name = match.group("var")
+            if not re.fullmatch(_NAME, name):
+                raise TemplateError(f"line {line}: unsupported expression {{{{ {name} }}}}")
+            current.append(("var", name))
+            continue
+
+        tag = match.group("line_block") if match.group("line_block") is not None else match.group("block")
+        keyword, _, argument = tag.partition(" ")
+        if keyword == "if":
+            branches = [(_condition(argument, line), [])]
+            else_body: List[Optional[List[Node]]] = [None]
+            current.append(("if", branches, else_body))
+            stack.append((branches, else_body))
+            current = branches[0][1]
+        elif keyword in ("elif", "else", "endif"):
+            if not stack:
+                raise TemplateError(f"line {line}: {{% {keyword} %}} without {{% if %}}")
+            branches, else_body = stack[-1]
+            if else_body[0] is not None and keyword != "endif":
+                raise TemplateError(f"line {line}: {{% {keyword} %}} after {{% else %}}")
+            if keyword == "elif":
+                branches.append((_condition(argument, line), []))
+                current = branches[-1][1]
+            elif keyword == "else":
+                else_body[0] = []
+                current = else_body[0]
+            else:
+                stack.pop()
+                current = _innermost(root, stack)
+        else:
+            raise TemplateError(f"line {line}: unsupported tag {{% {tag} %}}")
+    if stack:
+        raise TemplateError("unclosed {% if %}")
+    if position < len(text):
+        current.append(("text", text[position:]))
+    return tuple(root)
+
+
+def _condition(argument: str, line: int) -> str:
+    if not _CONDITION.match(argument.strip()):
+        raise TemplateError(f"line {line}: unsupported condition {argument!r}")
+    return argument.strip()
+
+
+def _innermost(root: List[Node], stack: list) -> List[Node]:
+    """Node list new nodes go to once a block is closed: the last open branch, or the root."""
+    if not stack:
+        return root
+    branches, else_body = stack[-1]
+    return else_body[0] if else_body[0] is not None else branches[-1][1]
+
+
+def render(text: str, variables: Dict[str, Any]) -> str:
+    """Render a template.
+
+    Raises:
+        TemplateError: On syntax errors and undefined variables
+    """
+    out: List[str] = []
+    _render(compile_template(text), variables, out)
+    return "".join(out)
+
+
+def _render(nodes, variables: Dict[str, Any], out: List[str]) -> None:
+    for node in nodes:
+        if node[0] == "text":
+            out.append(node[1])
+        elif node[0] == "var":
+            out.append(str(_lookup(variables, node[1])))
+        else:
+            _, branches, else_body = node
+            for condition, body in branches:
+                if _evaluate(condition, variables):
+                    _render(body, variables, out)
+                    break
+            else:
+                _render(else_body[0] or [], variables, out)
+
+
+def _lookup(variables: Dict[str, Any], name: str) -> Any:
+    if name not in variables:
+        raise TemplateError(f"undefined variable {name!r} (defined: {', '.join(sorted(variables))})")
+    return variables[name]
+
+
+def _evaluate(condition: str, variables: Dict[str, Any]) -> bool:
+    match = _CONDITION.match(condition)
+    value = _lookup(variables, match.group("name"))
+    if match.group("op") == "==":
+        result = str(value) == match.group("value")
+    elif match.group("op") == "!=":
+        result = str(value) != match.group("value")
+    else:
+        result = bool(value)
+    return not result if match.group("not") else result
+
+
+def device_variables(device: DevicesData) -> Dict[str, Any]:
+    """Variables available to templates: identifier, home_path, dotfiles_dir_path and `system` (e.g. "Linux", "Darwin").
+
+    `system` is the one recorded for `device`, left undefined while unknown.
+    """
+    variables = device.model_dump(exclude={"ssh_host", "system"})
+    if device.system is not None:
+        variables["system"] = device.system
+    return variables
+
+
+def rendered_path(alias: str, identifier: str) -> Path:
+    return Path(config.project_path).joinpath(config.rendered_dir, identifier, alias)
+
+
+def render_to_cache(template_path: Union[str, Path], alias: str, device: DevicesData) -> Path:
+    """Render `template_path` for `device` into the render cache, unless already up to date.
+
+    The output is keyed by the sha256 of the template and of its variables,
+    stored next to it: if neither changed, nothing is read beyond the
+    template nor written. The output is replaced atomically, so a deployed
+    symlink never sees a partial file.
+
+    Returns:
+        Path: The rendered file
+    """
+    text = Path(template_path).read_text()
+    variables = device_variables(device)
+    key = hashlib.sha256((text + "\0" + json.dumps(variables, sort_keys=True)).encode()).hexdigest()
+    output = rendered_path(alias, device.identifier)
+    stamp = output.with_name(f".{output.name}.sha256")
+    if output.exists() and stamp.exists() and stamp.read_text() == key:
+        logger.debug(f"{output} is up to date")
+        return output
+    atomic_write(output, render(text, variables))
+    os.chmod(output, os.stat(template_path).st_mode & 0o777)
+    atomic_write(stamp, key)
+    logger.info(f"Rendered {template_path} for {device.identifier} into {output}")
+    return output
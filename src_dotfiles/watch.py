@@ -0,0 +1,252 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+from src_dotfiles.config import get_logger
+from src_dotfiles.database import Dependencies
+
+logger = get_logger(__name__)
+
+# inotify(7) event bits
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+# Anything that can turn a deploy path into something other than our symlink
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")
+
+# Returned by a source when it lost track of events: everything must be re-checked
+EVERYTHING = None
+Changes = Optional[Set[str]]
+
+
+class InotifySource:
+    """Changed paths below a set of directories, from Linux inotify (via libc, no dependency)."""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+
+    def watch(self, directories: Iterable[str]) -> None:
+        """Watch `directories` (adding a directory twice is harmless)."""
+        for directory in directories:
+            wd = self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                logger.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._dirs[wd] = directory
+
+    def poll(self, timeout: float) -> Changes:
+        """Wait up to `timeout` seconds and return the paths that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed: Set[str] = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+                name = buf[offset + _EVENT.size: offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning("inotify queue overflowed; re-checking everything")
+                    return EVERYTHING
+                directory = self._dirs.get(wd)
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                if directory is None:
+                    continue
+                changed.add(os.path.join(directory, os.fsdecode(name)) if name else directory)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingSource:
+    """Fallback when inotify is unavailable: lstat every watched path each `timeout`."""
+    def __init__(self):
+        self.paths: Dict[str, Optional[Tuple[int, int, int]]] = {}
+
+    def track(self, paths: Iterable[str]) -> None:
+        """Set the paths to look at, remembering their current state."""
+        self.paths = {p: self.paths.get(p, _signature(p)) for p in paths}
+
+    def poll(self, timeout: float) -> Changes:
+        time.sleep(timeout)
+        changed = set()
+        for path, before in self.paths.items():
+            after = _signature(path)
+            if after != before:
+                self.paths[path] = after
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def _signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mode, st.st_mtime_ns
+
+
+class Watcher:
+    """Keep this device's deploy symlinks in place as other tools clobber them.
+
+    Watches the parent directory of every deploy path (plus the registry, to
+    pick up `add`/`register` from other runs). When a deploy path stops being
+    the right symlink, it is backed up if it holds content, then redeployed,
+    exactly as `deploy` would. The registry lock is only held while healing,
+    so other commands keep working while the watcher runs.
+    """
+    def __init__(
+        self,
+        load: Callable[[], Dependencies] = Dependencies,
+        poll: bool = False,
+        interval: float = 2.0,
+        debounce: float = 0.05,
+    ):
+        """Initialize the watcher.
+
+        Args:
+            load (Callable): Opens (and locks) the registry
+            poll (bool): Use lstat polling instead of inotify
+            interval (float): Polling period, and longest wait between checks of
+                the stop flag
+            debounce (float): Quiet time to wait for after an event, so that an
+                editor's delete+create or write+rename is handled as one change
+        """
+        self.load = load
+        self.interval = interval
+        self.debounce = debounce
+        self.source = None
+        if not poll and sys.platform.startswith("linux"):
+            try:
+                self.source = InotifySource()
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable ({e}); falling back to polling")
+        if self.source is None:
+            self.source = PollingSource()
+        self.registry_path = ""
+        self.deploy_paths: Set[str] = set()
+        # Farm deploy path -> paths of its links, which live below it rather than next to it
+        self.farms: Dict[str, Set[str]] = {}
+        self.healed = 0
+
+    def refresh(self) -> None:
+        """Reload the deploy paths from the registry and watch their directories."""
+        db = self.load()
+        try:
+            self.registry_path = os.path.abspath(db.storage.path)
+            self.deploy_paths = {os.path.abspath(d.data.deploy[d.identifier].deploy_path) for d in db.data}
+            self.farms = {}
+            for d in db.data:
+                if d.data.farm:
+                    root = os.path.abspath(d.data.deploy[d.identifier].deploy_path)
+                    self.farms[root] = {os.path.join(root, rel) for rel in d.farm_files()}
+        finally:
+            db.close()
+        links = set().union(*self.farms.values())
+        if isinstance(self.source, InotifySource):
+            parents = {os.path.dirname(p) for p in self.deploy_paths | links} | {os.path.dirname(self.registry_path)}
+            missing = sorted(d for d in parents if not os.path.isdir(d))
+            for d in missing:
+                logger.warning(f"{d} does not exist; not watched until the registry changes")
+            self.source.watch(sorted(parents - set(missing)))
+        else:
+            self.source.track(sorted(self.deploy_paths | links | {self.registry_path}))
+        logger.info(f"watch: {len(self.deploy_paths)} deploy path(s) with {type(self.source).__name__}")
+
+    def heal(self, paths: Changes = EVERYTHING) -> int:
+        """Redeploy the managed paths among `paths` that are no longer correct.
+
+        Args:
+            paths (Optional[Set[str]]): Changed paths, or None to check them all
+
+        Returns:
+            int: Number of dotfiles redeployed
+        """
+        db = self.load()
+        healed = 0
+        try:
+            if paths is EVERYTHING:
+                dot_files = db.data
+            else:
+                dot_files = [d for d in map(db.select_by_deploy_path, sorted(paths)) if d is not None]
+            for dot_file in dot_files:
+                try:
+                    action = dot_file.plan()
+                    if action.kind == "noop":
+                        continue
+                    if action.kind == "sudo":
+                        logger.warning(f"watch: {action.deploy_path} needs root; run `deploy` by hand")
+                        continue
+                    logger.info(f"watch: {action.deploy_path} drifted ({action.kind}); healing")
+                    if action.backup:
+                        dot_file.backup(action.conflicts or None)
+                    dot_file.apply(action)
+                    healed += 1
+                except Exception as e:
+                    logger.error(f"watch: failed to heal {dot_file.data.alias}: {e}")
+            if healed:
+                db.save_all()
+        finally:
+            db.close()
+        self.healed += healed
+        return healed
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """Heal once, then react to changes until `stop` is set (or forever)."""
+        stop = stop or threading.Event()
+        self.refresh()
+        self.heal()
+        try:
+            while not stop.is_set():
+                changed = self.source.poll(self.interval)
+                if changed is not EVERYTHING and not changed:
+                    continue
+                # Let bursts settle: one heal per editor save, not per syscall
+                while changed is not EVERYTHING:
+                    more = self.source.poll(self.debounce)
+                    if more is EVERYTHING:
+                        changed = EVERYTHING
+                    elif more:
+                        changed |= more
+                        continue
+                    break
+                if changed is EVERYTHING or self.registry_path in changed:
+                    self.refresh()
+                    self.heal()
+                    continue
+                # A change to one link of a farm re-plans the whole farm
+                changed |= {root for root, links in self.farms.items() if changed & links}
+                if changed & self.deploy_paths:
+                    self.heal(changed & self.deploy_paths)
+        finally:
+            self.source.close()
@@ -0,0 +1 @@
+keymaps
\ No newline at end of file
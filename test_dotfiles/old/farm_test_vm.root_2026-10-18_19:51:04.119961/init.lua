@@ -0,0 +1 @@
+edited in place
\ No newline at end of file
@@ -3,11 +3,12 @@ from src_dotfiles.config import set_config, config
 from pathlib import Path
 import shutil
 import os
+import stat
 import time
 from ezpy_logs.LoggerFactory import LoggerFactory
 from src_dotfiles.__main__ import ManageDotfiles
 from src_dotfiles.database import Dependencies
-from src_dotfiles.models import DevicesData, DotFileModel, DeployedDotFile, MetaDataDotFiles
+from src_dotfiles.models import DevicesData, DotFileModel, DeployedDotFile, MetaDataDotFiles, BackupMetadata
 from src_dotfiles.DotFile import get_time, DATETIME_FORMAT, DotFile
 from datetime import datetime
 
@@ -206,6 +207,50 @@ def test_deploy_escalates_to_sudo_on_permission_error(setup_test_environment, mo
     assert calls[0][:3] == ["sudo", "ln", "-sfn"]
     assert calls[0][-1] == deploy_path
 
+@pytest.mark.run(order=8)
+def test_deploy_all_batches_privileged_links(setup_test_environment, monkeypatch):
+    """Every entry needing root goes through one elevated helper call, with per-entry results."""
+    import sys
+    from src_dotfiles import DotFile as dotfile_mod
+    from src_dotfiles import privileged
+
+    manager = ManageDotfiles()
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+    monkeypatch.setattr(dotfile_mod, "_parent_writable", lambda path: False)
+    monkeypatch.setattr(dotfile_mod.DotFile, "_deploy_via_sudo",
+                        lambda self, *a: pytest.fail("per-entry sudo must not run in deploy-all"))
+    calls = []
+    real_run = privileged.run
+    def run_without_sudo(requests, cwd, command=None):
+        calls.append(requests)
+        return real_run(requests, cwd, [sys.executable, "-m", "src_dotfiles.privileged"])
+    monkeypatch.setattr(privileged, "run", run_without_sudo)
+
+    results = manager._deploy_all(manager.db.data, jobs=4, actions=manager._plan_all(manager.db.data))
+
+    assert len(calls) == 1 and len(calls[0]) == len(manager.db.data)
+    assert {outcome for _, outcome, _ in results} == {"created"}
+    for dotfile in manager.db.data:
+        assert os.readlink(dotfile.data.deploy[dotfile.identifier].deploy_path) == dotfile.source_path()
+
+@pytest.mark.run(order=8)
+def test_privileged_helper_reports_per_entry_results(tmp_path):
+    """The helper links what it can and reports the rest, in request order."""
+    from src_dotfiles.privileged import apply_all
+
+    (tmp_path / "real_dir").mkdir()
+    (tmp_path / "old").write_text("old")
+    results = apply_all([
+        {"deploy_path": str(tmp_path / "old"), "target": "/etc/hostname"},
+        {"deploy_path": str(tmp_path / "real_dir"), "target": "/etc/hostname"},
+        {"deploy_path": str(tmp_path / "missing_parent" / "x"), "target": "/etc/hostname"},
+    ])
+    assert [r["ok"] for r in results] == [True, False, False]
+    assert os.readlink(tmp_path / "old") == "/etc/hostname"
+    assert "refusing" in results[1]["error"]
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+
 @pytest.mark.run(order=8)
 def test_deploy_all_continues_past_one_failure(setup_test_environment, monkeypatch):
     """All-mode loop must report failures and keep going, not abort the run."""
@@ -214,14 +259,16 @@ def test_deploy_all_continues_past_one_failure(setup_test_environment, monkeypat
     manager = ManageDotfiles()
     assert len(manager.db.data) >= 2
 
-    # Sabotage exactly one dotfile's deploy.
+    # Sabotage exactly one dotfile's apply phase, and make sure every entry has work to do.
     victim_alias = manager.db.data[0].data.alias
-    original_deploy = dotfile_mod.DotFile.deploy
-    def maybe_boom(self):
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+    original_apply = dotfile_mod.DotFile.apply
+    def maybe_boom(self, action, escalate=True):
         if self.data.alias == victim_alias:
             raise RuntimeError("simulated failure")
-        return original_deploy(self)
-    monkeypatch.setattr(dotfile_mod.DotFile, "deploy", maybe_boom)
+        return original_apply(self, action, escalate)
+    monkeypatch.setattr(dotfile_mod.DotFile, "apply", maybe_boom)
 
     # Should not raise — failures are caught and summarized.
     manager.deploy()
@@ -230,6 +277,446 @@ def test_deploy_all_continues_past_one_failure(setup_test_environment, monkeypat
     survivor = manager.db.data[1]
     assert os.path.lexists(survivor.data.deploy[survivor.identifier].deploy_path)
 
+@pytest.mark.run(order=7)
+def test_transactional_deploy_rolls_back_on_failure(setup_test_environment, monkeypatch):
+    """One failing entry puts every deploy path back as it was before the run."""
+    from src_dotfiles import DotFile as dotfile_mod
+
+    manager = ManageDotfiles()
+    first, victim = manager.db.data[0], manager.db.data[-1]
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+    first_path = Path(first.data.deploy[first.identifier].deploy_path)
+    first_path.write_text("machine-local edits\n")
+
+    original_apply = dotfile_mod.DotFile.apply
+    def maybe_boom(self, action, escalate=True):
+        if self is victim:
+            raise OSError(28, "No space left on device")
+        return original_apply(self, action, escalate)
+    monkeypatch.setattr(dotfile_mod.DotFile, "apply", maybe_boom)
+
+    manager.deploy(transactional=True)
+
+    assert not first_path.is_symlink() and first_path.read_text() == "machine-local edits\n"
+    assert not os.path.lexists(victim.data.deploy[victim.identifier].deploy_path)
+    assert not Path(config.project_path).joinpath(config.dotfiles_dir, ".deploy_journal.jsonl").exists()
+    # The backup the content was restored from stays referenced
+    assert ManageDotfiles().db.select_by_alias(first.data.alias).data.deploy[first.identifier].backups
+
+@pytest.mark.run(order=7)
+def test_crashed_transactional_deploy_is_reverted_next_run(setup_test_environment, monkeypatch):
+    """A journal left by a crash is rolled back by the next deploy before anything else."""
+    from src_dotfiles import DotFile as dotfile_mod
+
+    manager = ManageDotfiles()
+    target, last = manager.db.data[0], manager.db.data[-1]
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+    target_path = Path(target.data.deploy[target.identifier].deploy_path)
+    target_path.write_text("before the crash\n")
+
+    original_apply = dotfile_mod.DotFile.apply
+    def crash(self, action, escalate=True):
+        if self is last:
+            raise SystemExit("power cut")
+        return original_apply(self, action, escalate)
+    monkeypatch.setattr(dotfile_mod.DotFile, "apply", crash)
+    # Simulate a crash: skip the in-process rollback so the journal stays on disk
+    monkeypatch.setattr(ManageDotfiles, "_rollback", lambda self, journal: None)
+    with pytest.raises(SystemExit):
+        manager.deploy(transactional=True)
+    journal = Path(config.project_path).joinpath(config.dotfiles_dir, ".deploy_journal.jsonl")
+    assert journal.exists() and target_path.is_symlink()
+    monkeypatch.undo()
+
+    fresh = ManageDotfiles()
+    fresh.deploy(alias=last.data.alias)
+
+    assert not journal.exists()
+    assert not target_path.is_symlink() and target_path.read_text() == "before the crash\n"
+    assert fresh.db.select_by_alias(target.data.alias).data.deploy[target.identifier].backups
+
+@pytest.mark.run(order=7)
+def test_unrevertable_journal_is_reported_and_discardable(setup_test_environment, monkeypatch):
+    """A rollback that keeps failing stops deploy cleanly; --discard-journal gets past it."""
+    from src_dotfiles import DotFile as dotfile_mod
+    from src_dotfiles import journal as journal_mod
+
+    manager = ManageDotfiles()
+    last = manager.db.data[-1]
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+    original_apply = dotfile_mod.DotFile.apply
+    def crash(self, action, escalate=True):
+        if self is last:
+            raise SystemExit("power cut")
+        return original_apply(self, action, escalate)
+    monkeypatch.setattr(dotfile_mod.DotFile, "apply", crash)
+    monkeypatch.setattr(ManageDotfiles, "_rollback", lambda self, journal: True)
+    with pytest.raises(SystemExit):
+        manager.deploy(transactional=True)
+    monkeypatch.undo()
+    journal = Path(config.project_path).joinpath(config.dotfiles_dir, ".deploy_journal.jsonl")
+    assert journal.exists()
+
+    # e.g. a root-owned link the user cannot remove
+    def denied(record):
+        raise PermissionError(13, "Permission denied")
+    monkeypatch.setattr(journal_mod, "_revert", denied)
+    fresh = ManageDotfiles()
+    fresh.deploy(transactional=True)  # handled: no RuntimeError from journal.begin()
+    assert journal.exists()
+    assert not any(Path(d.data.deploy[d.identifier].deploy_path).is_symlink() for d in fresh.db.data[1:])
+
+    fresh.deploy(transactional=True, discard_journal=True)
+    assert not journal.exists()
+    assert all(Path(d.data.deploy[d.identifier].deploy_path).is_symlink() for d in fresh.db.data)
+
+@pytest.mark.run(order=8)
+def test_deploy_all_parallel_jobs(setup_test_environment):
+    """--jobs N deploys every dotfile and keeps the summary in registry order."""
+    manager = ManageDotfiles()
+    for dotfile in manager.db.data:
+        remove_file_if_exists(Path(dotfile.data.deploy[dotfile.identifier].deploy_path))
+
+    results = manager._deploy_all(manager.db.data, jobs=4)
+
+    assert [a for a, _, _ in results] == [d.data.alias for d in manager.db.data]
+    assert all(outcome == "created" for _, outcome, _ in results)
+    for dotfile in manager.db.data:
+        assert Path(dotfile.data.deploy[dotfile.identifier].deploy_path).is_symlink()
+
+@pytest.mark.run(order=8)
+def test_independent_groups_keeps_nested_paths_together(setup_test_environment):
+    """Nested deploy paths must share a worker; unrelated ones may not."""
+    from src_dotfiles.__main__ import _independent_groups
+
+    def make(alias, path):
+        model = DotFileModel(alias=alias, main=f"test_dotfiles/{alias}",
+                             deploy={config.identifier: DeployedDotFile(deploy_path=path)})
+        return DotFile(model, config.identifier)
+
+    parent = make("nvim", "/tmp/home/.config/nvim")
+    child = make("nvim_init", "/tmp/home/.config/nvim/init.lua")
+    other = make("zshrc", "/tmp/home/.zshrc")
+    sibling = make("nvim2", "/tmp/home/.config/nvim2")
+
+    groups = _independent_groups([parent, other, child, sibling])
+    aliases = [[d.data.alias for d in g] for g in groups]
+    assert aliases == [["nvim", "nvim_init"], ["zshrc"], ["nvim2"]]
+
+    # Two siblings first, then their parent: all three must end up together
+    a_x = make("a_x", "/tmp/home/a/x")
+    a_y = make("a_y", "/tmp/home/a/y")
+    a = make("a", "/tmp/home/a")
+    groups = _independent_groups([a_x, other, a_y, a])
+    aliases = [[d.data.alias for d in g] for g in groups]
+    assert aliases == [["a_x", "a_y", "a"], ["zshrc"]]
+
+@pytest.mark.run(order=8)
+def test_plan_classifies_deploy_paths(setup_test_environment, tmp_path):
+    """plan() classifies the target with a single stat and changes nothing."""
+    main_path = Path(config.project_path) / "test_dotfiles" / "plan_test"
+    main_path.write_text("plan main")
+    deploy_path = tmp_path / "plan_test"
+    model = DotFileModel(alias="plan_test", main="test_dotfiles/plan_test",
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_path))})
+    dotfile = DotFile(model, config.identifier)
+
+    assert dotfile.plan().kind == "create"
+
+    deploy_path.write_text("local edits")
+    action = dotfile.plan()
+    assert (action.kind, action.backup) == ("replace_file", True)
+    assert deploy_path.read_text() == "local edits"
+
+    deploy_path.unlink()
+    deploy_path.mkdir()
+    assert dotfile.plan().kind == "replace_dir"
+
+    deploy_path.rmdir()
+    deploy_path.symlink_to("/nonexistent/elsewhere")
+    action = dotfile.plan()
+    assert (action.kind, action.backup, action.current) == ("replace_file", False, "/nonexistent/elsewhere")
+
+    assert dotfile.apply(action) is True
+    assert dotfile.plan().kind == "noop"
+    remove_file_if_exists(main_path)
+
+@pytest.mark.run(order=8)
+def test_status_classifies_drift_with_stat_cache(setup_test_environment, tmp_path):
+    """status checks are read-only and reuse cached classifications of unchanged paths."""
+    from src_dotfiles import status as drift
+
+    project = Path(config.project_path)
+    (project / "test_dotfiles" / "status_test").write_text("main")
+    (project / "test_dotfiles" / "status_test.other").write_text("other device")
+    deploy_path = tmp_path / "status_test"
+    model = DotFileModel(alias="status_test", main="test_dotfiles/status_test",
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_path))},
+                         variants={"other.device": "test_dotfiles/status_test.other"})
+    dotfile = DotFile(model, config.identifier)
+    cache = drift.StatusCache(tmp_path / "cache.json")
+
+    assert drift.check(dotfile, cache)[0] == drift.MISSING
+    deploy_path.write_text("local")
+    assert drift.check(dotfile, cache)[0] == drift.SHADOWED
+    assert deploy_path.read_text() == "local"
+    deploy_path.unlink()
+    deploy_path.symlink_to(project / "test_dotfiles" / "status_test.other")
+    assert drift.check(dotfile, cache)[0] == drift.VARIANT_MISMATCH
+    deploy_path.unlink()
+    (tmp_path / "elsewhere").write_text("unrelated")
+    deploy_path.symlink_to(tmp_path / "elsewhere")
+    assert drift.check(dotfile, cache)[0] == drift.WRONG_TARGET
+    deploy_path.unlink()
+    deploy_path.symlink_to(dotfile.source_path())
+    assert drift.check(dotfile, cache) == (drift.OK, dotfile.source_path())
+    cache.save()
+
+    # A fresh cache from disk answers without a readlink...
+    cache = drift.StatusCache(tmp_path / "cache.json")
+    assert drift.check(dotfile, cache)[0] == drift.OK and cache.hits == 1
+    # ...but still notices the target disappearing and coming back
+    source = project / "test_dotfiles" / "status_test"
+    source.rename(tmp_path / "moved")
+    assert drift.check(dotfile, cache)[0] == drift.DANGLING
+    (tmp_path / "moved").rename(source)
+    assert drift.check(dotfile, cache)[0] == drift.OK
+    remove_file_if_exists(source)
+    remove_file_if_exists(project / "test_dotfiles" / "status_test.other")
+
+@pytest.mark.run(order=8)
+def test_status_command_never_saves(setup_test_environment, capsys):
+    """`status` prints one line per managed dotfile and leaves the registry untouched."""
+    manager = ManageDotfiles()
+    db_path = manager.db.get_db_path()
+    mtime_before = db_path.stat().st_mtime_ns
+    manager.status()
+    manager.status()
+
+    lines = [l for l in capsys.readouterr().out.splitlines() if l.split(" ", 1)[0] in ("ok", "missing", "shadowed", "dangling", "wrong_target", "variant_mismatch", "error")]
+    assert len(lines) == 2 * len(manager.db.data)
+    assert db_path.stat().st_mtime_ns == mtime_before
+    assert Path(config.project_path, config.dotfiles_dir, ".status_cache.json").exists()
+
+@pytest.mark.run(order=8)
+@pytest.mark.parametrize("poll", [False, True])
+def test_watch_heals_clobbered_symlink(setup_test_environment, poll):
+    """The watcher backs up a file that replaced a deploy symlink and redeploys it."""
+    import threading
+    from src_dotfiles.watch import Watcher
+
+    manager = ManageDotfiles()
+    manager.deploy()
+    dotfile = manager.db.select_by_alias("test_dotfile_a")
+    deploy_path = Path(dotfile.data.deploy[dotfile.identifier].deploy_path)
+    backups_before = len(dotfile.data.deploy[dotfile.identifier].backups)
+    manager.db.close()
+
+    watcher = Watcher(poll=poll, interval=0.05, debounce=0.02)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        time.sleep(0.3)
+        clobber = deploy_path.with_name(deploy_path.name + ".new")
+        clobber.write_text("written by some installer")
+        os.replace(clobber, deploy_path)
+        deadline = time.monotonic() + 5
+        while not deploy_path.is_symlink() and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert deploy_path.is_symlink()
+    assert watcher.healed == 1
+    dotfile = ManageDotfiles().db.select_by_alias("test_dotfile_a")
+    backups = dotfile.data.deploy[dotfile.identifier].backups
+    assert len(backups) == backups_before + 1
+    assert Path(backups[-1].backup_path).read_text() == "written by some installer"
+
+@pytest.mark.run(order=8)
+def test_watch_does_not_load_the_registry(setup_test_environment, monkeypatch):
+    """watch leaves the registry unloaded (and unlocked) until a path needs healing."""
+    from src_dotfiles import watch
+
+    def interrupted(self):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(watch.Watcher, "run", interrupted)
+    manager = ManageDotfiles()
+    manager.watch(poll=True)
+    assert manager._db is None
+
+@pytest.mark.run(order=8)
+def test_farm_deploy_reconciles_per_file_links(setup_test_environment, tmp_path):
+    """A farm deploy links each file, keeps local files, drops stale links and backs up only conflicts."""
+    from src_dotfiles.status import check
+
+    source = Path(config.project_path) / "test_dotfiles" / "farm_test"
+    (source / "lua").mkdir(parents=True)
+    (source / "init.lua").write_text("init")
+    (source / "lua" / "keymaps.lua").write_text("keymaps")
+    (source / "lua" / "old.lua").write_text("old")
+    deploy_dir = tmp_path / "nvim"
+    deploy_dir.symlink_to(source)  # deployed the plain way before switching to farm
+    model = DotFileModel(alias="farm_test", main="test_dotfiles/farm_test", farm=True,
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_dir))})
+    dotfile = DotFile(model, config.identifier)
+
+    action = dotfile.plan()
+    assert (action.kind, action.current, action.backup) == ("farm", str(source), False)
+    assert dotfile.apply(action) is True
+    assert deploy_dir.is_dir() and not deploy_dir.is_symlink()
+    assert os.readlink(deploy_dir / "lua" / "keymaps.lua") == str(source / "lua" / "keymaps.lua")
+    assert dotfile.plan().kind == "noop"
+    assert check(dotfile)[0] == "ok"
+
+    (deploy_dir / "lua" / "local.lua").write_text("machine-local")
+    (source / "lua" / "old.lua").unlink()
+    (deploy_dir / "init.lua").unlink()
+    (deploy_dir / "init.lua").write_text("edited in place")
+    action = dotfile.plan()
+    assert (action.links, action.stale, action.conflicts) == (["init.lua"], ["lua/old.lua"], ["init.lua"])
+    assert check(dotfile)[0] == "shadowed"
+
+    dotfile.backup(action.conflicts)
+    dotfile.apply(action)
+    backup = model.deploy[config.identifier].backups[-1]
+    assert list(backup.manifest) == ["init.lua"]
+    assert (Path(backup.backup_path) / "init.lua").read_text() == "edited in place"
+    assert (deploy_dir / "init.lua").is_symlink()
+    assert not os.path.lexists(deploy_dir / "lua" / "old.lua")
+    assert (deploy_dir / "lua" / "local.lua").read_text() == "machine-local"
+    assert dotfile.plan().kind == "noop"
+    shutil.rmtree(source)
+
+@pytest.mark.run(order=8)
+def test_deploy_all_noop_skips_save(setup_test_environment):
+    """When every symlink is already correct, deploy exits before rewriting the registry."""
+    manager = ManageDotfiles()
+    manager.deploy()
+    db_path = manager.db.get_db_path()
+    mtime_before = db_path.stat().st_mtime_ns
+
+    time.sleep(0.01)
+    ManageDotfiles().deploy()
+
+    assert db_path.stat().st_mtime_ns == mtime_before
+
+@pytest.mark.run(order=8)
+def test_save_all_skips_unchanged_registry(setup_test_environment):
+    """save_all() only rewrites dotfiles.json when the serialized registry changed."""
+    manager = ManageDotfiles()
+    manager.db.save_all()
+    db_path = manager.db.get_db_path()
+    mtime_before = db_path.stat().st_mtime_ns
+
+    assert manager.db.save_all() is False
+    assert ManageDotfiles().db.save_all() is False
+    assert db_path.stat().st_mtime_ns == mtime_before
+
+    manager.db.metadata.devices["dirty_device"] = DevicesData(
+        identifier="dirty_device", home_path="/home/dirty", dotfiles_dir_path="test_dotfiles")
+    assert manager.db.save_all() is True
+    del manager.db.metadata.devices["dirty_device"]
+    assert manager.db.save_all() is True
+
+@pytest.mark.run(order=8)
+def test_save_all_is_atomic(setup_test_environment, monkeypatch):
+    """A crash between write and rename leaves the previous registry intact and no temp file."""
+    from src_dotfiles import fsutils
+
+    manager = ManageDotfiles()
+    db_path = manager.db.get_db_path()
+    before = db_path.read_text()
+
+    def crash(src, dst):
+        raise OSError("simulated crash before rename")
+    monkeypatch.setattr(fsutils.os, "replace", crash)
+    manager.db.metadata.devices["crash_device"] = DevicesData(
+        identifier="crash_device", home_path="/home/crash", dotfiles_dir_path="test_dotfiles")
+    with pytest.raises(OSError):
+        manager.db.save_all()
+    monkeypatch.undo()
+
+    assert db_path.read_text() == before
+    assert MetaDataDotFiles.model_validate_json(db_path.read_text())
+    assert not list(db_path.parent.glob(f".{db_path.name}.*.tmp"))
+    del manager.db.metadata.devices["crash_device"]
+
+@pytest.mark.run(order=8)
+def test_registry_lock_blocks_other_processes(setup_test_environment):
+    """While a Dependencies instance is alive, another process cannot take the registry lock."""
+    import subprocess
+    import sys
+
+    manager = ManageDotfiles()
+    lock_path = manager.db.lock.path
+    probe = (
+        "import fcntl, os, sys\n"
+        f"fd = os.open({str(lock_path)!r}, os.O_RDWR)\n"
+        "try:\n"
+        "    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+        "except BlockingIOError:\n"
+        "    sys.exit(3)\n"
+    )
+    assert subprocess.run([sys.executable, "-c", probe]).returncode == 3
+
+    # Reentrant in-process: a second manager does not deadlock.
+    ManageDotfiles().db.close()
+    assert subprocess.run([sys.executable, "-c", probe]).returncode == 3
+
+@pytest.mark.run(order=8)
+def test_read_only_commands_do_not_wait_for_the_lock(setup_test_environment):
+    """status/plan in another process run while this one holds the registry lock."""
+    import subprocess
+    import sys
+
+    manager = ManageDotfiles()
+    assert manager.db.lock._acquired
+    script = (
+        "from src_dotfiles.config import set_config\n"
+        "set_config(dotfiles_dir='test_dotfiles')\n"
+        "from src_dotfiles.__main__ import ManageDotfiles\n"
+        "manager = ManageDotfiles()\n"
+        "manager.status()\n"
+        "manager.plan()\n"
+        "assert manager.db.read_only and not manager.db.lock._acquired\n"
+        "try:\n"
+        "    manager.db.save_all()\n"
+        "except RuntimeError:\n"
+        "    print('refused')\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert "refused" in result.stdout
+
+@pytest.mark.run(order=8)
+def test_cli_import_is_lazy():
+    """Importing the CLI loads neither fire, pydantic nor the registry, and touches no config or logging."""
+    import subprocess
+    import sys
+
+    probe = (
+        "import sys\n"
+        "import src_dotfiles.__main__\n"
+        "from src_dotfiles import config\n"
+        "heavy = [m for m in ('fire', 'pydantic', 'src_dotfiles.models', 'src_dotfiles.database',"
+        " 'src_dotfiles.DotFile') if m in sys.modules]\n"
+        "assert not heavy, heavy\n"
+        "assert not config._configured\n"
+        "import logging\n"
+        "assert not logging.getLogger().handlers, 'logging was set up at import'\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", probe],
+        capture_output=True, text=True, cwd=Path(__file__).parent.parent,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
 # -------------------------------- Backup tests ------------------------------- #
 
 @pytest.mark.run(order=9)
@@ -327,6 +814,236 @@ def test_backup_metadata_is_correct(setup_test_environment):
     assert Path(backup.backup_path).read_text() == test_content
     assert datetime.strptime(t_0, DATETIME_FORMAT) <= datetime.strptime(backup.datetime, DATETIME_FORMAT) <= datetime.strptime(t_1, DATETIME_FORMAT)
 
+@pytest.mark.run(order=12)
+def test_backup_deduplicates_identical_content(setup_test_environment):
+    """Two backups of identical content share one blob (same inode)."""
+    dotfile_path = Path(f"{setup_test_environment['TEST_DATA_TMP'].as_posix()}/test_dotfile_c")
+    manager = ManageDotfiles()
+    for _ in range(2):
+        remove_file_if_exists(dotfile_path)
+        dotfile_path.write_text("same content twice")
+        manager.deploy("c_dotfile")
+
+    dotfile = manager.db.select_by_alias("c_dotfile")
+    first, second = dotfile.data.deploy[dotfile.identifier].backups[-2:]
+    assert first.manifest == second.manifest
+    assert first.backup_path != second.backup_path
+    assert Path(first.backup_path).stat().st_ino == Path(second.backup_path).stat().st_ino
+    assert Path(second.backup_path).read_text() == "same content twice"
+
+@pytest.mark.run(order=12)
+def test_backup_directory_snapshot_restores(setup_test_environment, tmp_path):
+    """A directory backup records a per-file manifest and can be materialized again."""
+    deploy_dir = tmp_path / "config_dir"
+    (deploy_dir / "lua").mkdir(parents=True)
+    (deploy_dir / "init.lua").write_text("init")
+    (deploy_dir / "lua" / "keymaps.lua").write_text("keymaps")
+    model = DotFileModel(alias="dir_backup", main="test_dotfiles/dir_backup",
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_dir))})
+    dotfile = DotFile(model, config.identifier)
+
+    dotfile.backup()
+    backup = model.deploy[config.identifier].backups[-1]
+    assert sorted(backup.manifest) == ["init.lua", "lua/keymaps.lua"]
+    assert (Path(backup.backup_path) / "lua" / "keymaps.lua").read_text() == "keymaps"
+
+    restored = tmp_path / "restored"
+    dotfile.restore_backup(backup, str(restored))
+    assert (restored / "init.lua").read_text() == "init"
+    (restored / "init.lua").write_text("editable")  # restored files are independent copies
+    assert (Path(backup.backup_path) / "init.lua").read_text() == "init"
+
+@pytest.mark.run(order=12)
+def test_backup_restore_keeps_exec_bit(setup_test_environment, tmp_path):
+    """Blobs are read-only and shared, but restored files get their recorded modes back."""
+    deploy_dir = tmp_path / "bin_dir"
+    deploy_dir.mkdir()
+    (deploy_dir / "tool").write_text("#!/bin/sh\necho tool\n")
+    os.chmod(deploy_dir / "tool", 0o755)
+    (deploy_dir / "notes").write_text("notes")
+    os.chmod(deploy_dir / "notes", 0o600)
+    model = DotFileModel(alias="bin_backup", main="test_dotfiles/bin_backup",
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_dir))})
+    dotfile = DotFile(model, config.identifier)
+
+    dotfile.backup()
+    backup = model.deploy[config.identifier].backups[-1]
+    assert backup.modes == {"notes": 0o600, "tool": 0o755}
+
+    restored = tmp_path / "restored"
+    dotfile.restore_backup(backup, str(restored))
+    assert stat.S_IMODE((restored / "tool").stat().st_mode) == 0o755
+    assert stat.S_IMODE((restored / "notes").stat().st_mode) == 0o600
+
+@pytest.mark.run(order=12)
+def test_select_backups_retention_policy(setup_test_environment):
+    """keep_last, daily and weekly thinning, and the size budget all apply."""
+    from src_dotfiles.models import BackupMetadata
+    from src_dotfiles.retention import fit_budget, select_backups
+
+    stamps = [
+        "2021-06-14_08:38",            # legacy minute-precision format
+        "2026-01-05_10:00:00.000000",
+        "2026-01-12_10:00:00.000000",
+        "2026-01-13_09:00:00.000000",
+        "2026-01-13_18:00:00.000000",
+        "not a date",
+    ]
+    backups = [BackupMetadata(backup_path=f"/b/{i}", datetime=t) for i, t in enumerate(stamps)]
+
+    kept = select_backups(backups, keep_last=1, keep_daily=0, keep_weekly=0)
+    assert [b.backup_path for b in kept] == ["/b/4", "/b/5"]
+
+    kept = select_backups(backups, keep_last=0, keep_daily=2, keep_weekly=0)
+    assert [b.backup_path for b in kept] == ["/b/2", "/b/4", "/b/5"]
+
+    kept = select_backups(backups, keep_last=0, keep_daily=0, keep_weekly=2)
+    assert [b.backup_path for b in kept] == ["/b/1", "/b/4", "/b/5"]
+
+    # The undated backup is never pruned, but uses 10 of the 35 bytes
+    kept = select_backups(backups, keep_last=10, keep_daily=0, keep_weekly=0,
+                          max_bytes=35, size_of=lambda b: 10)
+    assert [b.backup_path for b in kept] == ["/b/3", "/b/4", "/b/5"]
+
+    # One budget across histories: the oldest go first, whichever dotfile they belong to
+    other = [BackupMetadata(backup_path=f"/o/{i}", datetime=t) for i, t in enumerate(stamps[2:5])]
+    kept = fit_budget([backups[1:5], other], max_bytes=40, size_of=lambda b: 10)
+    assert [[b.backup_path for b in h] for h in kept] == [["/b/3", "/b/4"], ["/o/1", "/o/2"]]
+
+@pytest.mark.run(order=12)
+def test_gc_prunes_metadata_files_and_blobs(setup_test_environment):
+    """gc trims the history, deletes pruned backup files and unreferenced blobs."""
+    from src_dotfiles.DotFile import backup_store
+
+    dotfile_path = Path(f"{setup_test_environment['TEST_DATA_TMP'].as_posix()}/test_dotfile_c")
+    manager = ManageDotfiles()
+    for content in ("gc version 1", "gc version 2"):
+        remove_file_if_exists(dotfile_path)
+        dotfile_path.write_text(content)
+        manager.deploy("c_dotfile")
+    backups = manager.db.select_by_alias("c_dotfile").data.deploy[config.identifier].backups
+    doomed = backups[:-1]
+    doomed_blob = backup_store().blob_path(backups[-2].manifest["."])
+    assert len(doomed) > 0 and doomed_blob.exists()
+    # A blob this device never referenced, e.g. from another device's (unsynced) history
+    foreign = dotfile_path.parent / "foreign_blob"
+    foreign.write_text("only another device knows this")
+    foreign_blob = backup_store().blob_path(backup_store().put(foreign))
+
+    manager = ManageDotfiles()
+    manager.gc(keep_last=1, keep_daily=0, keep_weekly=0)
+
+    backups = ManageDotfiles().db.select_by_alias("c_dotfile").data.deploy[config.identifier].backups
+    assert len(backups) == 1
+    assert Path(backups[0].backup_path).read_text() == "gc version 2"
+    assert not any(Path(b.backup_path).exists() for b in doomed)
+    assert not doomed_blob.exists()
+    assert foreign_blob.exists()
+
+@pytest.mark.run(order=12)
+def test_restore_falls_back_to_backup_copy_without_blob(setup_test_environment, tmp_path):
+    """A backup whose blob was pruned elsewhere is restored from its browsable copy."""
+    from src_dotfiles.DotFile import backup_store, restore_backup
+
+    source = tmp_path / "fallback_src"
+    source.write_text("kept in old/ only")
+    manifest = backup_store().snapshot(source, tmp_path / "fallback_copy")
+    blob = backup_store().blob_path(manifest["."])
+    blob.chmod(0o644)
+    blob.unlink()
+    backup = BackupMetadata(backup_path=(tmp_path / "fallback_copy").as_posix(),
+                            datetime="2024-01-01_00:00:00.000000", manifest=manifest)
+    restore_backup(backup, (tmp_path / "restored").as_posix())
+    assert (tmp_path / "restored").read_text() == "kept in old/ only"
+
+@pytest.mark.run(order=12)
+def test_capture_diffs_and_promotes_in_place_edits(setup_test_environment, tmp_path, capsys):
+    """capture spots a deployed copy edited in place, diffs it and folds it back into main."""
+    from src_dotfiles import capture as cap
+
+    main_path = Path(config.project_path) / "test_dotfiles" / "capture_test"
+    main_path.write_text("alpha\nbeta\n")
+    deploy_path = (tmp_path / "capture_test").absolute()
+    manager = ManageDotfiles()
+    assert manager.register("capture_test", str(deploy_path), main="test_dotfiles/capture_test") == "capture_test"
+    dotfile = manager.db.select_by_alias("capture_test")
+    assert cap.compare(dotfile)[0] == cap.LINKED
+
+    deploy_path.unlink()
+    shutil.copyfile(main_path, deploy_path)
+    assert cap.compare(dotfile)[:2] == (cap.IDENTICAL, "test_dotfiles/capture_test")
+
+    deploy_path.write_text("alpha\nbeta, edited in place\n")
+    assert cap.compare(dotfile)[0] == cap.DIVERGENT
+    manager.capture(alias="capture_test")
+    out = capsys.readouterr().out
+    assert "-beta\n" in out and "+beta, edited in place\n" in out
+    assert main_path.read_text() == "alpha\nbeta\n"  # only shown, nothing changed
+
+    manager.capture(alias="capture_test", promote=True)
+    assert main_path.read_text() == "alpha\nbeta, edited in place\n"
+    assert deploy_path.is_symlink()
+    backups = ManageDotfiles().db.select_by_alias("capture_test").data.deploy[config.identifier].backups
+    assert Path(backups[-1].backup_path).read_text() == "alpha\nbeta, edited in place\n"
+
+@pytest.mark.run(order=12)
+def test_capture_three_way_merge_and_directory_diff(setup_test_environment, tmp_path):
+    """Edits on both sides since the last backup merge cleanly; directories diff per file."""
+    from src_dotfiles import capture as cap
+
+    main_path = Path(config.project_path) / "test_dotfiles" / "merge_test"
+    deploy_path = tmp_path / "merge_test"
+    deploy_path.write_text("one\ntwo\nthree\nfour\nfive\n")
+    model = DotFileModel(alias="merge_test", main="test_dotfiles/merge_test",
+                         deploy={config.identifier: DeployedDotFile(deploy_path=str(deploy_path))})
+    dotfile = DotFile(model, config.identifier)
+    dotfile.backup()  # base: what was deployed last time
+    main_path.write_text("ONE\ntwo\nthree\nfour\nfive\n")        # changed upstream
+    deploy_path.write_text("one\ntwo\nthree\nfour\nFIVE\n")      # changed locally
+
+    merged, conflicts = cap.three_way_merge(dotfile)
+    assert (merged, conflicts) == ("ONE\ntwo\nthree\nfour\nFIVE\n", 0)
+    remove_file_if_exists(main_path)
+
+    source, deployed = tmp_path / "src_dir", tmp_path / "deployed_dir"
+    for d in (source, deployed):
+        (d / "sub").mkdir(parents=True)
+        (d / "same").write_text("same")
+    (source / "sub" / "conf").write_text("a = 1\n")
+    (deployed / "sub" / "conf").write_text("a = 2\n")
+    (deployed / "new").write_text("added\n")
+    diff = "".join(cap.unified_diff(str(source), str(deployed)))
+    assert "-a = 1\n+a = 2\n" in diff
+    assert "--- /dev/null" in diff and "+added\n" in diff
+    assert "same" not in diff
+
+@pytest.mark.run(order=12)
+def test_capture_merge_failures_are_reported_per_alias(setup_test_environment, tmp_path, monkeypatch, caplog):
+    """A failing or missing git merge-file fails only its own alias."""
+    from src_dotfiles import capture as cap
+
+    main_path = Path(config.project_path) / "test_dotfiles" / "capture_nogit"
+    main_path.write_text("alpha\n")
+    deploy_path = (tmp_path / "capture_nogit").absolute()
+    manager = ManageDotfiles()
+    manager.register("capture_nogit", str(deploy_path), main="test_dotfiles/capture_nogit")
+    deploy_path.unlink()
+    deploy_path.write_text("alpha\n")
+    manager.db.select_by_alias("capture_nogit").backup()  # the merge base
+    manager.db.save_all()
+    deploy_path.write_text("alpha, edited\n")
+
+    for error in (FileNotFoundError(2, "No such file or directory: 'git'"), RuntimeError("git merge-file failed: boom")):
+        def fail(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(cap.subprocess, "run", fail)
+        caplog.clear()
+        ManageDotfiles().capture(merge=True, promote=True)
+        assert f"capture_nogit: cannot merge: {error}" in caplog.text
+    assert main_path.read_text() == "alpha\n"
+    assert not deploy_path.is_symlink()
+    deploy_path.unlink()
+
 # -------------------------------- Device Tests ------------------------------- #
 
 @pytest.mark.run(order=13)
@@ -393,7 +1110,7 @@ def test_load_from_different_device(setup_test_environment):
         ), 
         identifier=new_identifier
     )
-    manager.db.data.append(other_dotfile)
+    manager.db.add_dotfile(other_dotfile)
     manager.db.save_all()
     
     # WHEN loading all dotfiles
@@ -408,6 +1125,95 @@ def test_load_from_different_device(setup_test_environment):
     assert translated.data.main.startswith(config.dotfiles_dir)
     assert len(translated.data.deploy[config.identifier].backups) == 0
 
+@pytest.mark.run(order=15)
+def test_indexed_lookups_follow_registry_changes(setup_test_environment):
+    """Alias and deploy-path indexes stay correct through add_dotfile, refresh and set_global."""
+    manager = ManageDotfiles()
+    dotfile = manager.db.select_by_alias("c_dotfile")
+    deploy_path = dotfile.data.deploy[dotfile.identifier].deploy_path
+    assert manager.db.select_by_deploy_path(deploy_path) is dotfile
+
+    # A duplicate alias is refused; replacing keeps the entry's position.
+    aliases = [d.alias for d in manager.db.data]
+    replacement = DotFile(dotfile.data, dotfile.identifier)
+    with pytest.raises(ValueError):
+        manager.db.add_dotfile(replacement)
+    manager.db.add_dotfile(replacement, replace=True)
+    assert [d.alias for d in manager.db.data] == aliases
+    assert manager.db.select_by_alias("c_dotfile") is replacement
+
+    # A dotfile restricted to another device shows up once made global.
+    manager.db.metadata.dotfiles["index_global"] = DotFileModel(
+        alias="index_global",
+        main="test_dotfiles/index_global",
+        deploy={"other_device": DeployedDotFile(deploy_path="/Users/other/.index_global")},
+        only_devices=["other_device"],
+    )
+    assert manager.db.refresh("index_global") is None
+    manager.set_global("index_global")
+    loaded = manager.db.select_by_alias("index_global")
+    assert loaded is not None and loaded.identifier == config.identifier
+    assert manager.db.select_by_deploy_path(f"{config.home}/.index_global") is loaded
+
+    # A removal followed by an insertion (same length) still updates both indexes.
+    other = DotFile(DotFileModel(alias="index_append", main="test_dotfiles/index_append",
+                                 deploy={config.identifier: DeployedDotFile(deploy_path="/tmp/index_append")}))
+    assert manager.db.remove_dotfile("index_global") is loaded
+    manager.db.add_dotfile(other)
+    assert manager.db.select_by_alias("index_global") is None
+    assert manager.db.select_by_deploy_path(f"{config.home}/.index_global") is None
+    assert manager.db.select_by_alias("index_append") is other
+    assert manager.db.select_by_deploy_path("/tmp/index_append") is other
+
+    del manager.db.metadata.dotfiles["index_global"]
+    manager.db.remove_dotfile("index_append")
+    manager.db.save_all()
+
+@pytest.mark.run(order=15)
+def test_translation_is_lazy_and_memoized(setup_test_environment, monkeypatch):
+    """Entries from other devices are only translated on first access, once."""
+    from src_dotfiles import DotFile as dotfile_mod
+
+    manager = ManageDotfiles()
+    manager.db.metadata.devices["lazy_device"] = DevicesData(
+        identifier="lazy_device", home_path="/home/lazy", dotfiles_dir_path="test_dotfiles")
+    for alias in ("lazy_a", "lazy_b"):
+        manager.db.metadata.dotfiles[alias] = DotFileModel(
+            alias=alias, main=f"test_dotfiles/{alias}",
+            deploy={"lazy_device": DeployedDotFile(deploy_path=f"/home/lazy/.{alias}")})
+    manager.db.save_all()
+
+    calls = []
+    original = dotfile_mod.DotFile.translate_to_device
+    def counting(self, original_device, target_device):
+        calls.append(self.data.alias)
+        return original(self, original_device, target_device)
+    monkeypatch.setattr(dotfile_mod.DotFile, "translate_to_device", counting)
+
+    db = ManageDotfiles().db
+    assert calls == []
+    lazy_a = db.select_by_alias("lazy_a")
+    assert lazy_a.alias == "lazy_a" and calls == []
+    assert lazy_a.data.deploy[config.identifier].deploy_path == f"{config.home}/.lazy_a"
+    assert calls == ["lazy_a"]
+
+    # Refreshing re-wraps the entry but reuses the memoized translation.
+    db.refresh("lazy_a")
+    assert db.select_by_alias("lazy_a").data is lazy_a.data
+    assert calls == ["lazy_a"]
+
+    # Saving only persists what was touched.
+    db.save_all()
+    saved = MetaDataDotFiles.model_validate_json(db.get_db_path().read_text())
+    assert config.identifier in saved.dotfiles["lazy_a"].deploy
+    assert config.identifier not in saved.dotfiles["lazy_b"].deploy
+
+    for alias in ("lazy_a", "lazy_b"):
+        del db.metadata.dotfiles[alias]
+        db.refresh(alias)
+    del db.metadata.devices["lazy_device"]
+    db.save_all()
+
 # ----------------------------- Variant Model Tests ----------------------------- #
 
 @pytest.mark.run(order=16)
@@ -451,7 +1257,7 @@ def test_metadata_version_field(setup_test_environment):
 
 @pytest.mark.run(order=19)
 def test_migration_from_meta3(setup_test_environment):
-    """Test that meta_3.json is auto-migrated to dotfiles.json with version 1."""
+    """Test that meta_3.json is auto-migrated to dotfiles.json with version 2."""
     import json
 
     # GIVEN a meta_3.json file exists and dotfiles.json does not
@@ -477,12 +1283,13 @@ def test_migration_from_meta3(setup_test_environment):
 
     # WHEN loading the database
     manager = ManageDotfiles()
+    manager.db  # the registry is loaded (and migrated) on first use
 
-    # THEN dotfiles.json should exist with version=1
+    # THEN dotfiles.json should exist with version=2
     assert dotfiles_json_path.exists()
     with open(dotfiles_json_path) as f:
         loaded = json.loads(f.read())
-    assert loaded["version"] == 1
+    assert loaded["version"] == 2
     assert "migration_test" in loaded["dotfiles"]
 
     # Clean up: remove the meta_3.json we created, restore dotfiles.json as primary
@@ -491,6 +1298,336 @@ def test_migration_from_meta3(setup_test_environment):
 
 # -------------------------- Only Devices Tests -------------------------- #
 
+@pytest.mark.run(order=19)
+def test_migration_to_v2_moves_backups_to_device_logs(setup_test_environment):
+    """v1 inline histories of this device move to history/<identifier>.jsonl; new backups only append.
+
+    Other devices' inline backups stay in dotfiles.json until that device migrates them itself.
+    """
+    import json
+    from src_dotfiles.history import HistoryLog, history_path
+
+    db_path = Path(config.project_path) / config.dotfiles_dir / "dotfiles.json"
+    raw = json.loads(db_path.read_text())
+    raw["version"] = 1
+    raw["dotfiles"]["v2_test"] = {
+        "alias": "v2_test",
+        "main": "test_dotfiles/v2_test",
+        "deploy": {
+            config.identifier: {"deploy_path": "data/test_data/v2_test", "backups": [
+                {"backup_path": "test_dotfiles/old/v2_test_mine", "datetime": "2024-01-01_00:00:00.000000"},
+            ]},
+            "other.device": {"deploy_path": "/home/other/v2_test", "backups": [
+                {"backup_path": "test_dotfiles/old/v2_test_other", "datetime": "2024-01-02_00:00:00.000000"},
+            ]},
+        },
+    }
+    db_path.write_text(json.dumps(raw))
+    mine = history_path(config.identifier)
+    other = history_path("other.device")
+    other.unlink(missing_ok=True)
+
+    manager = ManageDotfiles()
+    manager.db  # the registry is loaded (and migrated) on first use
+
+    saved = json.loads(db_path.read_text())
+    assert saved["version"] == 2
+    assert all(not m["deploy"][config.identifier]["backups"]
+               for m in saved["dotfiles"].values() if config.identifier in m["deploy"])
+    deploy = saved["dotfiles"]["v2_test"]["deploy"]
+    assert [b["backup_path"] for b in deploy["other.device"]["backups"]] == ["test_dotfiles/old/v2_test_other"]
+    backups = manager.db.select_by_alias("v2_test").data.deploy[config.identifier].backups
+    assert [b.backup_path for b in backups] == ["test_dotfiles/old/v2_test_mine"]
+    assert not other.exists()
+
+    # A new backup is one appended line, and dotfiles.json does not change
+    before_db, before_log = db_path.read_text(), mine.read_text()
+    Path("data/test_data/v2_test").write_text("v2 content")
+    manager.db.select_by_alias("v2_test").backup()
+    manager.db.save_all()
+    assert db_path.read_text() == before_db
+    assert mine.read_text().startswith(before_log) and len(mine.read_text().splitlines()) == len(before_log.splitlines()) + 1
+    assert len(ManageDotfiles().db.select_by_alias("v2_test").data.deploy[config.identifier].backups) == 2
+
+@pytest.mark.run(order=19)
+def test_history_append_after_torn_line(tmp_path):
+    """A record appended after a crash mid-line starts on its own line and is read back."""
+    from src_dotfiles.history import HistoryLog
+
+    log = HistoryLog(tmp_path / "device.jsonl")
+    first = BackupMetadata(backup_path="test_dotfiles/old/first", datetime="2024-01-01_00:00:00.000000")
+    log.append([("torn", first)])
+    with open(log.path, "a") as f:
+        f.write('{"alias": "torn", "backup": {"backup_pa')
+    second = BackupMetadata(backup_path="test_dotfiles/old/second", datetime="2024-01-02_00:00:00.000000")
+    log.append([("torn", second)])
+    assert log.load() == {"torn": [first, second]}
+
+@pytest.mark.run(order=19)
+def test_sqlite_storage_imports_and_exports_json(setup_test_environment, monkeypatch):
+    """DOTFILES_STORAGE=sqlite: filled from dotfiles.json on first use, exported back identically."""
+    from src_dotfiles.storage import JsonStorage, SqliteStorage, Storage
+
+    with pytest.raises(TypeError):
+        Storage()  # abstract
+    sqlite_path = Path(config.project_path) / config.dotfiles_dir / "registry.sqlite3"
+    sqlite_path.unlink(missing_ok=True)
+    json_registry = ManageDotfiles().db.metadata.model_dump()
+    monkeypatch.setitem(config, "storage", "sqlite")
+
+    manager = ManageDotfiles()
+    assert isinstance(manager.db.storage, SqliteStorage) and sqlite_path.exists()
+    assert manager.db.metadata.model_dump() == json_registry
+    assert manager.db.save_all() is False
+
+    dotfile = manager.db.data[0]
+    deploy_path = Path(dotfile.data.deploy[dotfile.identifier].deploy_path)
+    remove_file_if_exists(deploy_path)
+    deploy_path.write_text("backed up into sqlite")
+    dotfile.backup()
+    manager.db.metadata.devices["sqlite_device"] = DevicesData(
+        identifier="sqlite_device", home_path="/home/sq", dotfiles_dir_path="test_dotfiles")
+    assert manager.db.save_all() is True
+    manager.db.close()
+
+    reloaded = ManageDotfiles()
+    assert "sqlite_device" in reloaded.db.metadata.devices
+    backups = reloaded.db.select_by_alias(dotfile.data.alias).data.deploy[dotfile.identifier].backups
+    assert Path(backups[-1].backup_path).read_text() == "backed up into sqlite"
+
+    reloaded.export_json()
+    exported = JsonStorage(reloaded.db.get_db_path())
+    assert "sqlite_device" in exported.load().devices
+    assert exported.load_history(config.identifier)[dotfile.data.alias][-1].backup_path == backups[-1].backup_path
+    del reloaded.db.metadata.devices["sqlite_device"]
+    reloaded.db.save_all()
+    reloaded.export_json()
+
+    # import-json replaces the SQLite histories: a device only SQLite knows is dropped
+    stale = BackupMetadata(backup_path="test_dotfiles/old/stale", datetime="2024-01-01_00:00:00.000000")
+    reloaded.db.storage.save_history("stale.device", {dotfile.data.alias: [stale]})
+    assert "stale.device" in reloaded.db.storage.history_identifiers()
+    reloaded.import_json()
+    assert "stale.device" not in SqliteStorage(sqlite_path).history_identifiers()
+    remove_file_if_exists(deploy_path)
+
+FAKE_SSH = """#!{python}
+import subprocess, sys
+args, options = sys.argv[1:], []
+while args[0].startswith("-"):
+    options += [args.pop(0), args.pop(0)]
+with open({log!r}, "a") as f:
+    f.write(" ".join(["ssh", *options, *args[:1]]) + "\\n")
+if "-O" in options:
+    sys.exit(0)
+sys.exit(subprocess.call(["sh", "-c", " ".join(args[1:])]))
+"""
+
+FAKE_RSYNC = """#!{python}
+import os, shutil, sys
+src, dest = sys.argv[-2], sys.argv[-1].split(":", 1)[1]
+rels = sys.stdin.read().split()
+with open({log!r}, "a") as f:
+    f.write(f"rsync {{len(rels)}}\\n")
+for rel in rels:
+    os.makedirs(os.path.dirname(os.path.join(dest, rel)), exist_ok=True)
+    shutil.copy2(os.path.join(src, rel), os.path.join(dest, rel))
+"""
+
+FAKE_REMOTE_PYTHON = """#!/bin/sh
+echo "python $1" >> {log!r}
+[ "$1" = "-c" ] && exec {python} "$@"
+echo "remote args: $*"
+echo "deploy summary: 2 created, 1 already correct, 0 failed"
+"""
+
+@pytest.mark.run(order=12)
+def test_deploy_hosts_pushes_only_changed_files(setup_test_environment, tmp_path, monkeypatch):
+    """deploy --hosts reuses one ControlMaster per host, rsyncs only differing files, merges summaries."""
+    import sys
+    from src_dotfiles.fanout import fan_out, needed_files, remote_project_path
+
+    log = tmp_path / "calls.log"
+    for name, template in (("ssh", FAKE_SSH), ("rsync", FAKE_RSYNC), ("python", FAKE_REMOTE_PYTHON)):
+        shim = tmp_path / f"fake-{name}"
+        shim.write_text(template.format(python=sys.executable, log=str(log)))
+        shim.chmod(0o755)
+    monkeypatch.setenv("DOTFILES_SSH", str(tmp_path / "fake-ssh"))
+    monkeypatch.setenv("DOTFILES_RSYNC", str(tmp_path / "fake-rsync"))
+    monkeypatch.setenv("DOTFILES_REMOTE_PYTHON", str(tmp_path / "fake-python"))
+
+    device = DevicesData(identifier="fanout.tester", home_path=str(tmp_path / "home"),
+                         dotfiles_dir_path="dotfiles", ssh_host="fakehost")
+    remote_dotfiles = Path(remote_project_path(device)) / "dotfiles"
+    remote_dotfiles.mkdir(parents=True)
+    manager = ManageDotfiles()
+    metadata = manager.db.metadata
+    needed = needed_files(metadata, device)
+    assert needed[0] == "dotfiles.json"
+
+    results = fan_out(metadata, [device], jobs=2, args=["--transactional"])
+    name, outcome, pushed, summary = results[0]
+    assert (name, outcome, summary) == ("fanout.tester", "ok", "2 created, 1 already correct, 0 failed")
+    assert pushed >= len(needed)
+    local_dotfiles = Path(config.project_path) / config.dotfiles_dir
+    for rel in needed:
+        if (local_dotfiles / rel).is_file():
+            assert (remote_dotfiles / rel).read_bytes() == (local_dotfiles / rel).read_bytes()
+
+    # Nothing changed: hashes match, nothing is pushed
+    assert fan_out(metadata, [device], jobs=1, args=[])[0][2] == 0
+
+    main = local_dotfiles / needed[1]
+    original = main.read_text()
+    main.write_text(original + "edited\n")
+    try:
+        assert fan_out(metadata, [device], jobs=1, args=[])[0][2] == 1
+    finally:
+        main.write_text(original)
+
+    calls = log.read_text().splitlines()
+    ssh_calls = [c for c in calls if c.startswith("ssh")]
+    assert all("ControlMaster=auto" in c and "ControlPath=" in c for c in ssh_calls)
+    assert sum("-O exit" in c for c in ssh_calls) == 3
+    # The remote hashing runs with DOTFILES_REMOTE_PYTHON too, not a hard-coded python3
+    assert [c for c in calls if c.startswith("python")] == ["python -c", "python -m"] * 3
+    assert [c for c in calls if c.startswith("rsync")][1:] == ["rsync 1"]
+
+    # dotfiles.json edited on the host since the last push: refused, unless overwrite_registry
+    remote_registry = remote_dotfiles / needed[0]
+    remote_registry.write_text(remote_registry.read_text() + "\n")
+    name, outcome, pushed, detail = fan_out(metadata, [device], jobs=1, args=[])[0]
+    assert (outcome, pushed) == ("failed", 0) and "changed on the host" in detail
+    assert remote_registry.read_bytes() != (local_dotfiles / needed[0]).read_bytes()
+    assert fan_out(metadata, [device], jobs=1, args=[], overwrite_registry=True)[0][1] == "ok"
+    assert remote_registry.read_bytes() == (local_dotfiles / needed[0]).read_bytes()
+
+    # Through the CLI, a device can be named by its ssh_host
+    manager.db.metadata.devices["fanout.tester"] = device
+    manager.deploy(hosts="fakehost")
+    last = log.read_text().splitlines()[-1]
+    assert last.startswith("ssh") and "-O exit" in last and last.endswith("fakehost")
+    del manager.db.metadata.devices["fanout.tester"]
+
+@pytest.mark.run(order=19)
+def test_deploy_hosts_exports_the_sqlite_registry_first(setup_test_environment, monkeypatch):
+    """With DOTFILES_STORAGE=sqlite, dotfiles.json is exported before it is pushed."""
+    from src_dotfiles import fanout
+    from src_dotfiles.storage import JsonStorage
+
+    monkeypatch.setitem(config, "storage", "sqlite")
+    manager = ManageDotfiles()
+    manager.db.metadata.devices["fanout.sqlite"] = DevicesData(
+        identifier="fanout.sqlite", home_path="/home/fs", dotfiles_dir_path="test_dotfiles", ssh_host="fs")
+    manager.db.save_all()
+    pushed = []
+    monkeypatch.setattr(fanout, "fan_out", lambda metadata, devices, jobs, args, alias, **kwargs: pushed.append(
+        JsonStorage(manager.db.get_db_path()).load().devices) or [])
+    manager.deploy(hosts="fs")
+    assert "fanout.sqlite" in pushed[0]
+
+    del manager.db.metadata.devices["fanout.sqlite"]
+    manager.db.save_all()
+    manager.export_json()
+    manager.db.close()
+
+@pytest.mark.run(order=12)
+def test_template_render_syntax():
+    """{{ var }} substitution, if/elif/else on device variables, block lines leave no blank line."""
+    from src_dotfiles.template import TemplateError, render
+
+    text = (
+        "export HOME_DIR={{ home_path }}\n"
+        "{% if identifier == \"TheBeast.ezalos\" %}\n"
+        "export GPU=1\n"
+        "{% elif not laptop %}\n"
+        "export GPU=0\n"
+        "{% else %}\n"
+        "export BATTERY=1\n"
+        "{% endif %}\n"
+        "done{% if laptop %} (laptop){% endif %}\n"
+    )
+    assert render(text, {"home_path": "/home/a", "identifier": "TheBeast.ezalos", "laptop": False}) == \
+        "export HOME_DIR=/home/a\nexport GPU=1\ndone\n"
+    assert render(text, {"home_path": "/Users/a", "identifier": "mbp", "laptop": True}) == \
+        "export HOME_DIR=/Users/a\nexport BATTERY=1\ndone (laptop)\n"
+    with pytest.raises(TemplateError, match="undefined variable 'home_path'"):
+        render(text, {"identifier": "x", "laptop": True})
+    with pytest.raises(TemplateError, match="unclosed"):
+        render("{% if a %}x", {"a": 1})
+
+@pytest.mark.run(order=12)
+def test_template_system_is_the_devices_own():
+    """`system` comes from the device's recorded data and stays undefined when unknown."""
+    from src_dotfiles.template import TemplateError, device_variables, render
+
+    mac = DevicesData(identifier="mbp", home_path="/Users/a", dotfiles_dir_path="/Users/a/dotfiles", system="Darwin")
+    unknown = DevicesData(identifier="box", home_path="/home/a", dotfiles_dir_path="/home/a/dotfiles")
+    assert device_variables(mac)["system"] == "Darwin"
+    assert "system" not in device_variables(unknown)
+    with pytest.raises(TemplateError, match="undefined variable 'system'"):
+        render("{{ system }}", device_variables(unknown))
+
+@pytest.mark.run(order=12)
+def test_template_dotfile_deploys_rendered_copy(setup_test_environment):
+    """A templated main is rendered per device into the cache, re-rendered only when it changes."""
+    deploy_path = setup_test_environment["TEST_DATA_TMP"] / "templated_rc"
+    remove_file_if_exists(deploy_path)
+    deploy_path.write_text("home={{ home_path }}\n{% if system == \"Plan9\" %}\nglenda\n{% endif %}\nid={{ identifier }}\n")
+    manager = ManageDotfiles()
+    manager.add(path=deploy_path.as_posix(), alias="templated_rc")
+    manager.set_template("templated_rc")
+    manager.deploy(alias="templated_rc")
+
+    dotfile = ManageDotfiles().db.select_by_alias("templated_rc")
+    rendered = Path(config.project_path) / config.dotfiles_dir / "rendered" / config.identifier / "templated_rc"
+    assert os.path.realpath(deploy_path) == rendered.as_posix()
+    assert deploy_path.read_text() == f"home={config.home}\nid={config.identifier}\n"
+
+    # Unchanged template and variables: the cached render is reused as is
+    mtime = rendered.stat().st_mtime_ns
+    time.sleep(0.01)
+    assert dotfile.source_path() == rendered.as_posix()
+    assert rendered.stat().st_mtime_ns == mtime
+
+    main = Path(config.project_path) / dotfile.data.main
+    main.write_text(main.read_text() + "edited={{ dotfiles_dir_path }}\n")
+    assert dotfile.source_path() == rendered.as_posix()
+    assert deploy_path.read_text().endswith(f"edited={config.dotfiles_dir}\n")
+
+@pytest.mark.run(order=12)
+def test_template_errors_are_reported_per_entry_without_rendering(setup_test_environment, capsys):
+    """status/plan never write the render cache, and a broken template only fails its own entry."""
+    deploy_path = setup_test_environment["TEST_DATA_TMP"] / "broken_rc"
+    remove_file_if_exists(deploy_path)
+    deploy_path.write_text("id={{ identifier }}\n")
+    manager = ManageDotfiles()
+    manager.add(path=deploy_path.as_posix(), alias="broken_rc")
+    manager.set_template("broken_rc")
+    manager.deploy(alias="broken_rc")
+    rendered = Path(config.project_path) / config.dotfiles_dir / "rendered" / config.identifier / "broken_rc"
+    main = Path(config.project_path) / manager.db.select_by_alias("broken_rc").data.main
+    before = rendered.read_text()
+    main.write_text("id={{ nowhere }}\n")
+    capsys.readouterr()
+
+    ManageDotfiles().status()
+    ManageDotfiles().plan()
+    out = capsys.readouterr().out
+    assert "ok                broken_rc" in out  # the link itself still points at the render
+    assert "error         broken_rc" in out
+    assert rendered.read_text() == before
+
+    # set_template checks every variant too
+    manager = ManageDotfiles()
+    manager.set_template("broken_rc", template=False)
+    main.write_text("id={{ identifier }}\n")
+    variant = main.with_name("broken_rc_variant")
+    variant.write_text("{% if %}\n")
+    manager.db.metadata.dotfiles["broken_rc"].variants = {"other.device": variant.relative_to(config.project_path).as_posix()}
+    manager.set_template("broken_rc")
+    assert not ManageDotfiles().db.metadata.dotfiles["broken_rc"].template
+
 @pytest.mark.run(order=20)
 def test_only_devices_skip(setup_test_environment):
     """Dotfile with only_devices excluding current device is skipped."""
@@ -658,7 +1795,7 @@ def test_variant_fallback(setup_test_environment):
 
 @pytest.mark.run(order=24)
 def test_translate_preserves_only_devices_and_variants(setup_test_environment):
-    """Test that translate_to_device preserves only_devices and variants."""
+    """Test that translate_to_device preserves only_devices, variants and the farm/template flags."""
     model = DotFileModel(
         alias="translate_test",
         main="test_dotfiles/translate_test",
@@ -669,7 +1806,9 @@ def test_translate_preserves_only_devices_and_variants(setup_test_environment):
             )
         },
         only_devices=[config.identifier, "target_device"],
-        variants={config.identifier: "test_dotfiles/translate_test.current"}
+        variants={config.identifier: "test_dotfiles/translate_test.current"},
+        farm=True,
+        template=True,
     )
     dotfile = DotFile(model, config.identifier)
 
@@ -682,6 +1821,8 @@ def test_translate_preserves_only_devices_and_variants(setup_test_environment):
     translated = dotfile.translate_to_device(config.device_data, target_device)
     assert translated.data.only_devices == [config.identifier, "target_device"]
     assert translated.data.variants == {config.identifier: "test_dotfiles/translate_test.current"}
+    assert translated.data.farm
+    assert translated.data.template
 
 
 # ----------------------------- CLI Add --only-device Tests ----------------------------- #
@@ -715,6 +1856,56 @@ def test_add_with_only_device(setup_test_environment):
         main_path.unlink()
 
 
+@pytest.mark.run(order=25)
+def test_add_many_and_register_many_save_once(setup_test_environment, monkeypatch):
+    """Batch commands report per-entry outcomes and write the registry a single time."""
+    import json
+
+    tmp_dir = setup_test_environment['TEST_DATA_TMP']
+    first, second = tmp_dir / "batch_first", tmp_dir / "batch_second"
+    first.write_text("first")
+    second.write_text("second")
+    manifest = tmp_dir / "batch.json"
+    manifest.write_text(json.dumps([
+        str(first),
+        {"path": str(second), "alias": "batch_second_alias"},
+        {"path": str(second), "alias": "batch_second_alias"},  # duplicate -> skipped
+        {"path": str(tmp_dir / "batch_first"), "bogus": True},  # bad entry -> failed
+    ]))
+
+    manager = ManageDotfiles()
+    saves = []
+    original_save = manager.db.save_all
+    monkeypatch.setattr(manager.db, "save_all", lambda: saves.append(1) or original_save())
+    outcomes = manager.add_many(str(manifest))
+
+    assert outcomes[str(first)] == "added batch_first"
+    assert outcomes[str(second)] == "added batch_second_alias"
+    assert outcomes[f"{second} (#2)"] == "skipped"
+    assert outcomes[f"{first} (#3)"].startswith("failed")
+    assert len(saves) == 1
+    assert first.is_symlink() and second.is_symlink()
+    reloaded = ManageDotfiles().db
+    assert reloaded.select_by_alias("batch_first") is not None
+    assert reloaded.select_by_alias("batch_second_alias") is not None
+
+    main_path = Path(config.project_path) / "test_dotfiles" / "batch_registered"
+    main_path.write_text("registered in place")
+    manifest.write_text(json.dumps([
+        {"alias": "batch_registered", "deploy_path": str((tmp_dir / "batch_registered").absolute())},
+        {"alias": "batch_missing", "deploy_path": str((tmp_dir / "batch_missing").absolute())},
+    ]))
+    outcomes = ManageDotfiles().register_many(str(manifest))
+    assert outcomes == {"batch_registered": "registered", "batch_missing": "skipped"}
+    assert (tmp_dir / "batch_registered").is_symlink()
+
+    # A plain file (no .json/.yaml/.yml suffix) is one entry, not a manifest
+    single = tmp_dir / ".batch_single"
+    single.write_text("export SINGLE=1\n")
+    assert ManageDotfiles().add_many(str(single)) == {str(single.absolute()): "added .batch_single"}
+    with pytest.raises(ValueError):
+        ManageDotfiles().register_many(str(single))
+
 # ----------------------- Real meta_3.json Migration Tests ----------------------- #
 
 @pytest.mark.run(order=26)
@@ -737,12 +1928,13 @@ def test_migration_from_real_meta3(setup_test_environment):
 
     # WHEN loading the database (triggers migration from meta_3.json)
     manager = ManageDotfiles()
+    manager.db  # the registry is loaded (and migrated) on first use
 
-    # THEN dotfiles.json should be created with version 1
+    # THEN dotfiles.json should be created with version 2
     assert test_dotfiles_json.exists()
     with open(test_dotfiles_json) as f:
         loaded = json.loads(f.read())
-    assert loaded["version"] == 1
+    assert loaded["version"] == 2
 
     # All 18 dotfiles from meta_3.json should be present in the migrated data
     assert len(loaded["dotfiles"]) >= 18